@@ -1,8 +1,43 @@
 from flask import abort, Blueprint, jsonify, request
 from datetime import datetime
 from db import db
-from models import Actor
+from models import Actor, Movie
 from auth import requires_auth
+from bulk import (
+    batch_errors_response,
+    bulk_delete,
+    bulk_insert,
+    bulk_update,
+    ensure_object,
+    find_duplicates,
+    find_missing,
+    get_by_ids,
+    get_batch,
+    validate_batch,
+    validate_id,
+)
+from cache import get_entity, get_updated_at
+from coalescing import coalesce_read
+from filters import filter_query
+from pagination import get_page_args, get_sort, paginate, with_sort_field
+from replicas import read_only
+from search import get_search_query, search
+from serialization import format_row, row_query
+from projection import (
+    get_fields,
+    get_includes,
+    include_relations,
+    project,
+)
+from streaming import stream_ndjson, wants_ndjson
+from request_logging import log_error
+from conditional import (
+    entity_validators,
+    is_conditional,
+    list_validators,
+    not_modified,
+    set_validators,
+)
 
 
 actors_blueprint = Blueprint(
@@ -11,23 +46,134 @@ actors_blueprint = Blueprint(
 )
 
 
+def parse_birthdate(birthdate):
+    """Returns the date of an ISO formatted birthdate, or raises ValueError"""
+    if not isinstance(birthdate, str):
+        raise ValueError('Invalid birthdate')
+    try:
+        return datetime.fromisoformat(birthdate).date()
+    except ValueError:
+        raise ValueError('Invalid birthdate')
+
+
+def validate_actor(item, partial: bool = False):
+    """Returns the column values of a batch item, or raises ValueError"""
+    ensure_object(item)
+    row = {}
+    if 'name' in item:
+        if not isinstance(item['name'], str) or not item['name']:
+            raise ValueError('Invalid name')
+        row['name'] = item['name']
+    if 'birthdate' in item:
+        row['birthdate'] = parse_birthdate(item['birthdate'])
+    if partial and not row:
+        raise ValueError('name or birthdate is required')
+    if not partial and len(row) != 2:
+        raise ValueError('name and birthdate are required')
+    return row
+
+
+def validate_actor_update(item):
+    """Returns the id and column values of a batch update item"""
+    row = validate_actor(item, partial=True)
+    row['id'] = validate_id(item.get('id'))
+    return row
+
+
 @actors_blueprint.route('/actors', methods=['GET'])
 @requires_auth(permission='get:actors')
+@read_only
 def get_actors(self):
-    """Handles GET requests for all available actors."""
+    """Handles GET requests for a page of available actors, filtered and
+    sorted as requested (see filters.py and pagination.get_sort).
+
+    Streams every actor as NDJSON instead when asked to (see streaming.py).
+    """
     try:
-        print('Request - [GET] /actors')
-        actors = Actor.query.all()
-        return jsonify({
+        limit, cursor, offset = get_page_args(request.args)
+        sort = get_sort(request.args, Actor)
+        fields = get_fields(request.args, Actor)
+        include = get_includes(request.args, Actor)
+
+        # answer conditional requests before loading any rows
+        etag, last_modified = list_validators(Actor, include)
+        response = not_modified(etag, last_modified)
+        if response:
+            return response
+
+        query = filter_query(Actor.query, Actor, request.args)
+        if include:
+            query = project(query, Actor, with_sort_field(fields, sort))
+            query = include_relations(query, Actor, include)
+        else:
+            # plain rows, skipping the ORM objects
+            query = row_query(query, Actor, fields, sort)
+        if wants_ndjson(request):
+            response = stream_ndjson(
+                query, Actor, cursor=cursor, fields=fields, include=include,
+                sort=sort)
+            response = set_validators(response, etag, last_modified)
+        else:
+            def load_page():
+                actors, next_cursor = paginate(
+                    query, Actor, limit, cursor=cursor, offset=offset,
+                    sort=sort)
+                return {
+                    'success': True,
+                    'actors': [
+                        format_row(actor, Actor, fields, include)
+                        for actor in actors
+                    ],
+                    'next_cursor': next_cursor,
+                }, (etag, last_modified)
+
+            # identical concurrent requests share the page (see coalescing.py)
+            response = coalesce_read(load_page, version=etag)
+        response.vary.add('Accept')
+        return response, 200
+    except Exception as e:
+        log_error(e)
+        code = getattr(e, 'code', 500)
+        abort(code)
+    finally:
+        db.session.close()
+
+
+@actors_blueprint.route('/actors/search', methods=['GET'])
+@requires_auth(permission='get:actors')
+@read_only
+def search_actors(self):
+    """Handles GET requests searching the names of actors.
+
+    Results are ranked by relevance, and paginated by offset.
+    """
+    try:
+        q = get_search_query(request.args)
+        limit, cursor, offset = get_page_args(request.args)
+        if cursor is not None:
+            abort(400)
+        fields = get_fields(request.args, Actor)
+        include = get_includes(request.args, Actor)
+
+        etag, last_modified = list_validators(Actor, include)
+        response = not_modified(etag, last_modified)
+        if response:
+            return response
+
+        actors, next_offset = search(
+            Actor, q, limit, offset or 0, fields=fields, include=include)
+        response = jsonify({
             'success': True,
-            'actors': [actor.format() for actor in actors]
-        }), 200
+            'actors': [actor.format(fields, include) for actor in actors],
+            'next_offset': next_offset,
+        })
+        return set_validators(response, etag, last_modified), 200
     except Exception as e:
-        print('Error - [GET] /actors', e)
+        log_error(e)
         code = getattr(e, 'code', 500)
         abort(code)
     finally:
-        db.session.close
+        db.session.close()
 
 
 @actors_blueprint.route('/actors', methods=['POST'])
@@ -35,14 +181,19 @@ def get_actors(self):
 def create_actor(self):
     """Handles POST requests to create a new actor"""
     try:
-        print('Request - [POST] /actors')
         body = request.get_json()
 
         required_attrs = ('name', 'birthdate')
         if not all(attr in body for attr in required_attrs):
             abort(400)
 
-        actor = Actor(name=body['name'], birthdate=body['birthdate'])
+        try:
+            birthdate = parse_birthdate(body['birthdate'])
+        except ValueError as e:
+            log_error(e)
+            abort(422, 'Invalid birthdate')
+
+        actor = Actor(name=body['name'], birthdate=birthdate)
 
         # add and commit
         actor.insert()
@@ -52,7 +203,7 @@ def create_actor(self):
             'actor': actor.format()
         }), 200
     except Exception as e:
-        print('Error - [POST] /actors', e)
+        log_error(e)
         code = getattr(e, 'code', 500)
         abort(code)
     finally:
@@ -61,21 +212,42 @@ def create_actor(self):
 
 @actors_blueprint.route('/actors/<int:actor_id>', methods=['GET'])
 @requires_auth(permission='get:actors')
+@read_only
 def get_actor(self, actor_id: int):
     """Handles GET requests for a single actor"""
     try:
-        print('Request - [GET] /actors/<int:actor_id>')
-        actor = Actor.query.get(actor_id)
+        fields = get_fields(request.args, Actor)
+        include = get_includes(request.args, Actor)
 
-        if not actor:
+        # answer conditional requests from the updated_at column alone
+        if is_conditional(request):
+            updated_at = get_updated_at(Actor, actor_id)
+            if updated_at is None:
+                abort(404)
+            response = not_modified(*entity_validators(
+                Actor, actor_id, updated_at, fields, include))
+            if response:
+                return response
+
+        def load_actor():
+            entity = get_entity(Actor, actor_id, fields, include)
+            if not entity:
+                return None
+            actor, updated_at = entity
+            return {
+                'success': True,
+                'actor': actor,
+            }, entity_validators(Actor, actor_id, updated_at, fields, include)
+
+        # identical concurrent requests share the actor (see coalescing.py)
+        response = coalesce_read(load_actor)
+
+        if response is None:
             abort(404)
 
-        return jsonify({
-            'success': True,
-            'actor': actor.format(),
-        }), 200
+        return response, 200
     except Exception as e:
-        print('Error - [GET] /actors/<int:actor_id>', e)
+        log_error(e)
         code = getattr(e, 'code', 500)
         abort(code)
     finally:
@@ -87,7 +259,6 @@ def get_actor(self, actor_id: int):
 def update_actor(self, actor_id: int):
     """Handles PATCH requests to update existing actors in the database"""
     try:
-        print('Request - [PATCH] /actors/<int:actor_id>')
         actor = Actor.query.get(actor_id)
 
         if not actor:
@@ -99,14 +270,14 @@ def update_actor(self, actor_id: int):
             actor.name = body['name']
 
         if 'birthdate' in body:
-            birthdate = body['birthdate']
             try:
-                birthdate = datetime.fromisoformat(birthdate)
-            except Exception as e:
-                print('Error - [PATCH] /actors/<int:actor_id>', e)
+                actor.birthdate = parse_birthdate(body['birthdate'])
+            except ValueError as e:
+                log_error(e)
                 abort(422, 'Invalid birthdate')
 
-        actor.birthdate = body['birthdate']
+        if 'movie_ids' in body:
+            actor.movies = get_by_ids(Movie, body['movie_ids'])
 
         # commit changes
         actor.update()
@@ -116,7 +287,7 @@ def update_actor(self, actor_id: int):
             'actor': actor.format()
         }), 200
     except Exception as e:
-        print('Error - [PATCH] /actors/<int:actor_id>', e)
+        log_error(e)
         code = getattr(e, 'code', 500)
         abort(code)
     finally:
@@ -128,7 +299,6 @@ def update_actor(self, actor_id: int):
 def delete_actor(self, actor_id: int):
     """Handles DELETE requests to remove existing actors in the database"""
     try:
-        print('Request - [PATCH] /actors/<int:actor_id>')
 
         actor = Actor.query.get(actor_id)
 
@@ -143,7 +313,92 @@ def delete_actor(self, actor_id: int):
             'removed': actor_id
         })
     except Exception as e:
-        print('Error - [PATCH] /actors/<int:actor_id>', e)
+        log_error(e)
+        code = getattr(e, 'code', 500)
+        abort(code)
+    finally:
+        db.session.close()
+
+
+@actors_blueprint.route('/actors/bulk', methods=['POST'])
+@requires_auth(permission='post:actors')
+def create_actors(self):
+    """Handles POST requests to create a batch of actors in one transaction"""
+    try:
+        items = get_batch(request.get_json(), 'actors')
+        rows, errors = validate_batch(items, validate_actor)
+        if errors:
+            return batch_errors_response(errors)
+
+        # add and commit
+        ids = bulk_insert(Actor, rows)
+
+        return jsonify({
+            'success': True,
+            'created': ids
+        }), 200
+    except Exception as e:
+        log_error(e)
+        code = getattr(e, 'code', 500)
+        abort(code)
+    finally:
+        db.session.close()
+
+
+@actors_blueprint.route('/actors/bulk', methods=['PATCH'])
+@requires_auth(permission='patch:actors')
+def update_actors(self):
+    """Handles PATCH requests to update a batch of actors in one transaction"""
+    try:
+        items = get_batch(request.get_json(), 'actors')
+        rows, errors = validate_batch(items, validate_actor_update)
+        if errors:
+            return batch_errors_response(errors)
+
+        ids = [row['id'] for row in rows]
+        errors = find_duplicates(ids) or find_missing(Actor, ids)
+        if errors:
+            return batch_errors_response(errors)
+
+        # commit changes
+        bulk_update(Actor, rows)
+
+        return jsonify({
+            'success': True,
+            'updated': ids
+        }), 200
+    except Exception as e:
+        log_error(e)
+        code = getattr(e, 'code', 500)
+        abort(code)
+    finally:
+        db.session.close()
+
+
+@actors_blueprint.route('/actors/bulk', methods=['DELETE'])
+@requires_auth(permission='delete:actors')
+def delete_actors(self):
+    """Handles DELETE requests to remove a batch of actors in one
+    transaction"""
+    try:
+        items = get_batch(request.get_json(), 'ids')
+        ids, errors = validate_batch(items, validate_id)
+        if errors:
+            return batch_errors_response(errors)
+
+        errors = find_duplicates(ids) or find_missing(Actor, ids)
+        if errors:
+            return batch_errors_response(errors)
+
+        # remove and commit
+        bulk_delete(Actor, ids)
+
+        return jsonify({
+            'success': True,
+            'removed': ids
+        }), 200
+    except Exception as e:
+        log_error(e)
         code = getattr(e, 'code', 500)
         abort(code)
     finally:
@@ -1,18 +1,26 @@
 from flask import Flask
-from flask_cors import CORS
-from flask_migrate import Migrate
 from db import get_db_path
 from init import init_app
 from dotenv import load_dotenv
 
 def create_app():
+    """App factory, called by `flask run` and by each gunicorn worker (or
+    once, by the gunicorn master, with preload_app: see gunicorn.conf.py)"""
     db_path = get_db_path()
     app = Flask(__name__)
     init_app(app=app, db_path=db_path)
     return app
 
-app = create_app()
+
+def __getattr__(name):
+    # `gunicorn app:app` (and other servers importing a module level app)
+    # get an app built on first access, so importing app.py builds nothing
+    if name == 'app':
+        global app
+        app = create_app()
+        return app
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
 if __name__ == '__main__':
     load_dotenv()
-    app.run(host='0.0.0.0', port=8080, debug=True)
+    create_app().run(host='0.0.0.0', port=8080, debug=True)
@@ -0,0 +1,336 @@
+"""ASGI entry point, serving the hot reads on asyncio.
+
+Run with `uvicorn --factory asgi:create_asgi_app` (see README).
+"""
+import asyncio
+import logging
+import re
+import time
+from os import getenv
+from flask import Flask
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from werkzeug.datastructures import Headers
+from werkzeug.exceptions import NotFound
+from werkzeug.http import http_date, quote_etag
+from werkzeug.sansio.request import Request
+from auth import (
+    AuthError,
+    enforce_rate_limit,
+    ensure_permissions_claim,
+    get_permission_mask,
+    get_verified_payload,
+    parse_auth_header,
+    raise_missing_permission,
+    RateLimitError,
+)
+from compression import compress, compression_stats, get_encoding, MIN_SIZE
+from conditional import as_utc, entity_validators, is_conditional, make_etag
+from db import get_db_path, get_engine_options
+from filters import filter_query
+from init import init_app
+from instrumentation import metrics
+from models import Actor, Movie, TableVersion
+from pagination import (
+    get_page_args,
+    get_sort,
+    next_page,
+    page_query,
+    with_sort_field,
+)
+from projection import get_fields
+from serialization import FastJSONProvider
+from streaming import wants_ndjson
+from token_cache import token_cache
+
+try:
+    from asgiref.wsgi import WsgiToAsgi
+except ImportError:  # optional, see README
+    WsgiToAsgi = None
+
+
+logger = logging.getLogger('castingagency.asgi')
+
+# the async driver of each dialect
+ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite',
+}
+
+# the reads served natively: (path, model, singular name, permission mask)
+NATIVE_ROUTES = tuple(
+    (
+        re.compile(rf'/{model.__tablename__}(?:/(\d+))?'),
+        model,
+        name,
+        get_permission_mask((f'get:{model.__tablename__}',), register=True),
+    )
+    for model, name in ((Actor, 'actor'), (Movie, 'movie'))
+)
+
+# messages of the error responses, like the Flask app's (see errors.py)
+ERROR_MESSAGES = {
+    400: 'malformed',
+    404: 'unreachable',
+    422: 'unprocessable',
+    500: 'internal_server_error',
+}
+
+
+def get_async_db_url(db_path: str):
+    """Returns the url of a database through its dialect's async driver"""
+    dialect, _, location = db_path.partition('://')
+    dialect = dialect.split('+')[0]
+    if dialect not in ASYNC_DRIVERS:
+        raise ValueError(f'No async driver for {dialect}')
+    return f'{ASYNC_DRIVERS[dialect]}://{location}'
+
+
+def get_async_engine_options(db_path: str):
+    """Returns the engine options of the async engine: the pool settings of
+    the sync engine, on the async driver's pool"""
+    options = get_engine_options(db_path)
+    options.pop('poolclass', None)
+    connect_args = options.pop('connect_args', {})
+    if 'connect_timeout' in connect_args:
+        # asyncpg's name for it
+        options['connect_args'] = {'timeout': connect_args['connect_timeout']}
+    return options
+
+
+def make_request(scope):
+    """Returns the request of an ASGI http scope"""
+    headers = Headers([
+        (name.decode('latin-1'), value.decode('latin-1'))
+        for name, value in scope['headers']
+    ])
+    client = scope.get('client')
+    return Request(
+        method=scope['method'],
+        scheme=scope.get('scheme', 'http'),
+        server=scope.get('server'),
+        root_path=scope.get('root_path', ''),
+        path=scope['path'],
+        query_string=scope['query_string'],
+        headers=headers,
+        remote_addr=client[0] if client else None,
+    )
+
+
+def serves_natively(request):
+    """Checks whether a read is served natively. Relationships, streams and
+    conditional requests are left to the Flask app"""
+    return request.method == 'GET' \
+        and 'include' not in request.args \
+        and not wants_ndjson(request) \
+        and not is_conditional(request)
+
+
+'''Return the verified payload of a request, if it has the permissions.
+
+    @INPUTS
+        request: the request
+        required_mask: the bitmask of the required permissions
+
+    Tokens are served from the verified-token cache without blocking. Others
+    are verified in a thread, since fetching the signing keys of a rotated
+    kid blocks on the network, so the event loop keeps serving meanwhile.
+'''
+
+
+async def authorize(request, required_mask: int):
+    token = parse_auth_header(request.headers.get('Authorization'))
+    payload = token_cache.get(token)
+    if payload is None:
+        payload = await asyncio.to_thread(get_verified_payload, token)
+    ensure_permissions_claim(payload)
+    enforce_rate_limit(payload)
+    if not payload.has_permissions(required_mask):
+        raise_missing_permission()
+    return payload
+
+
+class AsyncApp():
+    """ASGI app serving the actor and movie reads on asyncio, through an
+    async engine, and every other request through the Flask app (in a
+    thread pool)"""
+
+    def __init__(self, flask_app, engine):
+        self.flask_app = flask_app
+        self.engine = engine
+        self.sessions = sessionmaker(
+            engine, class_=AsyncSession, expire_on_commit=False)
+        self.json = FastJSONProvider(flask_app)
+        self.wsgi = WsgiToAsgi(flask_app)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] == 'http':
+            for pattern, model, name, required_mask in NATIVE_ROUTES:
+                match = pattern.fullmatch(scope['path'])
+                if match is None:
+                    continue
+                request = make_request(scope)
+                if serves_natively(request):
+                    id = match.group(1)
+                    return await self.handle(
+                        request, send, model, name, required_mask,
+                        None if id is None else int(id))
+                break
+        await self.wsgi(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.engine.dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def handle(self, request, send, model, name: str,
+                     required_mask: int, id: int = None):
+        started = time.perf_counter()
+        timings = {}
+        headers = {}
+        try:
+            await authorize(request, required_mask)
+            async with self.sessions() as session:
+                db_started = time.perf_counter()
+                if id is None:
+                    body, headers = await self.list_entities(
+                        session, request, model)
+                else:
+                    body, headers = await self.get_entity(
+                        session, request, model, name, id)
+                timings['db'] = time.perf_counter() - db_started
+            status = 200
+        except AuthError as e:
+            status = e.status_code
+            if isinstance(e, RateLimitError):
+                headers = e.headers
+            body = {
+                'success': False,
+                'error': status,
+                'message': e.error['description'],
+            }
+        except Exception as e:
+            status = getattr(e, 'code', 500)
+            if status not in ERROR_MESSAGES:
+                status = 500
+            if status == 500:
+                logger.exception('Unhandled error on %s', request.path)
+            body = {
+                'success': False,
+                'error': status,
+                'message': ERROR_MESSAGES[status],
+            }
+
+        await self.respond(request, send, status, body, headers)
+        # named like the Flask app's endpoints, to share their histograms
+        table = model.__tablename__
+        endpoint = f'{table}_blueprint.get_{table if id is None else name}'
+        metrics.observe_request(
+            endpoint, 'GET', status, time.perf_counter() - started, timings)
+
+    async def respond(self, request, send, status: int, body, headers):
+        data = f'{self.json.dumps(body)}\n'.encode()
+        headers = {
+            **headers,
+            'Content-Type': 'application/json',
+            'Vary': 'Accept, Accept-Encoding',
+        }
+        encoding = get_encoding(request.accept_encodings)
+        if encoding is not None and len(data) >= MIN_SIZE:
+            compressed = compress(data, encoding)
+            compression_stats.record(len(data), len(compressed))
+            data = compressed
+            headers['Content-Encoding'] = encoding
+            if 'ETag' in headers:
+                headers['ETag'] = 'W/' + headers['ETag']
+        headers['Content-Length'] = str(len(data))
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [
+                (name.lower().encode('latin-1'), value.encode('latin-1'))
+                for name, value in headers.items()
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': data})
+
+    async def list_entities(self, session, request, model):
+        """Returns a page of entities, like the Flask app's list routes"""
+        limit, cursor, offset = get_page_args(request.args)
+        sort = get_sort(request.args, model)
+        fields = get_fields(request.args, model)
+
+        version = (await session.execute(
+            select(TableVersion.version, TableVersion.updated_at)
+            .where(TableVersion.name == model.__tablename__))).first()
+
+        serialized = fields or model.serialized_fields
+        columns = with_sort_field(serialized, sort)
+        query = select(*(getattr(model, field) for field in columns))
+        query = filter_query(query, model, request.args)
+        query = page_query(query, model, limit, cursor, offset, sort)
+        rows = (await session.execute(query)).all()
+        rows, next_cursor = next_page(rows, limit, sort)
+
+        headers = {}
+        if version is not None:
+            # the same validators as conditional.list_validators
+            etag = make_etag(version.version, request.full_path, False)
+            headers['ETag'] = quote_etag(etag)
+            headers['Last-Modified'] = http_date(as_utc(version.updated_at))
+        return {
+            'success': True,
+            model.__tablename__: [dict(zip(serialized, row)) for row in rows],
+            'next_cursor': next_cursor,
+        }, headers
+
+    async def get_entity(self, session, request, model, name: str, id: int):
+        """Returns an entity, like the Flask app's entity routes"""
+        fields = get_fields(request.args, model)
+        serialized = fields or model.serialized_fields
+        columns = [getattr(model, field) for field in serialized]
+        row = (await session.execute(
+            select(*columns, model.updated_at).where(model.id == id))).first()
+        if row is None:
+            raise NotFound()
+        etag, last_modified = entity_validators(
+            model, id, row.updated_at, fields)
+        return {
+            'success': True,
+            name: dict(zip(serialized, row)),
+        }, {
+            'ETag': quote_etag(etag),
+            'Last-Modified': http_date(last_modified),
+        }
+
+
+'''Return the ASGI app.
+
+    The actor and movie reads (pages and entities, without embedded
+    relationships, streams or conditional headers) are served on the event
+    loop, through an async engine (asyncpg, or aiosqlite) on the primary, or
+    DB_ASYNC_URL. Every other request goes to the Flask app, which runs in a
+    thread pool. One process thus multiplexes many in-flight reads, instead
+    of one per worker.
+'''
+
+
+def create_asgi_app():
+    if WsgiToAsgi is None:
+        raise RuntimeError(
+            'The async mode requires asgiref (pip install asgiref)')
+    db_path = get_db_path()
+    flask_app = Flask(__name__)
+    init_app(flask_app, db_path=db_path)
+    async_path = getenv('DB_ASYNC_URL') or db_path
+    engine = create_async_engine(
+        get_async_db_url(async_path), **get_async_engine_options(async_path))
+    return AsyncApp(flask_app, engine)
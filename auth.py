@@ -1,9 +1,12 @@
-import json
+import math
 from os import getenv
-from flask import request
+from flask import g, request
 from functools import wraps
 from jose import jwt
-from urllib.request import urlopen
+from jwks import jwks_store, JWKSError
+from token_cache import token_cache
+from instrumentation import timed
+import rate_limit
 
 # AuthError Exception
 '''
@@ -18,6 +21,22 @@ class AuthError(Exception):
         self.status_code = status_code
 
 
+class RateLimitError(AuthError):
+    """Raised when a subject is over its rate limit (see rate_limit.py)"""
+
+    def __init__(self, retry_after: float):
+        super().__init__({
+            'code': 'rate_limited',
+            'description': 'Too many requests'
+        }, 429)
+        self.retry_after = retry_after
+
+    @property
+    def headers(self):
+        # Retry-After takes whole seconds
+        return {'Retry-After': str(max(math.ceil(self.retry_after), 1))}
+
+
 # Auth Header
 
 '''
@@ -27,7 +46,11 @@ class AuthError(Exception):
 
 
 def get_token_auth_header():
-    auth: str | None = request.headers.get('Authorization', None)
+    return parse_auth_header(request.headers.get('Authorization', None))
+
+
+def parse_auth_header(auth: str | None):
+    """Returns the token of an Authorization header value"""
     if not auth:
         raise AuthError(
             {'code': 'auth_missing', 'description': 'Authorization header is required'}, 401)
@@ -46,21 +69,108 @@ def get_token_auth_header():
     return token
 
 
-'''
+# Permissions
+
+# Bit assigned to each permission declared by a route (see requires_auth)
+permission_bits: dict[str, int] = {}
+
+
+'''Return the bitmask of the given permissions.
+
     @INPUTS
-        permission: string permission (i.e. 'post:actor')
-        payload: decoded jwt payload
-    Check that the permissions specify the desired permission.
+        permissions: iterable of string permissions
+        register: assign bits to permissions that don't have one yet
+
+    Permissions without an assigned bit are ignored unless registered,
+    since no route can require them.
 '''
 
 
-def check_permissions(permission: str, payload: str):
+def get_permission_mask(permissions, register: bool = False):
+    mask = 0
+    for permission in permissions:
+        bit = permission_bits.get(permission)
+        if bit is None:
+            if not register:
+                continue
+            bit = permission_bits[permission] = 1 << len(permission_bits)
+        mask |= bit
+    return mask
+
+
+class Claims(dict):
+    """A verified jwt payload with its permissions precomputed.
+
+    The `permissions` claim is compiled once, into a frozenset and a bitmask
+    over the permissions declared by the routes, so authorizing a request is
+    O(1) however many permissions the token carries.
+    """
+    __slots__ = ('permissions', 'permission_mask', '_compiled_bits')
+
+    def __init__(self, payload: dict):
+        super().__init__(payload)
+        self.permissions = frozenset(payload.get('permissions') or ())
+        self._compile()
+
+    def _compile(self):
+        self._compiled_bits = len(permission_bits)
+        self.permission_mask = get_permission_mask(self.permissions)
+
+    def has_permissions(self, mask: int, match: str = 'all'):
+        # routes declared after the claims were compiled get new bits
+        if self._compiled_bits != len(permission_bits):
+            self._compile()
+        if match == 'any':
+            return bool(self.permission_mask & mask)
+        return self.permission_mask & mask == mask
+
+
+def ensure_permissions_claim(payload: dict):
     if 'permissions' not in payload:
         raise AuthError(
-            {'code': 'malformed_query', 'description': 'Malformed token: permissions not specified'}, 400)
-    if permission not in payload['permissions']:
-        raise AuthError(
-            {'code': 'unauthorized_access', 'description': 'missing permission'}, 401)
+            {
+                'code': 'malformed_query',
+                'description': 'Malformed token: permissions not specified',
+            }, 400)
+
+
+def enforce_rate_limit(payload: Claims):
+    retry_after = rate_limit.rate_limiter.check(payload)
+    if retry_after:
+        raise RateLimitError(retry_after)
+
+
+def raise_missing_permission():
+    raise AuthError({
+        'code': 'unauthorized_access',
+        'description': 'missing permission',
+    }, 401)
+
+
+'''
+    @INPUTS
+        permission: string permission (i.e. 'post:actor'), or an iterable
+            of them
+        payload: decoded jwt payload
+        match: 'all' to require every permission, 'any' to require at least
+            one
+    Check that the permissions specify the desired permission(s).
+'''
+
+
+def check_permissions(permission: str, payload: dict, match: str = 'all'):
+    ensure_permissions_claim(payload)
+    required = (permission,) if isinstance(permission, str) else permission
+    if isinstance(payload, Claims):
+        granted = payload.permissions
+    else:
+        granted = frozenset(payload['permissions'])
+    if match == 'any':
+        allowed = not granted.isdisjoint(required)
+    else:
+        allowed = granted.issuperset(required)
+    if not allowed:
+        raise_missing_permission()
     return True
 
 
@@ -70,9 +180,9 @@ def check_permissions(permission: str, payload: str):
         token: a json web token (string)
 
     It verifies an Auth0 token with a key id (kid).
+    The signing key is looked up in the in-process JWKS key store (see jwks.py)
+    rather than being fetched from Auth0 on every request.
     It decodes the payload from the token and validates the claims.
-
-    !!NOTE urlopen has a common certificate error described here: https://stackoverflow.com/questions/50236117/scraping-ssl-certificate-verify-failed-error-for-http-en-wikipedia-org
 '''
 
 
@@ -89,20 +199,14 @@ def verify_decode_jwt(token):
             'code': 'invalid_header',
             'description': 'Authorization malformed.'
         }, 401)
-    auth0_domain = getenv('AUTH0_DOMAIN', None)
-    url = f'https://{auth0_domain}/.well-known/jwks.json'
-    jsonurl = urlopen(url)
-    jwks = json.loads(jsonurl.read())
-    rsa_key = {}
-    for key in jwks['keys']:
-        if key['kid'] == unverified_header['kid']:
-            rsa_key = {
-                'kty': key['kty'],
-                'kid': key['kid'],
-                'use': key['use'],
-                'n': key['n'],
-                'e': key['e']
-            }
+    try:
+        with timed('jwks'):
+            rsa_key = jwks_store.get_key(unverified_header['kid'])
+    except JWKSError:
+        raise AuthError({
+            'code': 'jwks_unavailable',
+            'description': 'Unable to fetch signing keys.'
+        }, 503)
 
     if not rsa_key:
         raise AuthError({
@@ -139,22 +243,58 @@ def verify_decode_jwt(token):
         }, 400)
 
 
-'''Return the decorator which passes the decoded payload to the decorated method.
+'''Return the verified payload for a token, using the verified-token cache.
+
+    @INPUTS
+        token: a json web token (string)
+
+    Tokens already verified by this process skip the signature check and are
+    served from the cache until they expire (see token_cache.py).
+    The payload is returned as Claims, with its permissions precomputed.
+'''
+
+
+def get_verified_payload(token):
+    payload = token_cache.get(token)
+    if payload is None:
+        payload = Claims(verify_decode_jwt(token))
+        token_cache.put(token, payload)
+    return payload
+
+
+'''Return the decorator passing the decoded payload to the decorated method.
 
     @INPUTS
         permission: string permission (i.e. 'post:actor')
+        permissions: iterable of string permissions, instead of a single one
+        match: 'all' to require every permission, 'any' to require at least
+            one
 
-    This method decodes the JWT, validates the claims and verifies the requested permission.
+    This method decodes the JWT, validates the claims and verifies the
+    requested permission(s). The required permissions are compiled into a
+    bitmask once, when the route is declared. Verified requests are rate
+    limited per subject and tier (see rate_limit.py), over-limit ones are
+    answered with a 429.
 '''
 
 
-def requires_auth(permission=''):
+def requires_auth(permission='', permissions=None, match='all'):
+    if match not in ('all', 'any'):
+        raise ValueError(f'Unknown permission match: {match}')
+    required = (permission,) if permissions is None else tuple(permissions)
+    required_mask = get_permission_mask(required, register=True)
+
     def requires_auth_decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
-            token = get_token_auth_header()
-            payload = verify_decode_jwt(token)
-            check_permissions(permission, payload)
+            with timed('auth'):
+                token = get_token_auth_header()
+                payload = get_verified_payload(token)
+                ensure_permissions_claim(payload)
+                enforce_rate_limit(payload)
+                if not payload.has_permissions(required_mask, match):
+                    raise_missing_permission()
+            g.auth_payload = payload
             return f(payload, *args, **kwargs)
 
         return wrapper
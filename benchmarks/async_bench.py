@@ -0,0 +1,103 @@
+"""Concurrency benchmark of the async (ASGI) mode against the sync workers:
+requests/sec and p95 latency of the actor reads as the number of concurrent
+clients grows.
+
+Both servers run as separate processes on local ports: gunicorn with
+`--workers` sync workers, and a single uvicorn process. Requires the async
+mode's packages (see README) and gunicorn.
+
+Run from the project root: `python -m benchmarks.async_bench`
+(uses the `castingagency_bench` database, next to the one configured by the
+DB_* env vars, which is reset and seeded, unless `--db` is passed)
+"""
+import argparse
+import importlib.util
+import os
+import sys
+from benchmarks.common import (
+    add_db_arguments,
+    create_app,
+    free_port,
+    get_db_env,
+    get_db_path,
+    OfflineAuth,
+    run_clients,
+    spawn_server,
+)
+
+
+def start_server(db_path: str, mode: str, port: int, workers: int):
+    env = {
+        **os.environ,
+        **get_db_env(db_path),
+        'REQUEST_LOG_ENABLED': 'false',
+        'RATE_LIMIT_ENABLED': 'false',
+    }
+    if mode == 'sync':
+        command = [
+            sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py',
+            '--workers', str(workers), '--bind', f'127.0.0.1:{port}',
+        ]
+    else:
+        command = [
+            sys.executable, '-m', 'uvicorn', '--factory',
+            'asgi:create_asgi_app', '--port', str(port), '--no-access-log',
+        ]
+    return spawn_server(command, env, port)
+
+
+def seed(db_path: str, rows: int):
+    """Creates the actors, returns the paths of the benchmarked reads"""
+    from db import db
+    from test_data_factory import ActorFactory
+
+    app = create_app(db_path)
+    with app.app_context():
+        actors = ActorFactory.create_batch(rows)
+        db.session.commit()
+        paths = [
+            path
+            for actor in actors
+            for path in ('/actors?limit=20', f'/actors/{actor.id}')
+        ]
+        db.session.remove()
+    return paths
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--requests', type=int, default=2000,
+                        help='requests per concurrency level')
+    parser.add_argument('-c', '--clients', default='1,16,64,256',
+                        help='concurrency levels, comma separated')
+    parser.add_argument('-w', '--workers', type=int, default=4,
+                        help='sync workers')
+    parser.add_argument('--rows', type=int, default=500)
+    add_db_arguments(parser)
+    args = parser.parse_args()
+    if importlib.util.find_spec('uvicorn') is None:
+        sys.exit('The async server requires uvicorn: pip install uvicorn')
+    db_path = get_db_path(args.db, args.reset_db)
+
+    levels = [int(level) for level in args.clients.split(',')]
+    with OfflineAuth() as offline_auth:
+        headers = offline_auth.headers()
+        paths = seed(db_path, args.rows)
+        print(f'{args.requests} requests per level, '
+              f'{args.workers} sync workers, 1 async process')
+        print(f"{'mode':<7}{'clients':>8}{'req/s':>9}{'p50 ms':>9}"
+              f"{'p95 ms':>9}{'errors':>8}")
+        for mode in ('sync', 'async'):
+            port = free_port()
+            server = start_server(db_path, mode, port, args.workers)
+            try:
+                for clients in levels:
+                    summary = run_clients(
+                        port, headers, paths, clients, args.requests)
+                    print(f"{mode:<7}{clients:>8}{summary['rps']:>9.0f}"
+                          f"{summary['p50_ms']:>9.2f}"
+                          f"{summary['p95_ms']:>9.2f}"
+                          f"{summary['errors']:>8}")
+            finally:
+                server.terminate()
+                server.wait()
@@ -0,0 +1,55 @@
+"""Micro-benchmark of the per-request auth cost with and without the
+verified-token cache, and of the rate limiter's share of it (with limits
+high enough to let every request in).
+
+Run from the project root: `python -m benchmarks.auth_bench`
+"""
+import argparse
+import time
+from flask import Flask
+from benchmarks.common import OfflineAuth
+
+
+def run(token: str, iterations: int, cached: bool, limited: bool = False):
+    import auth
+    import rate_limit
+    from token_cache import token_cache
+
+    app = Flask(__name__)
+
+    @auth.requires_auth(permission='get:actors')
+    def handler(payload):
+        return payload
+
+    token_cache.max_size = 1024 if cached else 0
+    token_cache.clear()
+    rate_limit.set_rate_limiter(rate_limit.RateLimiter(
+        limits={'read': (1e9, 10 ** 9), 'write': (1e9, 10 ** 9)},
+        enabled=limited))
+    headers = {'Authorization': f'Bearer {token}'}
+    with app.test_request_context('/actors', headers=headers):
+        # warm up the JWKS store so only verification cost is measured
+        handler()
+        started = time.perf_counter()
+        for _ in range(iterations):
+            handler()
+        elapsed = time.perf_counter() - started
+    return elapsed / iterations
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--iterations', type=int, default=2000)
+    args = parser.parse_args()
+
+    with OfflineAuth() as offline_auth:
+        token = offline_auth.mint(['get:actors', 'get:movies'])
+        uncached = run(token, args.iterations, cached=False)
+        cached = run(token, args.iterations, cached=True)
+        limited = run(token, args.iterations, cached=True, limited=True)
+
+    print(f'iterations:     {args.iterations}')
+    print(f'without cache:  {uncached * 1e6:9.1f} us/request')
+    print(f'with cache:     {cached * 1e6:9.1f} us/request')
+    print(f'speedup:        {uncached / cached:9.1f}x')
+    print(f'+ rate limit:   {limited * 1e6:9.1f} us/request')
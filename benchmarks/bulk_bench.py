@@ -0,0 +1,105 @@
+"""Benchmark of rows/sec created, updated and deleted through the bulk
+endpoints compared with the single-item routes.
+
+Run from the project root: `python -m benchmarks.bulk_bench`
+(uses the `castingagency_bench` database, next to the one configured by the
+DB_* env vars, which is reset, unless `--db` is passed)
+"""
+import argparse
+import os
+import time
+from benchmarks.common import (
+    add_db_arguments,
+    create_app,
+    get_db_path,
+    OfflineAuth,
+)
+
+
+def timed(fn):
+    started = time.perf_counter()
+    fn()
+    return time.perf_counter() - started
+
+
+def single_item(client, headers, rows):
+    ids = []
+
+    def create():
+        for row in rows:
+            res = client.post('/actors', json=row, headers=headers)
+            ids.append(res.get_json()['actor']['id'])
+
+    def update():
+        for id in ids:
+            client.patch(
+                f'/actors/{id}',
+                json={'name': 'Renamed', 'birthdate': '2000-01-01'},
+                headers=headers)
+
+    def delete():
+        for id in ids:
+            client.delete(f'/actors/{id}', headers=headers)
+
+    return timed(create), timed(update), timed(delete)
+
+
+def bulk(client, headers, rows, batch_size):
+    ids = []
+    batches = [
+        rows[i:i + batch_size] for i in range(0, len(rows), batch_size)]
+
+    def create():
+        for batch in batches:
+            res = client.post(
+                '/actors/bulk', json={'actors': batch}, headers=headers)
+            ids.extend(res.get_json()['created'])
+
+    def update():
+        for i in range(0, len(ids), batch_size):
+            batch = [
+                {'id': id, 'name': 'Renamed'}
+                for id in ids[i:i + batch_size]]
+            client.patch(
+                '/actors/bulk', json={'actors': batch}, headers=headers)
+
+    def delete():
+        for i in range(0, len(ids), batch_size):
+            client.delete(
+                '/actors/bulk',
+                json={'ids': ids[i:i + batch_size]},
+                headers=headers)
+
+    return timed(create), timed(update), timed(delete)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--rows', type=int, default=2000)
+    parser.add_argument('-b', '--batch-size', type=int, default=500)
+    add_db_arguments(parser)
+    args = parser.parse_args()
+
+    rows = [
+        {'name': f'Actor {i}', 'birthdate': '1970-01-01'}
+        for i in range(args.rows)
+    ]
+
+    # a single subject sends every request
+    os.environ.setdefault('RATE_LIMIT_ENABLED', 'false')
+    with OfflineAuth() as offline_auth:
+        headers = offline_auth.headers()
+        app = create_app(get_db_path(args.db, args.reset_db))
+        client = app.test_client()
+        single = single_item(client, headers, rows)
+        batched = bulk(client, headers, rows, args.batch_size)
+
+    print(f'rows: {args.rows}, batch size: {args.batch_size}')
+    print(f"{'operation':<10}{'single rows/s':>16}{'bulk rows/s':>16}"
+          f"{'speedup':>10}")
+    for name, single_time, bulk_time in zip(
+            ('create', 'update', 'delete'), single, batched):
+        single_rate = args.rows / single_time
+        bulk_rate = args.rows / bulk_time
+        print(f'{name:<10}{single_rate:>16.0f}{bulk_rate:>16.0f}'
+              f'{bulk_rate / single_rate:>9.1f}x')
@@ -0,0 +1,111 @@
+"""Benchmark of read coalescing (see coalescing.py): requests/sec, p95
+latency and the share of reads coalesced, as concurrent clients read the
+same few movies and pages.
+
+Coalescing only applies to concurrent requests within a worker, so the
+server is a single gthread worker with `--threads` threads.
+
+Run from the project root: `python -m benchmarks.coalescing_bench`
+(uses the `castingagency_bench` database, next to the one configured by the
+DB_* env vars, which is reset and seeded, unless `--db` is passed)
+"""
+import argparse
+import http.client
+import os
+import sys
+from benchmarks.common import (
+    add_db_arguments,
+    create_app,
+    free_port,
+    get_db_env,
+    get_db_path,
+    OfflineAuth,
+    run_clients,
+    spawn_server,
+)
+
+
+def start_server(db_path: str, port: int, threads: int,
+                 coalescing: bool):
+    env = {
+        **os.environ,
+        **get_db_env(db_path),
+        'GUNICORN_WORKER_CLASS': 'gthread',
+        'GUNICORN_THREADS': str(threads),
+        'READ_COALESCING_ENABLED': str(coalescing).lower(),
+        'REQUEST_LOG_ENABLED': 'false',
+        'RATE_LIMIT_ENABLED': 'false',
+    }
+    return spawn_server(
+        [
+            sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py',
+            '--workers', '1', '--bind', f'127.0.0.1:{port}',
+        ], env, port)
+
+
+def get_coalescing_stats(port: int):
+    """Returns the read coalescing counters of the server's /metrics"""
+    connection = http.client.HTTPConnection('127.0.0.1', port)
+    connection.request('GET', '/metrics')
+    prefix = 'castingagency_read_coalescing_'
+    stats = {}
+    for line in connection.getresponse().read().decode().splitlines():
+        if line.startswith(prefix):
+            name, value = line[len(prefix):].split()
+            stats[name] = float(value)
+    return stats
+
+
+def seed(db_path: str, rows: int, hot: int):
+    """Creates the movies, returns the paths of the `hot` reads"""
+    from db import db
+    from test_data_factory import MovieFactory
+
+    app = create_app(db_path)
+    with app.app_context():
+        movies = MovieFactory.create_batch(rows)
+        db.session.commit()
+        paths = [
+            path
+            for movie in movies[:hot]
+            for path in ('/movies?limit=50', f'/movies/{movie.id}')
+        ]
+        db.session.remove()
+    return paths
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--requests', type=int, default=4000)
+    parser.add_argument('-c', '--clients', type=int, default=32)
+    parser.add_argument('-t', '--threads', type=int, default=16)
+    parser.add_argument('--rows', type=int, default=500)
+    parser.add_argument('--hot', type=int, default=2,
+                        help='movies read (and pages, from each)')
+    add_db_arguments(parser)
+    args = parser.parse_args()
+    db_path = get_db_path(args.db, args.reset_db)
+
+    with OfflineAuth() as offline_auth:
+        headers = offline_auth.headers()
+        paths = seed(db_path, args.rows, args.hot)
+        print(f'1 gthread worker, {args.threads} threads, {args.clients} '
+              f'clients, {args.requests} requests of {len(paths)} paths')
+        print(f"{'coalescing':<11}{'req/s':>9}{'p95 ms':>9}"
+              f"{'loads':>8}{'collapse':>10}{'errors':>8}")
+        for coalescing in (False, True):
+            port = free_port()
+            server = start_server(
+                db_path, port, args.threads, coalescing)
+            try:
+                summary = run_clients(
+                    port, headers, paths, args.clients, args.requests)
+                stats = get_coalescing_stats(port)
+            finally:
+                server.terminate()
+                server.wait()
+            loads = stats['executions'] if coalescing else args.requests
+            print(f"{str(coalescing):<11}{summary['rps']:>9.0f}"
+                  f"{summary['p95_ms']:>9.2f}{loads:>8.0f}"
+                  f"{stats['collapse_ratio']:>10.2f}"
+                  f"{summary['errors']:>8}")
@@ -0,0 +1,90 @@
+"""Benchmark of worker cold starts per DB_INIT mode: the time to boot the
+app and to serve its first request, and the SQL statements issued on boot.
+`eager` is how every worker used to boot, creating the missing tables.
+
+Each start runs in a fresh interpreter, like a new worker. Imports are
+timed separately, since they don't depend on the mode.
+
+Run from the project root: `python -m benchmarks.cold_start_bench`
+(uses the `castingagency_bench` database, next to the one configured by the
+DB_* env vars, whose schema is created, unless `--db` is passed)
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from benchmarks.common import get_db_path
+
+
+MODES = ('eager', 'lazy', 'none')
+
+# run in a fresh interpreter, prints the timings of one start as JSON
+WORKER = '''
+import json, sys, time
+started = time.perf_counter()
+from flask import Flask
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from init import init_app
+imported = time.perf_counter()
+
+statements = []
+event.listen(Engine, 'before_cursor_execute',
+             lambda *args: statements.append(args[2]))
+app = Flask('worker')
+init_app(app, db_path=sys.argv[1])
+booted = time.perf_counter()
+boot_statements = len(statements)
+app.test_client().get('/healthcheck')
+served = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'boot_ms': (booted - imported) * 1000,
+    'first_request_ms': (served - booted) * 1000,
+    'boot_statements': boot_statements,
+}))
+'''
+
+
+def start_worker(db_path: str, mode: str):
+    env = {**os.environ, 'DB_INIT': mode, 'REQUEST_LOG_ENABLED': 'false'}
+    output = subprocess.run(
+        [sys.executable, '-c', WORKER, db_path],
+        env=env, check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def run(db_path: str, starts: int):
+    # create the schema once, so every mode boots against an existing one
+    start_worker(db_path, 'eager')
+    results = {}
+    for mode in MODES:
+        runs = [start_worker(db_path, mode) for _ in range(starts)]
+        results[mode] = {
+            key: statistics.median(run[key] for run in runs)
+            for key in runs[0]
+        }
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--starts', type=int, default=10,
+                        help='worker starts per mode')
+    parser.add_argument(
+        '--db', help='database url (default: castingagency_bench)')
+    args = parser.parse_args()
+
+    # the missing tables are created, none is dropped
+    results = run(get_db_path(args.db, reset_db=True), args.starts)
+    print(f'median of {args.starts} starts')
+    print(f"{'DB_INIT':<8}{'import ms':>11}{'boot ms':>10}"
+          f"{'1st req ms':>12}{'boot stmts':>12}")
+    for mode, timings in results.items():
+        print(f"{mode:<8}{timings['import_ms']:>11.1f}"
+              f"{timings['boot_ms']:>10.1f}"
+              f"{timings['first_request_ms']:>12.1f}"
+              f"{timings['boot_statements']:>12.0f}")
@@ -0,0 +1,193 @@
+"""Shared setup for the benchmarks: offline auth and a throwaway app."""
+import http.client
+import itertools
+import math
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from flask import Flask
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import make_url
+from test_auth_stub import OfflineAuth  # noqa: F401
+
+
+# appended to the DB_* database's name, for the default benchmark database
+BENCH_DB_SUFFIX = '_bench'
+
+
+def add_db_arguments(parser):
+    """Adds the --db and --reset-db options of a benchmark"""
+    parser.add_argument(
+        '--db', help=f'database url (default: the DB_* database, with '
+        f'{BENCH_DB_SUFFIX} appended to its name)')
+    parser.add_argument(
+        '--reset-db', action='store_true',
+        help='allow dropping the tables of a --db not ending in '
+        f'{BENCH_DB_SUFFIX}')
+
+
+def create_database(db_path: str):
+    """Creates a Postgres database, unless it exists"""
+    url = make_url(db_path)
+    engine = create_engine(
+        url.set(database='postgres'), isolation_level='AUTOCOMMIT')
+    try:
+        with engine.connect() as connection:
+            exists = connection.execute(
+                text('SELECT 1 FROM pg_database WHERE datname = :name'),
+                {'name': url.database}).scalar()
+            if not exists:
+                connection.execute(text(
+                    f'CREATE DATABASE "{url.database}" '
+                    "ENCODING 'UTF8' TEMPLATE template0"))
+    finally:
+        engine.dispose()
+
+
+def get_db_path(db_path: str = None, reset_db: bool = False):
+    """Returns the benchmark db, whose tables are dropped and recreated.
+
+    Defaults to a dedicated database next to the one configured by the DB_*
+    env vars (`castingagency_bench`, created if missing), never to that
+    database itself. Any other database is only used with `reset_db`.
+    """
+    if db_path is None:
+        from db import get_db_path as get_app_db_path
+        url = make_url(get_app_db_path())
+        url = url.set(database=url.database + BENCH_DB_SUFFIX)
+        db_path = url.render_as_string(hide_password=False)
+        if url.get_backend_name() == 'postgresql':
+            create_database(db_path)
+        return db_path
+    database = make_url(db_path).database or ''
+    if not reset_db and not database.rsplit('.', 1)[0].endswith(
+            BENCH_DB_SUFFIX):
+        raise SystemExit(
+            f'The tables of {database} would be dropped: pass --reset-db '
+            f'to confirm, or use a database ending in {BENCH_DB_SUFFIX}')
+    return db_path
+
+
+def get_db_env(db_path: str):
+    """Returns the DB_* env vars pointing a server process at a database"""
+    url = make_url(db_path)
+    if url.host is None:
+        raise SystemExit(f'{db_path}: the servers need a database server')
+    host = url.host if url.port is None else f'{url.host}:{url.port}'
+    return {
+        'DB_DIALECT': url.drivername,
+        'DB_USER': url.username or '',
+        'DB_PASSWORD': url.password or '',
+        'DB_HOST': host,
+        'DB_NAME': url.database,
+    }
+
+
+def create_app(db_path: str):
+    """Returns an app on a freshly created schema"""
+    from init import init_app
+
+    app = Flask(__name__)
+    init_app(app, db_path=db_path, drop_db=True)
+    return app
+
+
+def percentile(values: list, p: float):
+    """Returns the p-th percentile (nearest rank) of sorted values"""
+    if not values:
+        return None
+    rank = max(math.ceil(p / 100 * len(values)), 1)
+    return values[rank - 1]
+
+
+def summarize(latencies: list, elapsed: float):
+    """Returns the latency percentiles (in ms) and throughput of a run"""
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'rps': len(latencies) / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+    }
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_up(port: int, timeout: float = 30, process=None):
+    """Waits for a local server to answer its healthcheck, or its process
+    (if given) to exit"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(
+                f'The server on port {port} exited with {process.returncode}')
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port)
+            connection.request('GET', '/healthcheck')
+            if connection.getresponse().status == 200:
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'The server on port {port} did not start')
+
+
+def spawn_server(command: list, env: dict, port: int):
+    """Starts a local server and waits for it to be up. Its stderr is kept
+    in a temporary file, printed if it doesn't start"""
+    errors = tempfile.TemporaryFile()
+    server = subprocess.Popen(
+        command, env=env, stdout=subprocess.DEVNULL, stderr=errors)
+    try:
+        wait_until_up(port, process=server)
+    except RuntimeError:
+        server.kill()
+        server.wait()
+        errors.seek(0)
+        sys.stderr.write(errors.read().decode(errors='replace'))
+        raise
+    finally:
+        # the server keeps writing to its own descriptor
+        errors.close()
+    return server
+
+
+def run_clients(port: int, headers: dict, paths: list, clients: int,
+                requests: int):
+    """Sends GET requests for the paths, in turn, to a local server from
+    concurrent clients, each on its own keep-alive connection. Returns
+    their summary"""
+    counter = itertools.count()
+    latencies = []
+    errors = []
+
+    def client():
+        connection = http.client.HTTPConnection('127.0.0.1', port)
+        while True:
+            n = next(counter)
+            if n >= requests:
+                return
+            started = time.perf_counter()
+            connection.request('GET', paths[n % len(paths)], headers=headers)
+            response = connection.getresponse()
+            response.read()
+            latencies.append(time.perf_counter() - started)
+            if response.status >= 400:
+                errors.append(response.status)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    summary = summarize(latencies, time.perf_counter() - started)
+    summary['errors'] = len(errors)
+    return summary
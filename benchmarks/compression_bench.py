@@ -0,0 +1,89 @@
+"""Benchmark of the CPU cost of compressing a page of movies against the
+bytes it saves, per encoding and level.
+
+Run from the project root: `python -m benchmarks.compression_bench`
+(uses the `castingagency_bench` database, next to the one configured by the
+DB_* env vars, which is reset and seeded, unless `--db` is passed)
+"""
+import argparse
+import os
+import time
+from unittest import mock
+from benchmarks.common import (
+    add_db_arguments,
+    create_app,
+    get_db_path,
+    OfflineAuth,
+)
+
+
+GZIP_LEVELS = (1, 6, 9)
+BROTLI_LEVELS = (1, 4, 6, 11)
+
+
+def seed(app, rows: int):
+    """Creates movies with catalog-length descriptions"""
+    import factory
+    from db import db
+    from test_data_factory import MovieFactory
+
+    with app.app_context():
+        MovieFactory.create_batch(
+            rows, description=factory.Faker('paragraph', nb_sentences=8))
+        db.session.commit()
+        db.session.remove()
+
+
+def best_of(fn, repeat: int):
+    """Returns the fastest of repeat runs, in seconds"""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def run(body: bytes, repeat: int):
+    import compression
+
+    encodings = [('gzip', level) for level in GZIP_LEVELS]
+    if compression.brotli is not None:
+        encodings += [('br', level) for level in BROTLI_LEVELS]
+
+    results = []
+    for encoding, level in encodings:
+        setting = 'GZIP_LEVEL' if encoding == 'gzip' else 'BROTLI_LEVEL'
+        with mock.patch.object(compression, setting, level):
+            compressed = compression.compress(body, encoding)
+            seconds = best_of(
+                lambda: compression.compress(body, encoding), repeat)
+        results.append((encoding, level, len(compressed), seconds))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--rows', type=int, default=500,
+                        help='movies seeded, and fetched in one page')
+    parser.add_argument('-r', '--repeat', type=int, default=5)
+    add_db_arguments(parser)
+    args = parser.parse_args()
+
+    os.environ.setdefault('REQUEST_LOG_ENABLED', 'false')
+    # a single subject sends every request
+    os.environ.setdefault('RATE_LIMIT_ENABLED', 'false')
+    with OfflineAuth() as offline_auth:
+        app = create_app(get_db_path(args.db, args.reset_db))
+        seed(app, args.rows)
+        res = app.test_client().get(
+            f'/movies?limit={args.rows}', headers=offline_auth.headers())
+        body = res.get_data()
+
+    print(f'page of {args.rows} movies: {len(body)} bytes, '
+          f'best of {args.repeat}')
+    print(f"{'encoding':<10}{'level':>6}{'bytes':>10}{'saved':>8}"
+          f"{'cpu ms':>9}{'MB/s':>8}")
+    for encoding, level, size, seconds in run(body, args.repeat):
+        print(f'{encoding:<10}{level:>6}{size:>10}{1 - size / len(body):>8.1%}'
+              f'{seconds * 1000:>9.2f}{len(body) / seconds / 1e6:>8.1f}')
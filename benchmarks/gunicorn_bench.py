@@ -0,0 +1,120 @@
+"""Benchmark of the gunicorn profile (gunicorn.conf.py) per worker class,
+with and without preload_app: memory per worker and throughput.
+
+RSS counts every page a worker maps, PSS splits the pages shared between
+processes among them: preloading shows as a lower PSS. Memory is read from
+/proc once the workers served the requests, so Linux only.
+
+Run from the project root: `python -m benchmarks.gunicorn_bench`
+(uses the `castingagency_bench` database, next to the one configured by the
+DB_* env vars, which is reset and seeded, unless `--db` is passed)
+"""
+import argparse
+import importlib.util
+import os
+import sys
+from benchmarks.common import (
+    add_db_arguments,
+    create_app,
+    free_port,
+    get_db_env,
+    get_db_path,
+    OfflineAuth,
+    run_clients,
+    spawn_server,
+)
+
+
+def get_worker_classes():
+    classes = ['sync', 'gthread']
+    if importlib.util.find_spec('gevent') is not None:
+        classes.append('gevent')
+    return classes
+
+
+def get_children(pid: int):
+    with open(f'/proc/{pid}/task/{pid}/children') as f:
+        return [int(child) for child in f.read().split()]
+
+
+def get_memory(pid: int):
+    """Returns the RSS and PSS of a process, in MB"""
+    memory = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            name, _, value = line.partition(':')
+            if name in ('Rss', 'Pss'):
+                memory[name.lower()] = int(value.split()[0]) / 1024
+    return memory
+
+
+def start_server(db_path: str, port: int, workers: int, worker_class: str,
+                 preload: bool):
+    env = {
+        **os.environ,
+        **get_db_env(db_path),
+        'GUNICORN_WORKER_CLASS': worker_class,
+        'GUNICORN_PRELOAD': str(preload).lower(),
+        'REQUEST_LOG_ENABLED': 'false',
+        'RATE_LIMIT_ENABLED': 'false',
+    }
+    return spawn_server(
+        [
+            sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py',
+            '--workers', str(workers), '--bind', f'127.0.0.1:{port}',
+        ], env, port)
+
+
+def seed(db_path: str, rows: int):
+    """Creates the movies, returns the paths of the benchmarked reads"""
+    from db import db
+    from test_data_factory import MovieFactory
+
+    app = create_app(db_path)
+    with app.app_context():
+        movies = MovieFactory.create_batch(rows)
+        db.session.commit()
+        paths = [
+            path
+            for movie in movies
+            for path in ('/movies?limit=20', f'/movies/{movie.id}')
+        ]
+        db.session.remove()
+    return paths
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--requests', type=int, default=2000)
+    parser.add_argument('-c', '--clients', type=int, default=32)
+    parser.add_argument('-w', '--workers', type=int, default=4)
+    parser.add_argument('--rows', type=int, default=500)
+    add_db_arguments(parser)
+    args = parser.parse_args()
+    db_path = get_db_path(args.db, args.reset_db)
+
+    with OfflineAuth() as offline_auth:
+        headers = offline_auth.headers()
+        paths = seed(db_path, args.rows)
+        print(f'{args.workers} workers, {args.clients} clients, '
+              f'{args.requests} requests')
+        print(f"{'worker':<9}{'preload':>8}{'RSS MB':>9}{'PSS MB':>9}"
+              f"{'req/s':>9}{'p95 ms':>9}{'errors':>8}")
+        for worker_class in get_worker_classes():
+            for preload in (False, True):
+                port = free_port()
+                server = start_server(
+                    db_path, port, args.workers, worker_class, preload)
+                try:
+                    summary = run_clients(
+                        port, headers, paths, args.clients, args.requests)
+                    memory = [
+                        get_memory(pid) for pid in get_children(server.pid)]
+                finally:
+                    server.terminate()
+                    server.wait()
+                rss = sum(m['rss'] for m in memory) / len(memory)
+                pss = sum(m['pss'] for m in memory) / len(memory)
+                print(f"{worker_class:<9}{str(preload):>8}{rss:>9.1f}"
+                      f"{pss:>9.1f}{summary['rps']:>9.0f}"
+                      f"{summary['p95_ms']:>9.2f}{summary['errors']:>8}")
@@ -0,0 +1,227 @@
+"""Load test replaying the request shapes of the Postman collection against
+the app, reporting p50/p95/p99 latency and requests/sec per route.
+
+Run from the project root: `python -m benchmarks.load_bench`
+(uses the `castingagency_bench` database, next to the one configured by the
+DB_* env vars, which is reset and seeded, unless `--db` is passed)
+
+Save a run with `--save run.json`, then compare a later run against it with
+`--compare run.json`: routes whose p95 latency or throughput regressed by
+more than `--threshold` are flagged, and the exit status is 1. Two saved runs
+are compared without running anything with `--compare a.json --against b.json`.
+"""
+import argparse
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from benchmarks.common import (
+    add_db_arguments,
+    create_app,
+    get_db_path,
+    OfflineAuth,
+    summarize,
+)
+
+
+COLLECTION = 'Casting Agency.postman_collection.json'
+
+# reads the collection doesn't have
+EXTRA_SHAPES = [
+    {'method': 'GET', 'path': '/actors/:actor_id', 'body': None},
+    {'method': 'GET', 'path': '/movies/:movie_id', 'body': None},
+]
+
+
+def load_shapes(collection_path: str):
+    """Returns the distinct (method, path, body) of the collection's
+    requests, followed by EXTRA_SHAPES"""
+    with open(collection_path) as f:
+        collection = json.load(f)
+
+    def walk(items):
+        for item in items:
+            if 'item' in item:
+                yield from walk(item['item'])
+                continue
+            request = item['request']
+            url = request['url']
+            raw = url if isinstance(url, str) else url['raw']
+            body = (request.get('body') or {}).get('raw') or None
+            yield {
+                'method': request['method'],
+                'path': raw.replace('{{base_url}}', '') or '/',
+                'body': json.loads(body) if body else None,
+            }
+
+    shapes = {}
+    for shape in itertools.chain(walk(collection['item']), EXTRA_SHAPES):
+        shapes.setdefault((shape['method'], shape['path']), shape)
+    return list(shapes.values())
+
+
+def route_name(shape):
+    return f"{shape['method']} {shape['path']}"
+
+
+def seed(app, rows: int, disposable: int):
+    """Creates rows actors and movies, plus disposable ones for the deletes.
+    Returns their ids by path parameter"""
+    from db import db
+    from test_data_factory import ActorFactory, MovieFactory
+
+    ids = {}
+    with app.app_context():
+        for param, factory in (
+                ('actor_id', ActorFactory), ('movie_id', MovieFactory)):
+            kept = factory.create_batch(rows)
+            spare = factory.create_batch(disposable)
+            db.session.commit()
+            ids[param] = [entity.id for entity in kept]
+            ids[f'disposable_{param}'] = [entity.id for entity in spare]
+        db.session.remove()
+    return ids
+
+
+def resolve_path(shape, ids: dict, n: int):
+    """Fills in the path parameters: deletes each consume a disposable id"""
+    path = shape['path']
+    for param in ('actor_id', 'movie_id'):
+        if f':{param}' not in path:
+            continue
+        if shape['method'] == 'DELETE':
+            id = ids[f'disposable_{param}'].pop()
+        else:
+            pool = ids[param]
+            id = pool[n % len(pool)]
+        path = path.replace(f':{param}', str(id))
+    return path
+
+
+def run_route(app, shape, ids, headers, requests: int, concurrency: int):
+    """Sends the requests from concurrent clients. Returns their summary"""
+    counter = itertools.count()
+    latencies = []
+    errors = []
+
+    def worker():
+        client = app.test_client()
+        while True:
+            n = next(counter)
+            if n >= requests:
+                return
+            path = resolve_path(shape, ids, n)
+            started = time.perf_counter()
+            res = client.open(
+                path,
+                method=shape['method'],
+                json=shape['body'],
+                headers=headers,
+            )
+            latency = time.perf_counter() - started
+            latencies.append(latency)
+            if res.status_code >= 400:
+                errors.append(res.status_code)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    summary = summarize(latencies, time.perf_counter() - started)
+    summary['errors'] = len(errors)
+    return summary
+
+
+def run(args):
+    os.environ.setdefault('REQUEST_LOG_ENABLED', 'false')
+    # a single subject sends every request
+    os.environ.setdefault('RATE_LIMIT_ENABLED', 'false')
+    shapes = load_shapes(args.collection)
+    deletes = sum(shape['method'] == 'DELETE' for shape in shapes)
+    with OfflineAuth() as offline_auth:
+        headers = offline_auth.headers()
+        app = create_app(get_db_path(args.db, args.reset_db))
+        ids = seed(app, args.rows, args.requests * deletes)
+        # warm up the JWKS store and the pool
+        app.test_client().get('/actors', headers=headers)
+        routes = {
+            route_name(shape): run_route(
+                app, shape, ids, headers, args.requests, args.concurrency)
+            for shape in shapes
+        }
+    return {
+        'config': {
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'rows': args.rows,
+        },
+        'routes': routes,
+    }
+
+
+def print_run(results):
+    print(f"{'route':<28}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}"
+          f"{'p99 ms':>9}{'errors':>8}")
+    for route, summary in results['routes'].items():
+        print(f"{route:<28}{summary['rps']:>9.0f}{summary['p50_ms']:>9.2f}"
+              f"{summary['p95_ms']:>9.2f}{summary['p99_ms']:>9.2f}"
+              f"{summary['errors']:>8}")
+
+
+def compare(baseline, results, threshold: float):
+    """Prints the change of every route. Returns the regressed routes"""
+    regressions = []
+    print(f"{'route':<28}{'req/s':>9}{'change':>9}{'p95 ms':>9}"
+          f"{'change':>9}")
+    for route, summary in results['routes'].items():
+        base = baseline['routes'].get(route)
+        if base is None:
+            continue
+        rps_change = summary['rps'] / base['rps'] - 1
+        p95_change = summary['p95_ms'] / base['p95_ms'] - 1
+        regressed = rps_change < -threshold or p95_change > threshold
+        if regressed:
+            regressions.append(route)
+        print(f"{route:<28}{summary['rps']:>9.0f}{rps_change:>+9.1%}"
+              f"{summary['p95_ms']:>9.2f}{p95_change:>+9.1%}"
+              f"{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('-n', '--requests', type=int, default=200,
+                        help='requests per route')
+    parser.add_argument('-c', '--concurrency', type=int, default=4)
+    parser.add_argument('--rows', type=int, default=500,
+                        help='actors and movies seeded')
+    parser.add_argument('--collection', default=COLLECTION)
+    add_db_arguments(parser)
+    parser.add_argument('--save', help='write the results to this file')
+    parser.add_argument('--compare', help='results to compare against')
+    parser.add_argument('--against',
+                        help='compare these saved results instead of running')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='relative change flagged as a regression')
+    args = parser.parse_args()
+
+    if args.against:
+        with open(args.against) as f:
+            results = json.load(f)
+    else:
+        results = run(args)
+        print_run(results)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print()
+        if compare(baseline, results, args.threshold):
+            sys.exit(1)
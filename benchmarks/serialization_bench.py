@@ -0,0 +1,106 @@
+"""Benchmark of serializing a list of actors: ORM objects formatted and
+encoded with Flask's default JSON provider (the former path), compared with
+plain rows encoded by the app's provider, with the standard library and with
+orjson.
+
+Run from the project root: `python -m benchmarks.serialization_bench`
+(uses the `castingagency_bench` database, next to the one configured by the
+DB_* env vars, which is reset, unless `--db` is passed)
+"""
+import argparse
+import time
+from datetime import date
+from unittest import mock
+from flask.json.provider import DefaultJSONProvider
+from benchmarks.common import (
+    add_db_arguments,
+    create_app,
+    get_db_path,
+)
+
+
+def best_of(fn, repeat: int):
+    """Returns the fastest of repeat runs, in seconds, after an untimed one:
+    the first run of a path pays one-time costs (configuring the mappers,
+    compiling its statement), which would otherwise go to the first path"""
+    fn()
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def seed(app, rows: int):
+    from sqlalchemy import insert
+    from db import db
+    from models import Actor
+
+    with app.app_context():
+        db.session.execute(insert(Actor), [
+            {'name': f'Actor {i}', 'birthdate': date(1970, 1, 1)}
+            for i in range(rows)
+        ])
+        db.session.commit()
+        db.session.remove()
+
+
+def run(app, repeat: int):
+    from db import db
+    from models import Actor
+    from serialization import FastJSONProvider, format_row, orjson, row_query
+
+    default_provider = DefaultJSONProvider(app)
+    fast_provider = FastJSONProvider(app)
+
+    def orm_objects():
+        actors = Actor.query.order_by(Actor.id).all()
+        default_provider.response(
+            {'actors': [actor.format() for actor in actors]})
+        db.session.remove()
+
+    def plain_rows():
+        rows = row_query(Actor.query, Actor).order_by(Actor.id).all()
+        fast_provider.response(
+            {'actors': [format_row(row, Actor) for row in rows]})
+        db.session.remove()
+
+    def encode_only(provider, payload):
+        return lambda: provider.response(payload)
+
+    with app.app_context():
+        rows = row_query(Actor.query, Actor).order_by(Actor.id).all()
+        payload = {'actors': [format_row(row, Actor) for row in rows]}
+        results = {
+            'ORM + format + stdlib (before)': best_of(orm_objects, repeat),
+            'encode only, stdlib': best_of(
+                encode_only(default_provider, payload), repeat),
+        }
+        if orjson is not None:
+            results['rows + orjson'] = best_of(plain_rows, repeat)
+            results['encode only, orjson'] = best_of(
+                encode_only(fast_provider, payload), repeat)
+        else:
+            print('orjson is not installed: only the fallback is measured')
+        with mock.patch('serialization.orjson', None):
+            results['rows + stdlib fallback'] = best_of(plain_rows, repeat)
+        db.session.remove()
+    return len(rows), results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--rows', type=int, default=10000)
+    parser.add_argument('-r', '--repeat', type=int, default=5)
+    add_db_arguments(parser)
+    args = parser.parse_args()
+
+    app = create_app(get_db_path(args.db, args.reset_db))
+    seed(app, args.rows)
+    rows, results = run(app, args.repeat)
+
+    print(f'rows: {rows}, best of {args.repeat}')
+    print(f"{'path':<34}{'ms':>9}{'rows/s':>12}")
+    for name, seconds in results.items():
+        print(f'{name:<34}{seconds * 1000:>9.1f}{rows / seconds:>12.0f}')
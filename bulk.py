@@ -0,0 +1,177 @@
+from os import getenv
+from flask import abort, jsonify
+from sqlalchemy import delete, insert, select
+from db import db
+from cache import invalidate_entities
+from models import bump_table_versions
+
+
+MAX_BATCH_SIZE = int(getenv('MAX_BATCH_SIZE', 1000))
+
+
+'''Return the list of items of a batch request body.
+
+    @INPUTS
+        body: the decoded json body
+        key: the key holding the items (i.e. 'actors' or 'ids')
+
+    Aborts with a 400 if the list is missing, empty or too large.
+'''
+
+
+def get_batch(body, key: str):
+    if not isinstance(body, dict) or not isinstance(body.get(key), list):
+        abort(400)
+    items = body[key]
+    if not items or len(items) > MAX_BATCH_SIZE:
+        abort(400)
+    return items
+
+
+'''Return the validated rows of a batch, and the errors of invalid items.
+
+    @INPUTS
+        items: the items of the batch
+        validate: callable returning a row for an item, or raising ValueError
+
+    Every item is validated, so all errors are reported at once.
+'''
+
+
+def validate_batch(items: list, validate):
+    rows = []
+    errors = []
+    for index, item in enumerate(items):
+        try:
+            rows.append(validate(item))
+        except ValueError as e:
+            errors.append({'index': index, 'message': str(e)})
+    return rows, errors
+
+
+def batch_errors_response(errors: list):
+    """Returns the 422 response listing the errors of a rejected batch"""
+    return jsonify({
+        'success': False,
+        'error': 422,
+        'message': 'unprocessable',
+        'errors': errors,
+    }), 422
+
+
+def ensure_object(item):
+    """Raises ValueError unless the batch item is a json object"""
+    if not isinstance(item, dict):
+        raise ValueError('Item must be an object')
+    return item
+
+
+def validate_id(item):
+    """Returns the item as an id, raising ValueError unless it's an int"""
+    if isinstance(item, bool) or not isinstance(item, int):
+        raise ValueError('Invalid id')
+    return item
+
+
+def find_duplicates(ids: list):
+    """Returns an error for each id repeated within the batch"""
+    seen = set()
+    errors = []
+    for index, id in enumerate(ids):
+        if id in seen:
+            errors.append(
+                {'index': index, 'id': id, 'message': 'duplicate id'})
+        seen.add(id)
+    return errors
+
+
+'''Return an error for each id of the batch that doesn't exist.
+
+    @INPUTS
+        model: the model being updated or deleted
+        ids: the ids of the batch, in order
+
+    Existence is checked with a single `WHERE id IN (...)` query.
+'''
+
+
+def find_missing(model, ids: list):
+    table = model.__table__
+    existing = set(db.session.execute(
+        select(table.c.id).where(table.c.id.in_(ids))).scalars())
+    return [
+        {'index': index, 'id': id, 'message': 'not found'}
+        for index, id in enumerate(ids)
+        if id not in existing
+    ]
+
+
+def get_by_ids(model, ids):
+    """Returns the entities with the given ids, to associate them with
+    another entity. Aborts with a 422 if any is invalid or missing"""
+    if not isinstance(ids, list):
+        abort(422)
+    try:
+        ids = {validate_id(id) for id in ids}
+    except ValueError:
+        abort(422)
+    entities = model.query.filter(model.id.in_(ids)).all() if ids else []
+    if len(entities) != len(ids):
+        abort(422)
+    return entities
+
+
+'''Insert the rows in a single statement and return their new ids.
+
+    @INPUTS
+        model: the model to insert
+        rows: dicts of column values
+
+    Uses one multi-row `INSERT ... RETURNING id` where the dialect supports
+    it, falling back to one insert per row (in the same transaction) otherwise.
+'''
+
+
+def bulk_insert(model, rows: list):
+    table = model.__table__
+    if db.session.get_bind().dialect.full_returning:
+        result = db.session.execute(
+            insert(table).values(rows).returning(table.c.id))
+        ids = list(result.scalars())
+    else:
+        ids = [
+            db.session.execute(insert(table).values(row))
+            .inserted_primary_key[0]
+            for row in rows
+        ]
+    bump_table_versions(db.session, [table.name])
+    db.session.commit()
+    return ids
+
+
+def bulk_update(model, rows: list):
+    """Updates the rows (dicts including their id) in a single transaction"""
+    db.session.bulk_update_mappings(model, rows)
+    bump_table_versions(db.session, [model.__tablename__])
+    db.session.commit()
+    invalidate_entities(model, [row['id'] for row in rows])
+
+
+def bulk_delete(model, ids: list):
+    """Deletes the rows with the given ids, and their associations, in a
+    single statement per table"""
+    table = model.__table__
+    names = [table.name]
+    for prop in model.__mapper__.relationships:
+        if prop.secondary is None:
+            continue
+        # not left to ON DELETE CASCADE, which SQLite doesn't enforce
+        column = next(
+            column for column in prop.secondary.c
+            if column.references(table.c.id))
+        db.session.execute(delete(prop.secondary).where(column.in_(ids)))
+        names.append(prop.secondary.name)
+    db.session.execute(delete(table).where(table.c.id.in_(ids)))
+    bump_table_versions(db.session, names)
+    db.session.commit()
+    invalidate_entities(model, ids)
@@ -0,0 +1,202 @@
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from os import getenv
+from db import db
+from projection import include_relations, project
+from replicas import reads_own_writes
+
+
+class CacheBackend():
+    """Interface of the entity cache backends"""
+
+    def get(self, key: str):
+        """Returns the cached value, or None"""
+        raise NotImplementedError
+
+    def set(self, key: str, value, ttl: float):
+        raise NotImplementedError
+
+    def delete(self, *keys: str):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def stats(self):
+        return {}
+
+
+class LRUCache(CacheBackend):
+    """In-process LRU cache whose entries expire after their ttl.
+
+    Each worker process has its own, so writes handled by one worker only
+    invalidate that worker's entries: other workers may serve stale entities
+    for up to the ttl. Use a shared backend (see RedisCache) to avoid that.
+    """
+
+    def __init__(self, max_size: int = None):
+        self.max_size = max_size if max_size is not None else int(
+            getenv('ENTITY_CACHE_SIZE', 10000))
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() >= entry[0]:
+                self._counters['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._counters['hits'] += 1
+            return entry[1]
+
+    def set(self, key: str, value, ttl: float):
+        if self.max_size <= 0 or ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._counters['evictions'] += 1
+
+    def delete(self, *keys: str):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            for counter in self._counters:
+                self._counters[counter] = 0
+
+    def stats(self):
+        return {**self._counters, 'size': len(self._entries)}
+
+
+class RedisCache(CacheBackend):
+    """Cache shared by all workers, on a Redis-compatible client.
+
+    The client only needs `get`, `set(key, value, ex=seconds)`, `delete` and
+    `scan_iter`, as provided by redis-py.
+    """
+
+    def __init__(self, client, prefix: str = 'castingagency:'):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key: str):
+        value = self.client.get(self.prefix + key)
+        return None if value is None else pickle.loads(value)
+
+    def set(self, key: str, value, ttl: float):
+        if ttl <= 0:
+            return
+        self.client.set(
+            self.prefix + key, pickle.dumps(value), ex=max(int(ttl), 1))
+
+    def delete(self, *keys: str):
+        if keys:
+            self.client.delete(*(self.prefix + key for key in keys))
+
+    def clear(self):
+        keys = list(self.client.scan_iter(match=self.prefix + '*'))
+        if keys:
+            self.client.delete(*keys)
+
+
+ENTITY_CACHE_TTL = float(getenv('ENTITY_CACHE_TTL', 60))
+
+entity_cache: CacheBackend = LRUCache()
+
+
+def set_entity_cache(backend: CacheBackend):
+    """Replaces the entity cache backend"""
+    global entity_cache
+    entity_cache = backend
+
+
+def configure_entity_cache():
+    """Uses Redis for the entity cache when ENTITY_CACHE_REDIS_URL is set"""
+    url = getenv('ENTITY_CACHE_REDIS_URL', None)
+    if not url:
+        return
+    try:
+        import redis
+    except ImportError:
+        raise RuntimeError(
+            'ENTITY_CACHE_REDIS_URL is set but redis is not installed')
+    set_entity_cache(RedisCache(redis.Redis.from_url(url)))
+
+
+def entity_key(model, id: int):
+    return f'{model.__tablename__}:{id}'
+
+
+def invalidate_entities(model, ids):
+    """Drops cached entities after they were written"""
+    entity_cache.delete(*(entity_key(model, id) for id in ids))
+
+
+def may_read_cache():
+    """Checks whether the current request may be served from the cache:
+    requests reading their own writes (see replicas.py) skip it, since it
+    may hold a version read before their write"""
+    return not reads_own_writes()
+
+
+def may_fill_cache():
+    """Checks whether the current session may fill the cache: only rows read
+    from the primary are cached, since a replica may still be behind"""
+    return db.session.info.get('route_to') is None and may_read_cache()
+
+
+def get_updated_at(model, id: int):
+    """Returns when an entity was last updated, or None if it doesn't exist.
+    Only reads its updated_at column, unless the entity is cached"""
+    cached = entity_cache.get(entity_key(model, id)) \
+        if may_read_cache() else None
+    if cached is not None:
+        return cached[1]
+    return model.query.with_entities(model.updated_at) \
+        .filter(model.id == id).scalar()
+
+
+'''Return a formatted entity and its last update, from the cache if possible.
+
+    @INPUTS
+        model: the entity's model
+        id: the entity's primary key
+        fields: only return these fields (see projection.py)
+        include: embed these relationships
+
+    Full entities are cached for ENTITY_CACHE_TTL seconds; requests for some
+    fields are served from a cached full entity, or else projected in SQL
+    (without filling the cache). Embedded relationships are never cached.
+    Only entities read from the primary are cached, and requests reading
+    their own writes bypass the cache. Returns None if the entity doesn't
+    exist.
+'''
+
+
+def get_entity(model, id: int, fields=None, include=()):
+    cached = None if include or not may_read_cache() \
+        else entity_cache.get(entity_key(model, id))
+    if cached is None:
+        columns = None if fields is None else (*fields, 'updated_at')
+        query = project(model.query, model, columns)
+        entity = include_relations(query, model, include).get(id)
+        if entity is None:
+            return None
+        cached = (entity.format(fields, include), entity.updated_at)
+        if fields is None and not include and may_fill_cache():
+            entity_cache.set(entity_key(model, id), cached, ENTITY_CACHE_TTL)
+        return cached
+    formatted, updated_at = cached
+    if fields is not None:
+        formatted = {field: formatted[field] for field in fields}
+    return formatted, updated_at
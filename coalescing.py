@@ -0,0 +1,119 @@
+import threading
+from os import getenv
+from flask import current_app, request
+from conditional import set_validators
+from db import db
+from replicas import reads_own_writes
+
+
+class Flight():
+    """A call in progress, whose result its followers wait for"""
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight():
+    """Runs concurrent calls with the same key once.
+
+    The first caller of a key (its leader) runs the function. Callers of
+    the same key arriving before it returns wait for it, and get its result
+    (or raise its exception) instead of running the function themselves.
+    Nothing is kept once the call returned: later callers run it anew.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self._counters = {'calls': 0, 'executions': 0, 'coalesced': 0}
+
+    def do(self, key, fn):
+        with self._lock:
+            self._counters['calls'] += 1
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Flight()
+                self._counters['executions'] += 1
+            else:
+                self._counters['coalesced'] += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = fn()
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def stats(self):
+        """Returns a snapshot of the counters, and the share of the calls
+        which were coalesced into another"""
+        with self._lock:
+            calls = self._counters['calls']
+            return {
+                **self._counters,
+                'in_flight': len(self._flights),
+                'collapse_ratio': self._counters['coalesced'] / max(calls, 1),
+            }
+
+    def clear(self):
+        with self._lock:
+            for counter in self._counters:
+                self._counters[counter] = 0
+
+
+read_flights = SingleFlight()
+
+
+'''Return the response of a JSON read, shared by identical concurrent reads.
+
+    @INPUTS
+        load: returns the document to serialize and its (ETag, Last-Modified),
+            or None if not found
+        version: what else the read depends on than its path, e.g. the ETag
+            of a list computed from its tables' versions
+
+    Within a worker, concurrent reads of the same path (and version) share
+    one run of `load`, database queries and serialization included, and get
+    the same body. Each request still builds its own response from it.
+    Returns None if `load` did. Requests reading their own writes (see
+    replicas.reads_own_writes) run their own reads, so they always see them.
+    Set READ_COALESCING_ENABLED=false to disable it.
+'''
+
+
+def coalesce_read(load, version=None):
+    def load_body():
+        loaded = load()
+        if loaded is None:
+            return None
+        document, validators = loaded
+        return current_app.json.response(document).get_data(), validators
+
+    if getenv('READ_COALESCING_ENABLED', 'true').lower() \
+            in ('0', 'false', 'no') or reads_own_writes():
+        loaded = load_body()
+    else:
+        # reads routed to different databases never share a load
+        loaded = read_flights.do(
+            (request.full_path, version, db.session.info.get('route_to')),
+            load_body)
+    if loaded is None:
+        return None
+    body, (etag, last_modified) = loaded
+    response = current_app.response_class(
+        body, mimetype=current_app.json.mimetype)
+    return set_validators(response, etag, last_modified)
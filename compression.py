@@ -0,0 +1,165 @@
+import threading
+import zlib
+from os import getenv
+from flask import request
+from instrumentation import timed
+
+try:
+    import brotli
+except ImportError:  # optional, see README
+    brotli = None
+
+
+# responses smaller than this (in bytes) aren't worth compressing
+MIN_SIZE = int(getenv('COMPRESSION_MIN_SIZE', 1024))
+# 1 (fastest) to 9 (smallest)
+GZIP_LEVEL = int(getenv('COMPRESSION_GZIP_LEVEL', 6))
+# 0 (fastest) to 11 (smallest)
+BROTLI_LEVEL = int(getenv('COMPRESSION_BROTLI_LEVEL', 4))
+
+COMPRESSIBLE_MIMETYPES = frozenset((
+    'application/json',
+    'application/x-ndjson',
+    'text/html',
+    'text/plain',
+))
+
+
+class CompressionStats():
+    """Counts the compressed responses and the bytes they saved"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._responses = 0
+            self._bytes_in = 0
+            self._bytes_out = 0
+
+    def record(self, bytes_in: int, bytes_out: int):
+        with self._lock:
+            self._responses += 1
+            self._bytes_in += bytes_in
+            self._bytes_out += bytes_out
+
+    def stats(self):
+        with self._lock:
+            return {
+                'responses': self._responses,
+                'bytes_in': self._bytes_in,
+                'bytes_out': self._bytes_out,
+            }
+
+
+compression_stats = CompressionStats()
+
+
+def get_encoding(accept_encodings):
+    """Returns the preferred encoding the client accepts, brotli (when
+    installed) over gzip, or None"""
+    if brotli is not None and accept_encodings['br']:
+        return 'br'
+    if accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+
+class Compressor():
+    """Incremental compressor of an encoding"""
+
+    def __init__(self, encoding: str):
+        if encoding == 'br':
+            compressor = brotli.Compressor(quality=BROTLI_LEVEL)
+            self.compress = compressor.process
+            self.finish = compressor.finish
+        else:
+            # wbits of 16 + MAX_WBITS write a gzip header and trailer
+            compressor = zlib.compressobj(
+                GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            self.compress = compressor.compress
+            self.finish = compressor.flush
+
+
+def compress(data: bytes, encoding: str):
+    compressor = Compressor(encoding)
+    return compressor.compress(data) + compressor.finish()
+
+
+def compress_stream(chunks, encoding: str):
+    """Compresses a streamed body as it is generated. Compressed bytes are
+    written whenever the compressor emits them, so memory stays flat"""
+    compressor = Compressor(encoding)
+    bytes_in = bytes_out = 0
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            bytes_in += len(chunk)
+            compressed = compressor.compress(chunk)
+            if compressed:
+                bytes_out += len(compressed)
+                yield compressed
+        compressed = compressor.finish()
+        bytes_out += len(compressed)
+        yield compressed
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
+    compression_stats.record(bytes_in, bytes_out)
+
+
+def compress_response(response):
+    if response.mimetype not in COMPRESSIBLE_MIMETYPES \
+            or response.direct_passthrough \
+            or 'Content-Encoding' in response.headers \
+            or request.method == 'HEAD' \
+            or response.status_code < 200 \
+            or response.status_code in (204, 304):
+        return response
+    # the body depends on Accept-Encoding, even when left uncompressed
+    response.vary.add('Accept-Encoding')
+    encoding = get_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        response.response = compress_stream(response.response, encoding)
+    else:
+        data = response.get_data()
+        if len(data) < MIN_SIZE:
+            return response
+        with timed('compress'):
+            compressed = compress(data, encoding)
+        compression_stats.record(len(data), len(compressed))
+        response.set_data(compressed)
+
+    response.headers['Content-Encoding'] = encoding
+    # the compressed body differs byte for byte, but not semantically
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+'''Compress the responses of clients accepting it.
+
+    @INPUTS
+        app: the Flask app
+
+    JSON, NDJSON and text responses are compressed with brotli (if the
+    brotli package is installed) or gzip, as negotiated with Accept-Encoding.
+    Responses under COMPRESSION_MIN_SIZE bytes are left as they are; streamed
+    responses are compressed chunk by chunk as they are generated. Set
+    COMPRESSION_ENABLED=false to disable it, e.g. behind a proxy which
+    compresses already. Registered after the instrumentation and request
+    logging, so that they see the compression.
+'''
+
+
+def setup_compression(app):
+    if getenv('COMPRESSION_ENABLED', 'true').lower() in ('0', 'false', 'no'):
+        return
+    app.after_request(compress_response)
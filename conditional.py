@@ -0,0 +1,88 @@
+import hashlib
+from datetime import timezone
+from flask import request, Response
+from models import get_relation_tables, get_table_versions
+from streaming import wants_ndjson
+
+
+def make_etag(*parts):
+    """Returns a strong ETag derived from the given version parts"""
+    return hashlib.sha1(
+        '|'.join(str(part) for part in parts).encode()).hexdigest()
+
+
+def as_utc(value):
+    """SQLite returns naive datetimes: they are stored in UTC"""
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def is_conditional(request):
+    return bool(request.if_none_match or request.if_modified_since)
+
+
+def entity_validators(model, id: int, updated_at, fields=None, include=()):
+    """Returns the (ETag, Last-Modified) of an entity (or of some of its
+    fields). Embedded relationships are versioned by their tables"""
+    parts = [model.__tablename__, id, as_utc(updated_at).isoformat(), fields]
+    last_modified = as_utc(updated_at)
+    if include:
+        versions = get_table_versions(get_relation_tables(model, include))
+        if versions is None:
+            return None, None
+        parts += [version for version, _ in versions]
+        last_modified = max(
+            last_modified, *(as_utc(at) for _, at in versions))
+    return make_etag(*parts), last_modified
+
+
+def list_validators(model, include=()):
+    """Returns the (ETag, Last-Modified) of the current request's list of
+    entities, from its tables' versions, or (None, None) if they have none"""
+    versions = get_table_versions(
+        [model.__tablename__, *get_relation_tables(model, include)])
+    if versions is None:
+        return None, None
+    etag = make_etag(
+        *(version for version, _ in versions),
+        request.full_path,
+        wants_ndjson(request),
+    )
+    return etag, max(as_utc(updated_at) for _, updated_at in versions)
+
+
+def set_validators(response, etag: str, last_modified=None):
+    """Sets the ETag and Last-Modified headers of a response"""
+    if etag is None:
+        return response
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = as_utc(last_modified)
+    return response
+
+
+'''Return a 304 response if the client's copy is still fresh, or None.
+
+    @INPUTS
+        etag: the current ETag of the resource
+        last_modified: when the resource last changed
+
+    If-None-Match takes precedence over If-Modified-Since, as in RFC 9110.
+    Last-Modified only has second precision, so it is compared as such.
+'''
+
+
+def not_modified(etag: str, last_modified=None):
+    if etag is None:
+        return None
+    if request.if_none_match:
+        fresh = request.if_none_match.contains_weak(etag)
+    elif request.if_modified_since and last_modified is not None:
+        fresh = as_utc(last_modified).replace(microsecond=0) \
+            <= request.if_modified_since
+    else:
+        fresh = False
+    if not fresh:
+        return None
+    return set_validators(Response(status=304), etag, last_modified)
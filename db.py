@@ -1,8 +1,27 @@
+import threading
+import time
 from os import getenv
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
 
 
-db = SQLAlchemy()
+class RoutingSession(Session):
+    """Session whose reads can be routed to another engine (i.e. a replica)
+    by setting `info['route_to']` to its bind key. Flushes always go to the
+    model's own (primary) engine."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        route_to = self.info.get('route_to')
+        if bind is None and route_to is not None and not self._flushing:
+            return self._db.engines[route_to]
+        return super().get_bind(
+            mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
 
 def build_db_path(db_dialect, db_user, db_password, db_host, db_name):
     db_path = "{}://{}:{}@{}/{}".format(
@@ -24,20 +43,197 @@ def get_db_path():
     return build_db_path(db_dialect, db_user, db_password, db_host, db_name)
 
 
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool keeping checkout counters, the time spent waiting for a
+    connection and the time connections are held.
+
+    Checkouts and checkins are counted by the pool's own events, so the
+    counters are updated under a lock however many threads share the pool.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+        self.hold_time_total = 0.0
+        self.hold_time_max = 0.0
+        self._stats_lock = threading.Lock()
+        event.listen(self, 'checkout', self._on_checkout)
+        event.listen(self, 'checkin', self._on_checkin)
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            return super().connect()
+        except exc.TimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - started
+            with self._stats_lock:
+                self.wait_time_total += waited
+                self.wait_time_max = max(self.wait_time_max, waited)
+
+    def recreate(self):
+        # the new pool inherits this one's listeners, and adds its own
+        event.remove(self, 'checkout', self._on_checkout)
+        event.remove(self, 'checkin', self._on_checkin)
+        return super().recreate()
+
+    def _on_checkout(self, dbapi_connection, connection_record,
+                     connection_proxy):
+        connection_record.info['checked_out_at'] = time.perf_counter()
+        with self._stats_lock:
+            self.checkouts += 1
+
+    def _on_checkin(self, dbapi_connection, connection_record):
+        checked_out_at = connection_record.info.pop('checked_out_at', None)
+        if checked_out_at is None:
+            return
+        held = time.perf_counter() - checked_out_at
+        with self._stats_lock:
+            self.hold_time_total += held
+            self.hold_time_max = max(self.hold_time_max, held)
+
+
+def get_replica_urls():
+    """Returns the read replica urls, from the comma separated
+    DB_REPLICA_URLS"""
+    urls = getenv('DB_REPLICA_URLS', '')
+    return [url.strip() for url in urls.split(',') if url.strip()]
+
+
+def get_bool_env(name: str, default: bool):
+    value = getenv(name, None)
+    if value is None:
+        return default
+    return value.lower() in ('1', 'true', 'yes', 'on')
+
+
+def get_engine_options(db_path: str):
+    """Returns the engine options, with pool settings read from the env"""
+    if db_path.startswith('sqlite'):
+        # SQLite uses single-connection pools which take no sizing options
+        return {}
+    return {
+        'poolclass': InstrumentedQueuePool,
+        'pool_size': int(getenv('DB_POOL_SIZE', 5)),
+        'max_overflow': int(getenv('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': float(getenv('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(getenv('DB_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': get_bool_env('DB_POOL_PRE_PING', True),
+        'connect_args': {
+            'connect_timeout': int(getenv('DB_CONNECT_TIMEOUT', 10)),
+        },
+    }
+
+
+def get_pool_stats(engine):
+    """Returns the checkout, overflow and wait time statistics of a pool"""
+    pool = engine.pool
+    stats = {'pool': type(pool).__name__, 'status': pool.status()}
+    if isinstance(pool, QueuePool):
+        stats.update({
+            'size': pool.size(),
+            'checked_in': pool.checkedin(),
+            'checked_out': pool.checkedout(),
+            'overflow': pool.overflow(),
+        })
+    if isinstance(pool, InstrumentedQueuePool):
+        stats.update({
+            'checkouts': pool.checkouts,
+            'timeouts': pool.timeouts,
+            'wait_time_total': pool.wait_time_total,
+            'wait_time_max': pool.wait_time_max,
+            'wait_time_avg': pool.wait_time_total / max(pool.checkouts, 1),
+            'hold_time_total': pool.hold_time_total,
+            'hold_time_max': pool.hold_time_max,
+        })
+    return stats
+
+
 def configure_app(app, db_path: str):
     """Configures the app with the provided settings"""
     app.config["SQLALCHEMY_DATABASE_URI"] = db_path
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = get_engine_options(db_path)
+
+    # read replicas are extra binds, without any models of their own
+    replicas = {
+        f'replica_{i}': {'url': url, **get_engine_options(url)}
+        for i, url in enumerate(get_replica_urls())
+    }
+    app.config["SQLALCHEMY_BINDS"] = replicas
+    app.config["DB_REPLICAS"] = list(replicas)
+
+
+def dispose_engines(app):
+    """Drops the pooled connections of the app's engines, so that a forked
+    process never shares the sockets of its parent's connections"""
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose()
+
+
+def create_db(app, drop: bool = False):
+    """Creates the tables (and search structures) missing from the database,
+    after dropping every table if asked to"""
+    # only the primary: replicas get their schema through replication
+    with app.app_context():
+        if drop:
+            db.drop_all(bind_key=None)
+        db.create_all(bind_key=None)
+
+
+def defer_create_db(app):
+    """Creates the missing tables on the first request of the process,
+    rather than on boot"""
+    lock = threading.Lock()
+    created = False
+
+    def create_db_on_first_request():
+        nonlocal created
+        if created:
+            return
+        with lock:
+            if not created:
+                create_db(app)
+                created = True
+
+    app.before_request(create_db_on_first_request)
+
+
+# how setup_db initializes the schema (see README)
+DB_INIT_MODES = ('none', 'eager', 'lazy')
+
+
+'''Initialize the database using the provided app instance and options.
+
+    @INPUTS
+        app: the Flask app
+        db_path: the database url
+        drop_db: drop and recreate every table (for tests and benchmarks)
+
+    Booting doesn't touch the database by default (DB_INIT=none): the schema
+    is created with `flask create-db` or migrated with `flask db upgrade`, so
+    workers start without issuing reflection queries. DB_INIT=eager creates
+    the missing tables on boot, and DB_INIT=lazy on the first request.
+'''
 
 
 def setup_db(app, db_path: str, drop_db: bool = False):
-    """Initialize the database using the provided app instance and options"""
     configure_app(app, db_path=db_path)
 
     app.db = db
     db.app = app
     db.init_app(app)
 
-    with app.app_context():
-        if drop_db:
-            db.drop_all()
-        db.create_all()
+    mode = getenv('DB_INIT', 'none').lower()
+    if mode not in DB_INIT_MODES:
+        raise ValueError(f'Invalid DB_INIT: {mode}')
+    if drop_db or mode == 'eager':
+        create_db(app, drop=drop_db)
+    elif mode == 'lazy':
+        defer_create_db(app)
@@ -1,5 +1,5 @@
 from flask import jsonify
-from auth import AuthError
+from auth import AuthError, RateLimitError
 
 
 # Error Handling
@@ -43,3 +43,11 @@ def app_error_handling(app):
             'error': error.status_code,
             'message': error.error['description']
         }), error.status_code,
+
+    @app.errorhandler(RateLimitError)
+    def handle_rate_limit_error(error: RateLimitError):
+        return jsonify({
+            'success': False,
+            'error': error.status_code,
+            'message': error.error['description']
+        }), error.status_code, error.headers
@@ -0,0 +1,54 @@
+from datetime import date
+from flask import abort
+from sqlalchemy import func
+
+
+def escape_like(value: str):
+    """Escapes the LIKE wildcards of a value, with backslashes"""
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def parse_date(value: str):
+    """Returns the date of an ISO formatted query arg, or aborts with a 400"""
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        abort(400, 'Invalid date')
+
+
+'''Return the query filtered by the filters of a request.
+
+    @INPUTS
+        query: the query to filter
+        model: the queried model, whose prefix_filters and range_filters
+            are allowed
+        args: the request's query args
+
+    `?<column>_prefix=` matches the rows whose column starts with the value,
+    ignoring case, as `lower(column) LIKE 'value%'`, which the column's
+    `_prefix` index serves. `?<column>_from=` and `?<column>_to=` match the
+    rows whose (date) column is within the inclusive range. Invalid values
+    abort with a 400.
+'''
+
+
+def filter_query(query, model, args):
+    for field in model.prefix_filters:
+        prefix = args.get(f'{field}_prefix')
+        if prefix is None:
+            continue
+        if not prefix:
+            abort(400, 'Invalid prefix')
+        column = func.lower(getattr(model, field))
+        query = query.filter(
+            column.like(escape_like(prefix.lower()) + '%', escape='\\'))
+
+    for field in model.range_filters:
+        column = getattr(model, field)
+        start = args.get(f'{field}_from')
+        if start is not None:
+            query = query.filter(column >= parse_date(start))
+        end = args.get(f'{field}_to')
+        if end is not None:
+            query = query.filter(column <= parse_date(end))
+    return query
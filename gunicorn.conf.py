@@ -0,0 +1,69 @@
+"""Production gunicorn settings: `gunicorn -c gunicorn.conf.py`
+
+Every setting can be overridden from the environment (see README).
+"""
+import gc
+import logging
+import multiprocessing
+from os import getenv
+from db import get_bool_env
+
+
+wsgi_app = 'app:create_app()'
+bind = getenv('GUNICORN_BIND', f"0.0.0.0:{getenv('PORT', '8080')}")
+
+# sync: one request per worker at a time. gthread: `threads` requests per
+# worker. gevent: many per worker, cooperatively (pip install gevent
+# psycogreen)
+worker_class = getenv('GUNICORN_WORKER_CLASS', 'sync')
+workers = int(getenv(
+    'GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+threads = int(getenv(
+    'GUNICORN_THREADS', 4 if worker_class == 'gthread' else 1))
+worker_connections = int(getenv('GUNICORN_WORKER_CONNECTIONS', 1000))
+
+timeout = int(getenv('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(getenv('GUNICORN_KEEPALIVE', 5))
+# recycle workers now and then, with jitter so they don't restart together
+max_requests = int(getenv('GUNICORN_MAX_REQUESTS', 0))
+max_requests_jitter = int(getenv('GUNICORN_MAX_REQUESTS_JITTER', 0))
+
+# load the app once in the master, so the workers share its memory pages
+preload_app = get_bool_env('GUNICORN_PRELOAD', True)
+
+# the requests are logged by the app, as JSON lines (see request_logging.py)
+accesslog = getenv('GUNICORN_ACCESS_LOG', None)
+errorlog = '-'
+loglevel = getenv('GUNICORN_LOG_LEVEL', 'info')
+
+
+def when_ready(server):
+    # move everything loaded so far out of the collector's reach: collecting
+    # it would write to (and so copy) the pages the workers share with the
+    # master
+    if preload_app:
+        gc.freeze()
+
+
+def pre_fork(server, worker):
+    # the master mustn't hold connections its workers would inherit
+    if preload_app:
+        from db import dispose_engines
+        dispose_engines(server.app.wsgi())
+
+
+def post_fork(server, worker):
+    if worker_class == 'gevent':
+        try:
+            from psycogreen.gevent import patch_psycopg
+        except ImportError:
+            logging.getLogger('gunicorn.error').warning(
+                'psycogreen is not installed: queries block the gevent loop')
+        else:
+            patch_psycopg()
+    if preload_app:
+        from db import dispose_engines
+        from request_logging import restart_listener
+        dispose_engines(server.app.wsgi())
+        restart_listener()
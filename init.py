@@ -1,6 +1,18 @@
 from flask_cors import CORS
-from db import setup_db
+from flask import jsonify
+from db import db, get_pool_stats, setup_db
+import cache
+from cache import configure_entity_cache
+from coalescing import read_flights
+from compression import compression_stats, setup_compression
+from instrumentation import metrics, setup_instrumentation
+from jwks import jwks_store
+import rate_limit
+from rate_limit import configure_rate_limiter
+from token_cache import token_cache
 from migrate import setup_migrations
+from replicas import router, setup_replicas
+from request_logging import setup_request_logging
 from actors.routes import actors_blueprint
 from movies.routes import movies_blueprint
 from errors import app_error_handling
@@ -10,16 +22,47 @@ def init_app(app, db_path: str = None, drop_db: bool = False):
 
     # setup middleware
     CORS(app)
+    setup_instrumentation(app)
+    setup_request_logging(app)
+    setup_compression(app)
 
     # initialize db
     setup_db(app, db_path=db_path, drop_db=drop_db)
+    setup_replicas(app)
+
+    configure_entity_cache()
+    configure_rate_limiter()
 
     setup_migrations(app)
 
+    # expose the subsystems' counters on /metrics
+    metrics.register_collector('jwks', jwks_store.stats)
+    metrics.register_collector('token_cache', token_cache.stats)
+    metrics.register_collector(
+        'rate_limit', lambda: rate_limit.rate_limiter.stats())
+    metrics.register_collector(
+        'entity_cache', lambda: cache.entity_cache.stats())
+    metrics.register_collector('replica_routing', router.stats)
+    metrics.register_collector('db_pool', lambda: get_pool_stats(db.engine))
+    metrics.register_collector('compression', compression_stats.stats)
+    metrics.register_collector('read_coalescing', read_flights.stats)
+
     @app.route('/healthcheck', methods=['GET'])
     def healthcheck():
         return 'OK', 200
 
+    @app.route('/healthcheck/pool', methods=['GET'])
+    def pool_diagnostics():
+        return jsonify({
+            'success': True,
+            'pool': get_pool_stats(db.engine),
+            'replicas': {
+                replica: get_pool_stats(db.engines[replica])
+                for replica in app.config['DB_REPLICAS']
+            },
+            'routing': router.stats(),
+        }), 200
+
     # register routes
     app.register_blueprint(actors_blueprint)
     app.register_blueprint(movies_blueprint)
@@ -0,0 +1,242 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from os import getenv
+from flask import g, has_app_context, request, Response
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from serialization import FastJSONProvider
+
+
+# upper bounds (in seconds) of the latency histogram buckets
+BUCKETS = tuple(
+    float(bucket) for bucket in getenv(
+        'METRICS_BUCKETS',
+        '0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10',
+    ).split(',')
+)
+
+# phases of a request, in the order of the Server-Timing header
+PHASES = ('auth', 'jwks', 'db', 'serialize', 'compress')
+
+
+class Histogram():
+    """Cumulative latency histogram, in the Prometheus fashion"""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        # the last count is for observations above every bucket (+Inf)
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self):
+        total = 0
+        for count in self.counts:
+            total += count
+            yield total
+
+
+class Metrics():
+    """Request latency histograms, per endpoint and per phase, and gauges
+    collected from the other subsystems when scraped"""
+
+    def __init__(self):
+        self._requests = {}
+        self._phases = {}
+        self._collectors = {}
+        self._lock = threading.Lock()
+
+    def observe_request(self, endpoint: str, method: str, status: int,
+                        duration: float, phases: dict):
+        with self._lock:
+            key = (endpoint, method, str(status))
+            if key not in self._requests:
+                self._requests[key] = Histogram()
+            self._requests[key].observe(duration)
+            for phase, phase_duration in phases.items():
+                key = (endpoint, phase)
+                if key not in self._phases:
+                    self._phases[key] = Histogram()
+                self._phases[key].observe(phase_duration)
+
+    def register_collector(self, name: str, collect):
+        """Exposes the numbers of the dict returned by `collect()` as
+        `castingagency_<name>_<key>` gauges"""
+        self._collectors[name] = collect
+
+    def clear(self):
+        with self._lock:
+            self._requests = {}
+            self._phases = {}
+
+    def render(self):
+        """Returns the metrics in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            render_histograms(
+                lines,
+                'http_request_duration_seconds',
+                'Duration of the requests, per endpoint',
+                ('endpoint', 'method', 'status'),
+                self._requests,
+            )
+            render_histograms(
+                lines,
+                'http_request_phase_duration_seconds',
+                'Time spent in each phase of the requests, per endpoint',
+                ('endpoint', 'phase'),
+                self._phases,
+            )
+        for name, collect in sorted(self._collectors.items()):
+            for key, value in sorted(collect().items()):
+                if isinstance(value, bool) \
+                        or not isinstance(value, (int, float)):
+                    continue
+                metric = f'castingagency_{name}_{key}'
+                lines.append(f'# TYPE {metric} gauge')
+                lines.append(f'{metric} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(names, values, **extra):
+    labels = [*zip(names, values), *extra.items()]
+    return ','.join(
+        '{}="{}"'.format(
+            name,
+            str(value).replace('\\', '\\\\').replace('"', '\\"'))
+        for name, value in labels
+    )
+
+
+def render_histograms(lines, metric, help, label_names, histograms):
+    lines.append(f'# HELP {metric} {help}')
+    lines.append(f'# TYPE {metric} histogram')
+    for labels, histogram in sorted(histograms.items()):
+        bounds = [*(repr(bucket) for bucket in histogram.buckets), '+Inf']
+        for bound, count in zip(bounds, histogram.cumulative_counts()):
+            lines.append('{}_bucket{{{}}} {}'.format(
+                metric, format_labels(label_names, labels, le=bound), count))
+        label_values = format_labels(label_names, labels)
+        lines.append(f'{metric}_sum{{{label_values}}} {histogram.sum}')
+        lines.append(f'{metric}_count{{{label_values}}} {histogram.count}')
+
+
+metrics = Metrics()
+
+
+def add_timing(phase: str, duration: float):
+    """Adds time (in seconds) spent in a phase of the current request"""
+    if has_app_context():
+        timings = g.setdefault('timings', {})
+        timings[phase] = timings.get(phase, 0) + duration
+
+
+@contextmanager
+def timed(phase: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_timing(phase, time.perf_counter() - started)
+
+
+def get_timings():
+    """Returns the phases timed so far in the current request, in seconds"""
+    return dict(g.get('timings', {}))
+
+
+class TimedJSONProvider(FastJSONProvider):
+    """JSON provider timing serialization"""
+
+    def dumps(self, obj, **kwargs):
+        with timed('serialize'):
+            return super().dumps(obj, **kwargs)
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    if context is not None:
+        context.query_started = time.perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context,
+                         executemany):
+    started = getattr(context, 'query_started', None)
+    if started is not None and has_app_context():
+        add_timing('db', time.perf_counter() - started)
+        g.db_statements = g.get('db_statements', 0) + 1
+
+
+def start_timer():
+    g.request_started = time.perf_counter()
+
+
+def get_request_duration():
+    """Returns the time since the current request started, in seconds"""
+    started = g.get('request_started')
+    return None if started is None else time.perf_counter() - started
+
+
+def server_timing(timings: dict, total: float):
+    """Formats the timings as a Server-Timing header value"""
+    entries = [
+        f'{phase};dur={timings[phase] * 1000:.3f}'
+        for phase in PHASES if phase in timings
+    ]
+    entries.append(f'total;dur={total * 1000:.3f}')
+    return ', '.join(entries)
+
+
+def record_request(response):
+    duration = get_request_duration()
+    if duration is None:
+        return response
+    timings = get_timings()
+    if getenv('SERVER_TIMING_ENABLED', 'false').lower() in ('1', 'true'):
+        response.headers['Server-Timing'] = server_timing(timings, duration)
+    metrics.observe_request(
+        request.endpoint or 'unmatched',
+        request.method,
+        response.status_code,
+        duration,
+        timings,
+    )
+    return response
+
+
+def metrics_endpoint():
+    return Response(
+        metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+'''Time the phases of every request.
+
+    @INPUTS
+        app: the Flask app
+
+    Requests are broken down into auth (including jwks, fetching signing
+    keys), db (the SQL statements), serialize (JSON encoding), compress and
+    total time.
+    They are aggregated into histograms per endpoint served on /metrics, and
+    returned in a Server-Timing header when SERVER_TIMING_ENABLED is set.
+'''
+
+
+def setup_instrumentation(app):
+    app.json_provider_class = TimedJSONProvider
+    app.json = TimedJSONProvider(app)
+    if not event.contains(Engine, 'before_cursor_execute',
+                          before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+    app.before_request(start_timer)
+    app.after_request(record_request)
+    if getenv('METRICS_ENABLED', 'true').lower() in ('1', 'true'):
+        app.add_url_rule('/metrics', 'metrics', metrics_endpoint)
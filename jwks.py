@@ -0,0 +1,213 @@
+import json
+import re
+import threading
+import time
+from os import getenv
+from urllib.request import urlopen
+
+
+class JWKSError(Exception):
+    """Raised when the key set can't be fetched and nothing is cached"""
+
+
+'''Return the max-age (in seconds) from a Cache-Control header, if any.
+
+    @INPUTS
+        cache_control: the raw Cache-Control header value (or None)
+
+    no-cache / no-store are treated as a max-age of 0 (which the key store
+    raises to its min_ttl).
+'''
+
+
+def parse_max_age(cache_control: str | None):
+    if not cache_control:
+        return None
+    directives = cache_control.lower()
+    if 'no-store' in directives or 'no-cache' in directives:
+        return 0
+    match = re.search(r'max-age\s*=\s*"?(\d+)"?', directives)
+    if not match:
+        return None
+    return int(match.group(1))
+
+
+def get_jwks_url():
+    """Returns the JWKS url, defaulting to the Auth0 tenant's well-known url"""
+    url = getenv('JWKS_URL', None)
+    if url:
+        return url
+    auth0_domain = getenv('AUTH0_DOMAIN', None)
+    return f'https://{auth0_domain}/.well-known/jwks.json'
+
+
+class JWKSKeyStore():
+    """In-process store of the signing keys published in a JWKS document.
+
+    Keys are cached by `kid` for the max-age advertised by the provider
+    (falling back to `ttl`), but at least `min_ttl` seconds, so a provider
+    sending `no-cache` isn't fetched on every request. Once expired, keys
+    keep being served for up to `stale_ttl` seconds while a single
+    background refresh runs (at most one per `min_ttl`), so a slow
+    provider never blocks requests. An unknown `kid` forces one synchronous
+    refresh (rate limited by `min_refresh_interval`) to pick up rotated keys.
+    """
+
+    def __init__(
+        self,
+        url: str = None,
+        ttl: float = None,
+        stale_ttl: float = None,
+        min_refresh_interval: float = None,
+        min_ttl: float = None,
+        timeout: float = None,
+        background: bool = True,
+    ):
+        self.url = url
+        self.ttl = ttl if ttl is not None else float(
+            getenv('JWKS_CACHE_TTL', 600))
+        self.stale_ttl = stale_ttl if stale_ttl is not None else float(
+            getenv('JWKS_STALE_TTL', 3600))
+        self.min_refresh_interval = (
+            min_refresh_interval if min_refresh_interval is not None
+            else float(getenv('JWKS_MIN_REFRESH_INTERVAL', 30)))
+        self.min_ttl = min_ttl if min_ttl is not None else float(
+            getenv('JWKS_MIN_TTL', 5))
+        self.timeout = timeout if timeout is not None else float(
+            getenv('JWKS_FETCH_TIMEOUT', 5))
+        self.background = background
+
+        self._keys = {}
+        self._fetched_at = None
+        self._attempted_at = None
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._counters = {
+            'hits': 0,
+            'stale_hits': 0,
+            'misses': 0,
+            'refreshes': 0,
+            'refresh_errors': 0,
+        }
+
+    def _count(self, counter: str):
+        # counters are advisory, the GIL keeps `+=` on a dict slot safe enough
+        self._counters[counter] += 1
+
+    def _fetch(self):
+        """Fetches the key set, returning the keys by kid and their max-age"""
+        # !!NOTE urlopen has a common certificate error described here:
+        # https://stackoverflow.com/questions/50236117
+        url = self.url or get_jwks_url()
+        with urlopen(url, timeout=self.timeout) as response:
+            max_age = parse_max_age(response.headers.get('Cache-Control'))
+            jwks = json.loads(response.read())
+        keys = {}
+        for key in jwks.get('keys', []):
+            if 'kid' not in key:
+                continue
+            keys[key['kid']] = {
+                'kty': key['kty'],
+                'kid': key['kid'],
+                'use': key.get('use', 'sig'),
+                'n': key['n'],
+                'e': key['e'],
+            }
+        return keys, max_age
+
+    def refresh(self):
+        """Synchronously re-fetches the key set, keeping old keys on failure"""
+        self._attempted_at = time.monotonic()
+        try:
+            keys, max_age = self._fetch()
+        except Exception as e:
+            self._count('refresh_errors')
+            if not self._keys:
+                raise JWKSError(f'Unable to fetch JWKS: {e}') from e
+            return False
+        now = time.monotonic()
+        ttl = max(self.ttl if max_age is None else max_age, self.min_ttl)
+        with self._lock:
+            self._keys = keys
+            self._fetched_at = now
+            self._expires_at = now + ttl
+        self._count('refreshes')
+        return True
+
+    def _refresh_in_background(self):
+        # skip if one was attempted lately (and failed, since the keys
+        # expired), or is already in flight
+        attempted_at = self._attempted_at
+        if attempted_at is not None \
+                and time.monotonic() - attempted_at < self.min_ttl:
+            return
+        if not self._refresh_lock.acquire(blocking=False):
+            return
+
+        def run():
+            try:
+                self.refresh()
+            except JWKSError:
+                pass
+            finally:
+                self._refresh_lock.release()
+
+        if self.background:
+            threading.Thread(target=run, daemon=True).start()
+        else:
+            run()
+
+    def _refresh_once(self):
+        """Refreshes unless another caller refreshed while we waited"""
+        fetched_at = self._fetched_at
+        with self._refresh_lock:
+            if fetched_at != self._fetched_at:
+                return
+            self.refresh()
+
+    def get_key(self, kid: str):
+        """Returns the RSA key for the given kid, or None if it isn't
+        published"""
+        now = time.monotonic()
+        key = self._keys.get(kid)
+
+        if key and now < self._expires_at:
+            self._count('hits')
+            return key
+
+        if key and now < self._expires_at + self.stale_ttl:
+            # stale-while-revalidate
+            self._count('stale_hits')
+            self._refresh_in_background()
+            return key
+
+        self._count('misses')
+        recently_refreshed = (
+            self._fetched_at is not None
+            and now - self._fetched_at < self.min_refresh_interval
+        )
+        if kid in self._keys or not recently_refreshed:
+            self._refresh_once()
+        return self._keys.get(kid)
+
+    def stats(self):
+        """Returns a snapshot of the cache counters"""
+        return {
+            **self._counters,
+            'keys': len(self._keys),
+            'expires_in': max(self._expires_at - time.monotonic(), 0.0),
+        }
+
+    def clear(self):
+        """Drops all cached keys and resets the counters"""
+        with self._lock:
+            self._keys = {}
+            self._fetched_at = None
+            self._attempted_at = None
+            self._expires_at = 0.0
+            for counter in self._counters:
+                self._counters[counter] = 0
+
+
+jwks_store = JWKSKeyStore()
@@ -1,8 +1,34 @@
-from flask_migrate import Migrate
-from db import db
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from flask_migrate import Migrate, stamp
+from db import create_db, db
 
 migrate = Migrate()
 
 
+def include_object(object, name, type_, reflected, compare_to):
+  """Keeps autogenerate from dropping the full-text search structures,
+  which are maintained by hand (see models.create_search_index)"""
+  if type_ == 'column' and name == 'search_vector':
+    return False
+  if type_ == 'index' and reflected and compare_to is None \
+      and (name.endswith('_search_vector') or name.endswith('_trgm')):
+    return False
+  return True
+
+
+@click.command('create-db')
+@click.option('--drop', is_flag=True, help='Drop every table first.')
+@with_appcontext
+def create_db_command(drop):
+  """Creates the tables of a new database, and marks every migration as
+  applied. Migrate an existing database with `flask db upgrade` instead."""
+  create_db(current_app, drop=drop)
+  stamp()
+  click.echo('Created the database schema.')
+
+
 def setup_migrations(app):
-  migrate.init_app(app, db)
+  migrate.init_app(app, db, include_object=include_object)
+  app.cli.add_command(create_db_command)
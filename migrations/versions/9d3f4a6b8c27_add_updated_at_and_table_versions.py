@@ -0,0 +1,45 @@
+"""add updated_at and table_versions
+
+Revision ID: 9d3f4a6b8c27
+Revises: 5b1e0c2a7d41
+Create Date: 2026-10-18 09:31:02.540871
+
+"""
+from datetime import datetime, timezone
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d3f4a6b8c27'
+down_revision = '5b1e0c2a7d41'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table in ('movies', 'actors'):
+        op.add_column(table, sa.Column(
+            'updated_at',
+            sa.DateTime(timezone=True),
+            server_default=sa.func.now(),
+            nullable=False,
+        ))
+    table_versions = op.create_table(
+        'table_versions',
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('version', sa.BigInteger(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint('name')
+    )
+    now = datetime.now(timezone.utc)
+    op.bulk_insert(table_versions, [
+        {'name': name, 'version': 0, 'updated_at': now}
+        for name in ('movies', 'actors')
+    ])
+
+
+def downgrade():
+    op.drop_table('table_versions')
+    for table in ('actors', 'movies'):
+        op.drop_column(table, 'updated_at')
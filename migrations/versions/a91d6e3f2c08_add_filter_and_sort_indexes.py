@@ -0,0 +1,37 @@
+"""add filter and sort indexes
+
+Revision ID: a91d6e3f2c08
+Revises: e7b2d5c81a6f
+Create Date: 2026-10-18 15:07:12.538204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a91d6e3f2c08'
+down_revision = 'e7b2d5c81a6f'
+branch_labels = None
+depends_on = None
+
+# the case-insensitive prefix filtered column of each table
+PREFIXED = {'movies': 'title', 'actors': 'name'}
+
+
+def upgrade():
+    for table, column in PREFIXED.items():
+        op.create_index(
+            f'ix_{table}_{column}_prefix',
+            table,
+            [sa.text(f'lower({column}) text_pattern_ops')],
+        )
+        op.create_index(f'ix_{table}_{column}_id', table, [column, 'id'])
+    op.create_index('ix_actors_birthdate_id', 'actors', ['birthdate', 'id'])
+
+
+def downgrade():
+    op.drop_index('ix_actors_birthdate_id', table_name='actors')
+    for table, column in PREFIXED.items():
+        op.drop_index(f'ix_{table}_{column}_id', table_name=table)
+        op.drop_index(f'ix_{table}_{column}_prefix', table_name=table)
@@ -0,0 +1,51 @@
+"""add castings
+
+Revision ID: c4a8e1f09b53
+Revises: 9d3f4a6b8c27
+Create Date: 2026-10-18 11:04:27.913652
+
+"""
+from datetime import datetime, timezone
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4a8e1f09b53'
+down_revision = '9d3f4a6b8c27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'castings',
+        sa.Column('movie_id', sa.Integer(), nullable=False),
+        sa.Column('actor_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ['actor_id'], ['actors.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(
+            ['movie_id'], ['movies.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('movie_id', 'actor_id')
+    )
+    op.create_index(
+        op.f('ix_castings_actor_id'), 'castings', ['actor_id'], unique=False)
+    table_versions = sa.table(
+        'table_versions',
+        sa.column('name', sa.String()),
+        sa.column('version', sa.BigInteger()),
+        sa.column('updated_at', sa.DateTime(timezone=True)),
+    )
+    op.bulk_insert(table_versions, [
+        {
+            'name': 'castings',
+            'version': 0,
+            'updated_at': datetime.now(timezone.utc),
+        },
+    ])
+
+
+def downgrade():
+    op.execute("DELETE FROM table_versions WHERE name = 'castings'")
+    op.drop_index(op.f('ix_castings_actor_id'), table_name='castings')
+    op.drop_table('castings')
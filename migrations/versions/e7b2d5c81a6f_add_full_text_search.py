@@ -0,0 +1,64 @@
+"""add full-text search
+
+Revision ID: e7b2d5c81a6f
+Revises: c4a8e1f09b53
+Create Date: 2026-10-18 13:22:51.407315
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7b2d5c81a6f'
+down_revision = 'c4a8e1f09b53'
+branch_labels = None
+depends_on = None
+
+SEARCHED = {
+    'movies': (
+        "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+        "setweight(to_tsvector('english', coalesce(description, '')), 'B')",
+        'title',
+    ),
+    'actors': (
+        "setweight(to_tsvector('english', coalesce(name, '')), 'A')",
+        'name',
+    ),
+}
+
+
+def upgrade():
+    connection = op.get_bind()
+    # fuzzy matching is only available where the pg_trgm extension is
+    has_trigram = connection.execute(sa.text(
+        "SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'"
+    )).scalar()
+    if has_trigram:
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+
+    for table, (vector, trigram_column) in SEARCHED.items():
+        op.execute(
+            f'ALTER TABLE {table} ADD COLUMN search_vector tsvector '
+            f'GENERATED ALWAYS AS ({vector}) STORED')
+        op.create_index(
+            f'ix_{table}_search_vector',
+            table,
+            ['search_vector'],
+            postgresql_using='gin',
+        )
+        if has_trigram:
+            op.create_index(
+                f'ix_{table}_{trigram_column}_trgm',
+                table,
+                [trigram_column],
+                postgresql_using='gin',
+                postgresql_ops={trigram_column: 'gin_trgm_ops'},
+            )
+
+
+def downgrade():
+    for table, (_, trigram_column) in SEARCHED.items():
+        op.execute(f'DROP INDEX IF EXISTS ix_{table}_{trigram_column}_trgm')
+        op.drop_index(f'ix_{table}_search_vector', table_name=table)
+        op.drop_column(table, 'search_vector')
@@ -1,43 +1,310 @@
-from db import db
+from datetime import datetime, timezone
+from functools import partial
+from itertools import chain
+from sqlalchemy import event, inspect, text, update
+from db import db, RoutingSession
+from cache import invalidate_entities
+
+
+def utcnow():
+    return datetime.now(timezone.utc)
 
 
 class Model():
     """Abstraction for simple helper methods for models"""
+    # columns serialized by format(), in order
+    serialized_fields = ()
+    # relationships format() can embed
+    serialized_relations = ()
+    # full-text searched columns, by decreasing weight (see search.py)
+    search_columns = ()
+    # column also matched by trigram similarity, for misspelled names
+    trigram_column = None
+    # columns filtered by case-insensitive prefix, with `?<column>_prefix=`
+    prefix_filters = ()
+    # columns filtered by range, with `?<column>_from=` and `?<column>_to=`
+    range_filters = ()
+    # columns lists can be sorted by, with `?sort=`
+    sortable_fields = ('id',)
+
+    def format(self, fields=None, include=()):
+        """Serializes the model, limited to `fields` if provided, embedding
+        the `include`d relationships.
+
+        Only the requested attributes are read, so columns deferred with
+        load_only are never lazy loaded. Included relationships should be
+        eager loaded (see projection.include_relations).
+        """
+        if fields is None:
+            fields = self.serialized_fields
+        formatted = {field: getattr(self, field) for field in fields}
+        for relation in include:
+            formatted[relation] = [
+                related.format() for related in getattr(self, relation)]
+        return formatted
+
+    def invalidate(self):
+        """Drops the cached copy of the model (see cache.py)"""
+        invalidate_entities(type(self), [self.id])
+
     def delete(self):
         db.session.delete(self)
         db.session.commit()
+        self.invalidate()
 
     def insert(self):
         db.session.add(self)
         db.session.commit()
+        self.invalidate()
 
     def update(self):
         db.session.commit()
+        self.invalidate()
+
+
+# which actors are cast in which movies
+castings = db.Table(
+    'castings',
+    db.Column(
+        'movie_id',
+        db.Integer,
+        db.ForeignKey('movies.id', ondelete='CASCADE'),
+        primary_key=True,
+    ),
+    db.Column(
+        'actor_id',
+        db.Integer,
+        db.ForeignKey('actors.id', ondelete='CASCADE'),
+        primary_key=True,
+        index=True,
+    ),
+)
 
 
 class Movie(db.Model, Model):
     __tablename__ = "movies"
+    __table_args__ = (
+        # prefix filters compare lower(title) with LIKE 'prefix%', which
+        # only a text_pattern_ops index serves under a non-C collation
+        db.Index(
+            'ix_movies_title_prefix',
+            db.func.lower(db.text('title')).label('title_lower'),
+            postgresql_ops={'title_lower': 'text_pattern_ops'},
+        ),
+        # sorted pages resume with WHERE (title, id) > (:key, :after)
+        db.Index('ix_movies_title_id', 'title', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String())
     description = db.Column(db.Text())
+    updated_at = db.Column(
+        db.DateTime(timezone=True),
+        nullable=False,
+        default=utcnow,
+        onupdate=utcnow,
+        server_default=db.func.now(),
+    )
+    actors = db.relationship(
+        'Actor',
+        secondary=castings,
+        back_populates='movies',
+        order_by='Actor.id',
+    )
 
-    def format(self):
-        return {
-            'id': self.id,
-            'title': self.title,
-            'description': self.description,
-        }
+    serialized_fields = ('id', 'title', 'description')
+    serialized_relations = ('actors',)
+    search_columns = ('title', 'description')
+    trigram_column = 'title'
+    prefix_filters = ('title',)
+    sortable_fields = ('id', 'title')
 
 
 class Actor(db.Model, Model):
     __tablename__ = 'actors'
+    __table_args__ = (
+        db.Index(
+            'ix_actors_name_prefix',
+            db.func.lower(db.text('name')).label('name_lower'),
+            postgresql_ops={'name_lower': 'text_pattern_ops'},
+        ),
+        db.Index('ix_actors_name_id', 'name', 'id'),
+        db.Index('ix_actors_birthdate_id', 'birthdate', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String())
     birthdate = db.Column(db.Date)
+    updated_at = db.Column(
+        db.DateTime(timezone=True),
+        nullable=False,
+        default=utcnow,
+        onupdate=utcnow,
+        server_default=db.func.now(),
+    )
+    movies = db.relationship(
+        'Movie',
+        secondary=castings,
+        back_populates='actors',
+        order_by='Movie.id',
+    )
+
+    serialized_fields = ('id', 'name', 'birthdate')
+    serialized_relations = ('movies',)
+    search_columns = ('name',)
+    trigram_column = 'name'
+    prefix_filters = ('name',)
+    range_filters = ('birthdate',)
+    sortable_fields = ('id', 'name', 'birthdate')
+
+
+SEARCH_LANGUAGE = 'english'
+
+
+def search_vector_sql(model):
+    """Returns the tsvector expression of the searched columns"""
+    return ' || '.join(
+        f"setweight(to_tsvector('{SEARCH_LANGUAGE}', "
+        f"coalesce({column}, '')), '{weight}')"
+        for column, weight in zip(model.search_columns, 'ABCD')
+    )
+
+
+def create_search_index(model, target, connection, **kwargs):
+    """Adds the full-text search structures of a model's table.
+
+    Postgres gets a generated tsvector column with a GIN index (plus a
+    trigram index if pg_trgm is installed), SQLite an FTS5 table kept in
+    sync by triggers. Databases managed by Alembic get them from migrations.
+    """
+    table = model.__tablename__
+    if connection.dialect.name == 'postgresql':
+        connection.execute(text(
+            f'ALTER TABLE {table} ADD COLUMN search_vector tsvector '
+            f'GENERATED ALWAYS AS ({search_vector_sql(model)}) STORED'))
+        connection.execute(text(
+            f'CREATE INDEX ix_{table}_search_vector ON {table} '
+            f'USING GIN (search_vector)'))
+        has_trigram = connection.execute(text(
+            "SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")).scalar()
+        if has_trigram:
+            column = model.trigram_column
+            connection.execute(text(
+                f'CREATE INDEX ix_{table}_{column}_trgm ON {table} '
+                f'USING GIN ({column} gin_trgm_ops)'))
+    elif connection.dialect.name == 'sqlite':
+        columns = ', '.join(model.search_columns)
+        new = ', '.join(f'new.{column}' for column in model.search_columns)
+        old = ', '.join(f'old.{column}' for column in model.search_columns)
+        statements = [
+            f"CREATE VIRTUAL TABLE {table}_fts USING fts5({columns}, "
+            f"content='{table}', content_rowid='id', "
+            f"tokenize='porter unicode61 remove_diacritics 2')",
+            f'CREATE TRIGGER {table}_fts_insert AFTER INSERT ON {table} '
+            f'BEGIN INSERT INTO {table}_fts(rowid, {columns}) '
+            f'VALUES (new.id, {new}); END',
+            f'CREATE TRIGGER {table}_fts_delete AFTER DELETE ON {table} '
+            f'BEGIN INSERT INTO {table}_fts({table}_fts, rowid, {columns}) '
+            f"VALUES ('delete', old.id, {old}); END",
+            f'CREATE TRIGGER {table}_fts_update AFTER UPDATE ON {table} '
+            f'BEGIN INSERT INTO {table}_fts({table}_fts, rowid, {columns}) '
+            f"VALUES ('delete', old.id, {old}); "
+            f'INSERT INTO {table}_fts(rowid, {columns}) '
+            f'VALUES (new.id, {new}); END',
+        ]
+        for statement in statements:
+            connection.execute(text(statement))
+
+
+def drop_search_index(model, target, connection, **kwargs):
+    if connection.dialect.name == 'sqlite':
+        connection.execute(text(
+            f'DROP TABLE IF EXISTS {model.__tablename__}_fts'))
+
+
+for searchable in (Movie, Actor):
+    event.listen(
+        searchable.__table__,
+        'after_create',
+        partial(create_search_index, searchable),
+    )
+    event.listen(
+        searchable.__table__,
+        'before_drop',
+        partial(drop_search_index, searchable),
+    )
+
+
+class TableVersion(db.Model):
+    """Version counter of a table, bumped in the transaction of every write.
+
+    It lets list endpoints derive their ETag with a single primary key
+    lookup, without scanning the table.
+    """
+    __tablename__ = 'table_versions'
+    name = db.Column(db.String(), primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime(timezone=True), nullable=False)
+
+
+VERSIONED_TABLES = (Movie.__tablename__, Actor.__tablename__, castings.name)
+
+
+@event.listens_for(TableVersion.__table__, 'after_create')
+def seed_table_versions(target, connection, **kwargs):
+    connection.execute(target.insert(), [
+        {'name': name, 'version': 0, 'updated_at': utcnow()}
+        for name in VERSIONED_TABLES
+    ])
+
+
+def bump_table_versions(session, names):
+    """Increments the tables' versions, within the session's transaction.
+
+    Their rows are locked in order of name, so concurrent transactions
+    bumping several tables can't deadlock each other."""
+    table = TableVersion.__table__
+    for name in sorted(set(names)):
+        session.connection().execute(
+            update(table)
+            .where(table.c.name == name)
+            .values(version=table.c.version + 1, updated_at=utcnow())
+        )
+
+
+def get_table_versions(names):
+    """Returns the (version, updated_at) of the tables, in a single query.
+    Returns None if any of them has no version"""
+    rows = db.session.query(
+        TableVersion.name, TableVersion.version, TableVersion.updated_at) \
+        .filter(TableVersion.name.in_(names)) \
+        .all()
+    versions = {
+        name: (version, updated_at) for name, version, updated_at in rows}
+    if len(versions) != len(set(names)):
+        return None
+    return [versions[name] for name in names]
+
+
+def get_relation_tables(model, include):
+    """Returns the names of the tables read to embed the relationships"""
+    names = []
+    for relation in include:
+        prop = model.__mapper__.relationships[relation]
+        names += [prop.secondary.name, prop.mapper.local_table.name]
+    return names
+
 
-    def format(self):
-        return {
-            'id': self.id,
-            'name': self.name,
-            'birthdate': self.birthdate,
-        }
+@event.listens_for(RoutingSession, 'after_flush')
+def bump_flushed_table_versions(session, flush_context):
+    names = set()
+    for instance in chain(session.new, session.dirty, session.deleted):
+        if not isinstance(instance, Model):
+            continue
+        names.add(instance.__tablename__)
+        # deletes cascade to the association tables
+        state = inspect(instance)
+        for relation in instance.serialized_relations:
+            if instance in session.deleted \
+                    or state.attrs[relation].history.has_changes():
+                prop = state.mapper.relationships[relation]
+                names.add(prop.secondary.name)
+    bump_table_versions(session, names)
@@ -1,7 +1,42 @@
 from flask import abort, Blueprint, jsonify, request
 from db import db
-from models import Movie
+from models import Actor, Movie
 from auth import requires_auth
+from bulk import (
+    batch_errors_response,
+    bulk_delete,
+    bulk_insert,
+    bulk_update,
+    ensure_object,
+    find_duplicates,
+    find_missing,
+    get_by_ids,
+    get_batch,
+    validate_batch,
+    validate_id,
+)
+from cache import get_entity, get_updated_at
+from coalescing import coalesce_read
+from filters import filter_query
+from pagination import get_page_args, get_sort, paginate, with_sort_field
+from replicas import read_only
+from search import get_search_query, search
+from serialization import format_row, row_query
+from projection import (
+    get_fields,
+    get_includes,
+    include_relations,
+    project,
+)
+from streaming import stream_ndjson, wants_ndjson
+from request_logging import log_error
+from conditional import (
+    entity_validators,
+    is_conditional,
+    list_validators,
+    not_modified,
+    set_validators,
+)
 
 
 movies_blueprint = Blueprint(
@@ -10,19 +45,119 @@ movies_blueprint = Blueprint(
 )
 
 
+def validate_movie(item, partial: bool = False):
+    """Returns the column values of a batch item, or raises ValueError"""
+    ensure_object(item)
+    row = {}
+    for attr in ('title', 'description'):
+        if attr in item:
+            if not isinstance(item[attr], str):
+                raise ValueError(f'Invalid {attr}')
+            row[attr] = item[attr]
+    if partial and not row:
+        raise ValueError('title or description is required')
+    if not partial and len(row) != 2:
+        raise ValueError('title and description are required')
+    return row
+
+
+def validate_movie_update(item):
+    """Returns the id and column values of a batch update item"""
+    row = validate_movie(item, partial=True)
+    row['id'] = validate_id(item.get('id'))
+    return row
+
+
 @movies_blueprint.route('/movies', methods=['GET'])
 @requires_auth(permission='get:movies')
+@read_only
 def get_movies(self):
-    """Handles GET requests for all available movies."""
+    """Handles GET requests for a page of available movies, filtered and
+    sorted as requested (see filters.py and pagination.get_sort).
+
+    Streams every movie as NDJSON instead when asked to (see streaming.py).
+    """
     try:
-        print('Request - [GET] /movies')
-        movies = Movie.query.all()
-        return jsonify({
+        limit, cursor, offset = get_page_args(request.args)
+        sort = get_sort(request.args, Movie)
+        fields = get_fields(request.args, Movie)
+        include = get_includes(request.args, Movie)
+
+        # answer conditional requests before loading any rows
+        etag, last_modified = list_validators(Movie, include)
+        response = not_modified(etag, last_modified)
+        if response:
+            return response
+
+        query = filter_query(Movie.query, Movie, request.args)
+        if include:
+            query = project(query, Movie, with_sort_field(fields, sort))
+            query = include_relations(query, Movie, include)
+        else:
+            # plain rows, skipping the ORM objects
+            query = row_query(query, Movie, fields, sort)
+        if wants_ndjson(request):
+            response = stream_ndjson(
+                query, Movie, cursor=cursor, fields=fields, include=include,
+                sort=sort)
+            response = set_validators(response, etag, last_modified)
+        else:
+            def load_page():
+                movies, next_cursor = paginate(
+                    query, Movie, limit, cursor=cursor, offset=offset,
+                    sort=sort)
+                return {
+                    'success': True,
+                    'movies': [
+                        format_row(movie, Movie, fields, include)
+                        for movie in movies
+                    ],
+                    'next_cursor': next_cursor,
+                }, (etag, last_modified)
+
+            # identical concurrent requests share the page (see coalescing.py)
+            response = coalesce_read(load_page, version=etag)
+        response.vary.add('Accept')
+        return response, 200
+    except Exception as e:
+        log_error(e)
+        code = getattr(e, 'code', 500)
+        abort(code)
+    finally:
+        db.session.close()
+
+
+@movies_blueprint.route('/movies/search', methods=['GET'])
+@requires_auth(permission='get:movies')
+@read_only
+def search_movies(self):
+    """Handles GET requests searching the titles and descriptions of movies.
+
+    Results are ranked by relevance, and paginated by offset.
+    """
+    try:
+        q = get_search_query(request.args)
+        limit, cursor, offset = get_page_args(request.args)
+        if cursor is not None:
+            abort(400)
+        fields = get_fields(request.args, Movie)
+        include = get_includes(request.args, Movie)
+
+        etag, last_modified = list_validators(Movie, include)
+        response = not_modified(etag, last_modified)
+        if response:
+            return response
+
+        movies, next_offset = search(
+            Movie, q, limit, offset or 0, fields=fields, include=include)
+        response = jsonify({
             'success': True,
-            'movies': [movie.format() for movie in movies]
-        }), 200
+            'movies': [movie.format(fields, include) for movie in movies],
+            'next_offset': next_offset,
+        })
+        return set_validators(response, etag, last_modified), 200
     except Exception as e:
-        print('Error - [GET] /movies', e)
+        log_error(e)
         code = getattr(e, 'code', 500)
         abort(code)
     finally:
@@ -34,7 +169,6 @@ def get_movies(self):
 def create_movie(self):
     """Handles POST requests to create a new movies"""
     try:
-        print('Request - [POST] /movies')
         body = request.get_json()
 
         required_attrs = ('title', 'description')
@@ -51,7 +185,7 @@ def create_movie(self):
             'movie': movie.format()
         }), 200
     except Exception as e:
-        print('Error - [POST] /movies', e)
+        log_error(e)
         code = getattr(e, 'code', 500)
         abort(code)
     finally:
@@ -60,21 +194,42 @@ def create_movie(self):
 
 @movies_blueprint.route('/movies/<int:movie_id>', methods=['GET'])
 @requires_auth(permission='get:movies')
+@read_only
 def get_movie(self, movie_id: int):
     """Handles GET requests for a specified movie."""
     try:
-        print('Request - [GET] /movies/<int:movie_id>')
-        movie = Movie.query.get(movie_id)
+        fields = get_fields(request.args, Movie)
+        include = get_includes(request.args, Movie)
 
-        if not movie:
+        # answer conditional requests from the updated_at column alone
+        if is_conditional(request):
+            updated_at = get_updated_at(Movie, movie_id)
+            if updated_at is None:
+                abort(404)
+            response = not_modified(*entity_validators(
+                Movie, movie_id, updated_at, fields, include))
+            if response:
+                return response
+
+        def load_movie():
+            entity = get_entity(Movie, movie_id, fields, include)
+            if not entity:
+                return None
+            movie, updated_at = entity
+            return {
+                'success': True,
+                'movie': movie,
+            }, entity_validators(Movie, movie_id, updated_at, fields, include)
+
+        # identical concurrent requests share the movie (see coalescing.py)
+        response = coalesce_read(load_movie)
+
+        if response is None:
             abort(404)
 
-        return jsonify({
-            'success': True,
-            'movie': movie.format(),
-        }), 200
+        return response, 200
     except Exception as e:
-        print('Error - [GET] /movies/<int:movie_id>', e)
+        log_error(e)
         code = getattr(e, 'code', 500)
         abort(code)
     finally:
@@ -86,7 +241,6 @@ def get_movie(self, movie_id: int):
 def update_movie(self, movie_id: int):
     """Handles PATCH requests to update existing movies in the database"""
     try:
-        print('Request - [PATCH] /movies/<int:movie_id>')
         movie = Movie.query.get(movie_id)
 
         if not movie:
@@ -100,6 +254,9 @@ def update_movie(self, movie_id: int):
         if 'description' in body:
             movie.description = body['description']
 
+        if 'actor_ids' in body:
+            movie.actors = get_by_ids(Actor, body['actor_ids'])
+
         # commit changes
         movie.update()
 
@@ -108,7 +265,7 @@ def update_movie(self, movie_id: int):
             'movie': movie.format()
         }), 200
     except Exception as e:
-        print('Error - [PATCH] /movies/<int:movie_id>', e)
+        log_error(e)
         code = getattr(e, 'code', 500)
         abort(code)
     finally:
@@ -120,7 +277,6 @@ def update_movie(self, movie_id: int):
 def delete_movie(self, movie_id: int):
     """Handles DELETE requests to remove existing movies in the database"""
     try:
-        print('Request - [PATCH] /movies/<int:movie_id>')
 
         movie = Movie.query.get(movie_id)
 
@@ -135,7 +291,92 @@ def delete_movie(self, movie_id: int):
             'removed': movie_id
         })
     except Exception as e:
-        print('Error - [PATCH] /movies/<int:movie_id>', e)
+        log_error(e)
+        code = getattr(e, 'code', 500)
+        abort(code)
+    finally:
+        db.session.close()
+
+
+@movies_blueprint.route('/movies/bulk', methods=['POST'])
+@requires_auth(permission='post:movies')
+def create_movies(self):
+    """Handles POST requests to create a batch of movies in one transaction"""
+    try:
+        items = get_batch(request.get_json(), 'movies')
+        rows, errors = validate_batch(items, validate_movie)
+        if errors:
+            return batch_errors_response(errors)
+
+        # add and commit
+        ids = bulk_insert(Movie, rows)
+
+        return jsonify({
+            'success': True,
+            'created': ids
+        }), 200
+    except Exception as e:
+        log_error(e)
+        code = getattr(e, 'code', 500)
+        abort(code)
+    finally:
+        db.session.close()
+
+
+@movies_blueprint.route('/movies/bulk', methods=['PATCH'])
+@requires_auth(permission='patch:movies')
+def update_movies(self):
+    """Handles PATCH requests to update a batch of movies in one transaction"""
+    try:
+        items = get_batch(request.get_json(), 'movies')
+        rows, errors = validate_batch(items, validate_movie_update)
+        if errors:
+            return batch_errors_response(errors)
+
+        ids = [row['id'] for row in rows]
+        errors = find_duplicates(ids) or find_missing(Movie, ids)
+        if errors:
+            return batch_errors_response(errors)
+
+        # commit changes
+        bulk_update(Movie, rows)
+
+        return jsonify({
+            'success': True,
+            'updated': ids
+        }), 200
+    except Exception as e:
+        log_error(e)
+        code = getattr(e, 'code', 500)
+        abort(code)
+    finally:
+        db.session.close()
+
+
+@movies_blueprint.route('/movies/bulk', methods=['DELETE'])
+@requires_auth(permission='delete:movies')
+def delete_movies(self):
+    """Handles DELETE requests to remove a batch of movies in one
+    transaction"""
+    try:
+        items = get_batch(request.get_json(), 'ids')
+        ids, errors = validate_batch(items, validate_id)
+        if errors:
+            return batch_errors_response(errors)
+
+        errors = find_duplicates(ids) or find_missing(Movie, ids)
+        if errors:
+            return batch_errors_response(errors)
+
+        # remove and commit
+        bulk_delete(Movie, ids)
+
+        return jsonify({
+            'success': True,
+            'removed': ids
+        }), 200
+    except Exception as e:
+        log_error(e)
         code = getattr(e, 'code', 500)
         abort(code)
     finally:
@@ -0,0 +1,198 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import date
+from os import getenv
+from flask import abort
+from sqlalchemy import and_, or_, tuple_
+
+
+DEFAULT_PAGE_SIZE = int(getenv('PAGE_SIZE', 50))
+MAX_PAGE_SIZE = int(getenv('MAX_PAGE_SIZE', 500))
+
+# the default sort, by ascending primary key
+ID_SORT = ('id', False)
+
+
+def format_sort(sort):
+    field, descending = sort
+    return f"{'-' if descending else ''}{field}"
+
+
+def get_sort(args, model):
+    """Returns the (field, descending) requested with `?sort=` (`name`, or
+    `-name` for descending), by id by default. Aborts with a 400 unless the
+    field is one of the model's sortable_fields"""
+    raw = args.get('sort')
+    if raw is None:
+        return ID_SORT
+    field = raw[1:] if raw.startswith('-') else raw
+    if field not in model.sortable_fields:
+        abort(400, 'Invalid sort')
+    return field, raw.startswith('-')
+
+
+def with_sort_field(fields, sort):
+    """Returns the projected fields plus the sort field, which the cursor
+    of the next page is built from"""
+    if fields is None or sort[0] in fields:
+        return fields
+    return (*fields, sort[0])
+
+
+def encode_cursor(last_id: int, sort=ID_SORT, key=None):
+    """Returns an opaque cursor pointing after the given primary key (and
+    sort key, when not sorting by id)"""
+    position = {'after': last_id}
+    if sort != ID_SORT:
+        if isinstance(key, date):
+            key = key.isoformat()
+        position.update({'sort': format_sort(sort), 'key': key})
+    raw = json.dumps(position, separators=(',', ':')).encode()
+    return urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+
+def decode_cursor(cursor: str):
+    """Returns the position encoded in a cursor, or aborts with a 400"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        position = json.loads(urlsafe_b64decode(padded))
+        after = position['after']
+    except Exception:
+        abort(400, 'Invalid cursor')
+    if not isinstance(after, int):
+        abort(400, 'Invalid cursor')
+    return position
+
+
+'''Return the (limit, cursor, offset) paging arguments of a request.
+
+    @INPUTS
+        args: the request's query args
+
+    `cursor` (keyset) paging is preferred; `offset` is only a fallback for
+    clients that need to jump to a page, and can't be combined with a cursor.
+'''
+
+
+def get_page_args(args):
+    limit = args.get('limit', type=int)
+    if 'limit' not in args:
+        limit = DEFAULT_PAGE_SIZE
+    elif limit is None or limit < 1:
+        abort(400, 'Invalid limit')
+    limit = min(limit, MAX_PAGE_SIZE)
+
+    cursor = args.get('cursor')
+    offset = args.get('offset', type=int)
+    if cursor and 'offset' in args:
+        abort(400, 'cursor and offset are mutually exclusive')
+    if 'offset' in args and (offset is None or offset < 0):
+        abort(400, 'Invalid offset')
+
+    cursor = decode_cursor(cursor) if cursor else None
+    return limit, cursor, offset
+
+
+def decode_key(column, key):
+    """Returns the sort key of a cursor as the column's python type"""
+    if key is None:
+        return None
+    try:
+        if column.type.python_type is date:
+            return date.fromisoformat(key)
+        if not isinstance(key, column.type.python_type):
+            raise TypeError
+    except (TypeError, ValueError):
+        abort(400, 'Invalid cursor')
+    return key
+
+
+'''Return the query ordered by the sort, resumed after the cursor.
+
+    @INPUTS
+        query: the query to order
+        model: the queried model
+        sort: see get_sort
+        cursor: see get_page_args
+
+    Rows are ordered by the sort field, then by id, so that the order is
+    total. NULLs sort after every value (before them when descending), which
+    matches how an index on (field, id) is scanned either way. Resuming
+    compares (field, id) row values, so an index on them serves any page.
+'''
+
+
+def order_after(query, model, sort=ID_SORT, cursor=None):
+    field, descending = sort
+    id_column = model.id
+    if cursor is not None and cursor.get('sort', 'id') != format_sort(sort):
+        abort(400, 'The cursor is for another sort')
+
+    if sort == ID_SORT:
+        query = query.order_by(id_column)
+        if cursor is not None:
+            query = query.filter(id_column > cursor['after'])
+        return query
+
+    column = getattr(model, field)
+    if descending:
+        query = query.order_by(column.desc().nulls_first(), id_column.desc())
+    else:
+        query = query.order_by(column.asc().nulls_last(), id_column.asc())
+    if cursor is None:
+        return query
+
+    after = cursor['after']
+    key = decode_key(column, cursor.get('key'))
+    if key is None:
+        # past the last value, within the NULLs (first when descending)
+        if descending:
+            return query.filter(or_(
+                and_(column.is_(None), id_column < after),
+                column.isnot(None)))
+        return query.filter(column.is_(None), id_column > after)
+    if descending:
+        return query.filter(tuple_(column, id_column) < tuple_(key, after))
+    return query.filter(or_(
+        tuple_(column, id_column) > tuple_(key, after),
+        column.is_(None)))
+
+
+def next_page(rows, limit: int, sort=ID_SORT):
+    """Returns the page of fetched rows (limit + 1 at most, see
+    paginate), and the cursor of the next page if there is one"""
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(last.id, sort, getattr(last, sort[0]))
+
+
+def page_query(query, model, limit: int, cursor=None, offset: int = None,
+               sort=ID_SORT):
+    """Returns the query of a page, and of the first row of the next"""
+    query = order_after(query, model, sort, cursor)
+    if cursor is None and offset:
+        query = query.offset(offset)
+    return query.limit(limit + 1)
+
+
+'''Return a page of rows and the cursor of the next page.
+
+    @INPUTS
+        query: the query to page through
+        model: the queried model
+        limit, cursor, offset: see get_page_args
+        sort: see get_sort
+
+    With a cursor the query is `WHERE (field, id) > (:key, :after) ORDER BY
+    field, id LIMIT n`, so its cost stays constant however deep the page is.
+    One extra row is fetched to know whether there is a next page, instead of
+    counting the table.
+'''
+
+
+def paginate(query, model, limit: int, cursor=None, offset: int = None,
+             sort=ID_SORT):
+    rows = page_query(query, model, limit, cursor, offset, sort).all()
+    return next_page(rows, limit, sort)
@@ -0,0 +1,86 @@
+from flask import abort
+from sqlalchemy.orm import load_only, selectinload
+
+
+'''Return the fields requested with `?fields=`, or None for all of them.
+
+    @INPUTS
+        args: the request's query args
+        model: the model being read, whose serialized_fields are allowed
+
+    The id is always included. Unknown fields abort with a 400.
+'''
+
+
+def get_fields(args, model):
+    raw = args.get('fields')
+    if raw is None:
+        return None
+    requested = {field.strip() for field in raw.split(',') if field.strip()}
+    if not requested or not requested.issubset(model.serialized_fields):
+        abort(400, 'Invalid fields')
+    requested.add('id')
+    return tuple(
+        field for field in model.serialized_fields if field in requested)
+
+
+'''Return the query restricted to the requested columns.
+
+    @INPUTS
+        query: the query to restrict
+        model: the queried model
+        fields: the fields returned by get_fields
+
+    Projection happens in SQL through load_only, so the unrequested
+    columns are never fetched from the database.
+'''
+
+
+def project(query, model, fields):
+    if fields is None:
+        return query
+    return query.options(
+        load_only(*(getattr(model, field) for field in fields)))
+
+
+'''Return the relationships requested with `?include=`.
+
+    @INPUTS
+        args: the request's query args
+        model: the model being read, whose serialized_relations are allowed
+
+    Unknown relationships abort with a 400.
+'''
+
+
+def get_includes(args, model):
+    raw = args.get('include')
+    if raw is None:
+        return ()
+    requested = {
+        relation.strip() for relation in raw.split(',') if relation.strip()}
+    if not requested or not requested.issubset(model.serialized_relations):
+        abort(400, 'Invalid include')
+    return tuple(
+        relation for relation in model.serialized_relations
+        if relation in requested)
+
+
+'''Return the query eager loading the included relationships.
+
+    @INPUTS
+        query: the query to extend
+        model: the queried model
+        include: the relationships returned by get_includes
+
+    Relationships are loaded with selectinload: one extra `IN` query per
+    relationship for all the rows of the query (or of each yield_per batch),
+    instead of one lazy load per row.
+'''
+
+
+def include_relations(query, model, include):
+    if not include:
+        return query
+    return query.options(
+        *(selectinload(getattr(model, relation)) for relation in include))
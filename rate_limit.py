@@ -0,0 +1,225 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from os import getenv
+
+
+logger = logging.getLogger('castingagency.rate_limit')
+
+# the actions of the permissions putting a token in the write tier
+WRITE_ACTIONS = ('post', 'patch', 'delete')
+
+# requests per second and burst of each tier, unless set in the environment
+DEFAULT_LIMITS = {
+    'read': (50, 100),
+    'write': (100, 200),
+}
+
+
+@lru_cache(maxsize=1024)
+def get_tier(permissions: frozenset):
+    """Returns the rate limit tier of a token's permissions"""
+    for permission in permissions:
+        if permission.split(':')[0] in WRITE_ACTIONS:
+            return 'write'
+    return 'read'
+
+
+'''Take a token from a bucket.
+
+    @INPUTS
+        full_at: when the bucket is full again (now, or earlier, if it is)
+        now: the current time
+        rate: the tokens added to the bucket per second
+        burst: the tokens the bucket holds
+
+    A bucket is stored as the single timestamp at which it is full again
+    (GCRA), instead of a token count and its last refill. Returns the new
+    timestamp and 0 if a token was taken, or else the seconds until one is
+    available.
+'''
+
+
+def take_token(full_at: float, now: float, rate: float, burst: int):
+    interval = 1 / rate
+    full_at = max(full_at, now) + interval
+    wait = full_at - now - burst * interval
+    return full_at, max(wait, 0.0)
+
+
+class RateLimitBackend():
+    """Interface of the rate limiter backends, holding the token buckets"""
+
+    def take(self, key: str, rate: float, burst: int):
+        """Takes a token from a bucket, returns 0 if there was one, or else
+        the seconds until there is"""
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def stats(self):
+        return {}
+
+
+class LocalBuckets(RateLimitBackend):
+    """In-process token buckets, the least recently used evicted first.
+
+    Each worker process has its own, so a subject can get up to `workers`
+    times its rate overall. Use a shared backend (see RedisBuckets) to
+    enforce the rate across workers.
+    """
+
+    def __init__(self, max_size: int = None):
+        self.max_size = max_size if max_size is not None else int(
+            getenv('RATE_LIMIT_MAX_BUCKETS', 100000))
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key: str, rate: float, burst: int):
+        now = time.monotonic()
+        with self._lock:
+            full_at, wait = take_token(
+                self._buckets.get(key, now), now, rate, burst)
+            if wait:
+                return wait
+            self._buckets[key] = full_at
+            self._buckets.move_to_end(key)
+            # an evicted bucket starts over, full
+            while len(self._buckets) > self.max_size:
+                self._buckets.popitem(last=False)
+        return 0.0
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+    def stats(self):
+        return {'buckets': len(self._buckets)}
+
+
+class RedisBuckets(RateLimitBackend):
+    """Token buckets shared by all workers, on a Redis-compatible client.
+
+    Each bucket is a key holding when it is full again, which expires then.
+    It is updated in an optimistic transaction (WATCH/MULTI), so workers
+    never both take its last token. The client only needs `transaction`,
+    with pipelines supporting `get`, `multi` and `set(key, value, px=ms)`,
+    as provided by redis-py. Workers must have synchronized clocks.
+    """
+
+    def __init__(self, client, prefix: str = 'castingagency:rate:'):
+        self.client = client
+        self.prefix = prefix
+
+    def take(self, key: str, rate: float, burst: int):
+        key = self.prefix + key
+
+        def take_from(pipe):
+            now = time.time()
+            value = pipe.get(key)
+            full_at, wait = take_token(
+                now if value is None else float(value), now, rate, burst)
+            if not wait:
+                pipe.multi()
+                pipe.set(key, repr(full_at),
+                         px=max(int((full_at - now) * 1000), 1))
+            return wait
+
+        return self.client.transaction(
+            take_from, key, value_from_callable=True)
+
+    def clear(self):
+        keys = list(self.client.scan_iter(match=self.prefix + '*'))
+        if keys:
+            self.client.delete(*keys)
+
+
+class RateLimiter():
+    """Token-bucket rate limits on the requests of each token subject.
+
+    Tokens holding a write permission are in the `write` tier, the others
+    in the `read` tier. Each tier has its own rate and burst, and each
+    subject its own bucket per tier.
+    """
+
+    def __init__(self, backend: RateLimitBackend = None, limits: dict = None,
+                 enabled: bool = None):
+        self.backend = backend if backend is not None else LocalBuckets()
+        self.limits = limits if limits is not None else {
+            tier: (
+                float(getenv(f'RATE_LIMIT_{tier.upper()}_RATE', rate)),
+                int(getenv(f'RATE_LIMIT_{tier.upper()}_BURST', burst)),
+            )
+            for tier, (rate, burst) in DEFAULT_LIMITS.items()
+        }
+        self.enabled = enabled if enabled is not None else getenv(
+            'RATE_LIMIT_ENABLED', 'true').lower() not in ('0', 'false', 'no')
+        self._lock = threading.Lock()
+        self._counters = {
+            f'{tier}_{outcome}': 0
+            for tier in self.limits
+            for outcome in ('allowed', 'limited', 'errors')
+        }
+
+    def check(self, payload):
+        """Takes a token from the bucket of a verified payload's subject and
+        tier. Returns 0 if the request is allowed, or else the seconds until
+        it would be"""
+        if not self.enabled:
+            return 0.0
+        tier = get_tier(payload.permissions)
+        rate, burst = self.limits[tier]
+        if rate <= 0:
+            return 0.0
+        try:
+            wait = self.backend.take(
+                f"{tier}:{payload.get('sub')}", rate, burst)
+        except Exception:
+            # an unavailable backend mustn't fail every request: let it in
+            logger.warning('Rate limit backend error', exc_info=True)
+            self._count(f'{tier}_errors')
+            return 0.0
+        self._count(f"{tier}_{'limited' if wait else 'allowed'}")
+        return wait
+
+    def _count(self, counter: str):
+        with self._lock:
+            self._counters[counter] += 1
+
+    def stats(self):
+        """Returns a snapshot of the limiter counters"""
+        return {**self._counters, **self.backend.stats()}
+
+    def clear(self):
+        """Empties the buckets and resets the counters"""
+        self.backend.clear()
+        with self._lock:
+            for counter in self._counters:
+                self._counters[counter] = 0
+
+
+rate_limiter = RateLimiter()
+
+
+def set_rate_limiter(limiter: RateLimiter):
+    """Replaces the rate limiter"""
+    global rate_limiter
+    rate_limiter = limiter
+
+
+def configure_rate_limiter():
+    """Configures the rate limiter from the environment, with its buckets on
+    Redis when RATE_LIMIT_REDIS_URL is set"""
+    url = getenv('RATE_LIMIT_REDIS_URL', None)
+    backend = None
+    if url:
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError(
+                'RATE_LIMIT_REDIS_URL is set but redis is not installed')
+        backend = RedisBuckets(redis.Redis.from_url(url))
+    set_rate_limiter(RateLimiter(backend))
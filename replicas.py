@@ -0,0 +1,168 @@
+import itertools
+import threading
+import time
+from functools import partial, wraps
+from os import getenv
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event, exc
+from db import db, RoutingSession
+
+
+class ReplicaRouter():
+    """Picks the read replica serving a read-only request.
+
+    Replicas are used round-robin. A replica that errors out is skipped for
+    `retry_after` seconds. Subjects who wrote within the last `sticky_seconds`
+    (or who send `X-Read-Your-Writes: true`) read from the primary, so they
+    always see their own writes despite replication lag.
+    """
+
+    def __init__(self, sticky_seconds: float = None,
+                 retry_after: float = None):
+        self.sticky_seconds = sticky_seconds if sticky_seconds is not None \
+            else float(getenv('DB_REPLICA_STICKY_SECONDS', 5))
+        self.retry_after = retry_after if retry_after is not None \
+            else float(getenv('DB_REPLICA_RETRY_AFTER', 30))
+        self._round_robin = itertools.count()
+        self._down_until = {}
+        self._last_writes = {}
+        self._lock = threading.Lock()
+        self.counters = {
+            'replica_reads': 0,
+            'primary_reads': 0,
+            'fallbacks': 0,
+        }
+
+    def mark_down(self, replica: str):
+        self._down_until[replica] = time.monotonic() + self.retry_after
+
+    def record_write(self, subject: str):
+        now = time.monotonic()
+        with self._lock:
+            self._last_writes[subject] = now
+            # forget subjects whose writes have replicated by now
+            if len(self._last_writes) > 10000:
+                self._last_writes = {
+                    sub: at for sub, at in self._last_writes.items()
+                    if now - at < self.sticky_seconds
+                }
+
+    def wrote_recently(self, subject: str):
+        wrote_at = self._last_writes.get(subject)
+        return wrote_at is not None \
+            and time.monotonic() - wrote_at < self.sticky_seconds
+
+    def reads_own_writes(self, subject: str = None):
+        """Checks whether the current request must see its subject's writes:
+        it asks to, or its subject wrote recently"""
+        if request.headers.get(
+                'X-Read-Your-Writes', '').lower() in ('1', 'true'):
+            return True
+        return bool(subject) and self.wrote_recently(subject)
+
+    def choose(self, replicas: list, subject: str = None):
+        """Returns the bind key of the replica to read from, or None for the
+        primary"""
+        if replicas and not self.reads_own_writes(subject):
+            now = time.monotonic()
+            for _ in range(len(replicas)):
+                replica = replicas[next(self._round_robin) % len(replicas)]
+                if self._down_until.get(replica, 0) <= now:
+                    self.counters['replica_reads'] += 1
+                    return replica
+        self.counters['primary_reads'] += 1
+        return None
+
+    def clear(self):
+        """Forgets replica failures and recent writes, and resets counters"""
+        with self._lock:
+            self._down_until = {}
+            self._last_writes = {}
+            for counter in self.counters:
+                self.counters[counter] = 0
+
+    def stats(self):
+        now = time.monotonic()
+        return {
+            **self.counters,
+            'down': sorted(
+                replica for replica, until in self._down_until.items()
+                if until > now),
+        }
+
+
+router = ReplicaRouter()
+
+
+def reads_own_writes():
+    """Checks whether the current request, if any, must see its subject's
+    writes (see ReplicaRouter.reads_own_writes)"""
+    if not has_request_context():
+        return False
+    payload = g.get('auth_payload')
+    return router.reads_own_writes(payload.get('sub') if payload else None)
+
+
+def on_replica_error(replica: str, context):
+    if context.is_disconnect \
+            or isinstance(context.sqlalchemy_exception, exc.OperationalError):
+        router.mark_down(replica)
+        if has_request_context():
+            g.replica_failed = True
+
+
+def on_commit(session):
+    payload = g.get('auth_payload') if has_request_context() else None
+    if payload and 'sub' in payload:
+        router.record_write(payload['sub'])
+
+
+def setup_replicas(app):
+    """Watches the replica engines for errors and tracks writes"""
+    with app.app_context():
+        for replica in app.config.get('DB_REPLICAS', []):
+            event.listen(
+                db.engines[replica],
+                'handle_error',
+                partial(on_replica_error, replica),
+            )
+    if not event.contains(RoutingSession, 'after_commit', on_commit):
+        event.listen(RoutingSession, 'after_commit', on_commit)
+
+
+'''Return the decorator routing a read-only handler to a read replica.
+
+    Must be applied below requires_auth, since it reads the token's subject.
+    If the replica errors out, the handler is retried once on the primary.
+    The routing lasts for the whole request (the session is request scoped),
+    so streamed responses read from the replica too.
+'''
+
+
+def read_only(f):
+    @wraps(f)
+    def wrapper(payload, *args, **kwargs):
+        replica = router.choose(
+            current_app.config.get('DB_REPLICAS', []),
+            subject=payload.get('sub'),
+        )
+        if replica is None:
+            return f(payload, *args, **kwargs)
+
+        db.session.info['route_to'] = replica
+        g.replica_failed = False
+        try:
+            response = f(payload, *args, **kwargs)
+        except Exception:
+            if not g.replica_failed:
+                raise
+        if not g.replica_failed:
+            return response
+
+        # the replica errored out: retry on the primary
+        router.counters['fallbacks'] += 1
+        db.session.info.pop('route_to', None)
+        db.session.rollback()
+        return f(payload, *args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,146 @@
+import atexit
+import json
+import logging
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from os import getenv
+from flask import g, request
+from instrumentation import get_request_duration, get_timings
+
+
+logger = logging.getLogger('castingagency.requests')
+
+# successful requests to these routes are only logged at the sample rate
+SAMPLED_ROUTES = frozenset(
+    route.strip() for route in getenv(
+        'REQUEST_LOG_SAMPLED_ROUTES',
+        '/healthcheck,/actors,/movies,'
+        '/actors/<int:actor_id>,/movies/<int:movie_id>',
+    ).split(',') if route.strip()
+)
+SAMPLE_RATE = float(getenv('REQUEST_LOG_SAMPLE_RATE', 1))
+# requests slower than this are always logged
+SLOW_REQUEST_MS = float(getenv('REQUEST_LOG_SLOW_MS', 1000))
+
+_listener = None
+
+
+class JSONFormatter(logging.Formatter):
+    """Formats records as JSON lines, including their `fields` extra"""
+
+    def format(self, record):
+        line = {
+            'ts': datetime.fromtimestamp(
+                record.created, timezone.utc).isoformat(),
+            'level': record.levelname.lower(),
+            'message': record.getMessage(),
+            **getattr(record, 'fields', {}),
+        }
+        if record.exc_info:
+            line['exception'] = self.formatException(record.exc_info)
+        return json.dumps(line, default=str)
+
+
+def start_listener(stream=None):
+    """Writes the logged requests from a background thread, so requests never
+    wait on the stream. Only the first call has an effect"""
+    global _listener
+    if _listener is not None:
+        return _listener
+    records = queue.SimpleQueue()
+    handler = logging.StreamHandler(stream or sys.stdout)
+    handler.setFormatter(JSONFormatter())
+    _listener = QueueListener(records, handler)
+    _listener.start()
+    atexit.register(stop_listener)
+
+    logger.addHandler(QueueHandler(records))
+    logger.setLevel(getenv('REQUEST_LOG_LEVEL', 'INFO').upper())
+    logger.propagate = False
+    return _listener
+
+
+def stop_listener():
+    """Flushes the queued records and stops the background thread"""
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    _listener = None
+    for handler in list(logger.handlers):
+        if isinstance(handler, QueueHandler):
+            logger.removeHandler(handler)
+
+
+def restart_listener():
+    """Restarts the background thread in a forked process (threads don't
+    survive a fork), if it was started before the fork"""
+    if _listener is None:
+        return
+    stream = _listener.handlers[0].stream
+    stop_listener()
+    start_listener(stream)
+
+
+def log_error(error: Exception):
+    """Records a handled error, logged with the request it interrupted"""
+    g.request_error = f'{type(error).__name__}: {error}'
+
+
+def should_log(route: str, status: int, duration_ms: float):
+    if status >= 400 or duration_ms >= SLOW_REQUEST_MS:
+        return True
+    if route in SAMPLED_ROUTES:
+        return random.random() < SAMPLE_RATE
+    return True
+
+
+def log_request(response):
+    duration = get_request_duration()
+    if duration is None:
+        return response
+    duration_ms = duration * 1000
+    route = request.url_rule.rule if request.url_rule else request.path
+    if not should_log(route, response.status_code, duration_ms):
+        return response
+
+    fields = {
+        'method': request.method,
+        'route': route,
+        'status': response.status_code,
+        'duration_ms': round(duration_ms, 3),
+        'db_ms': round(get_timings().get('db', 0) * 1000, 3),
+        'db_statements': g.get('db_statements', 0),
+    }
+    if response.is_streamed:
+        # the body is generated (and queried) after this
+        fields['streamed'] = True
+    error = g.get('request_error')
+    if error:
+        fields['error'] = error
+    level = logging.ERROR if response.status_code >= 500 else logging.INFO
+    logger.log(level, 'request', extra={'fields': fields})
+    return response
+
+
+'''Log every request as a JSON line.
+
+    @INPUTS
+        app: the Flask app
+
+    Lines hold the method, route, status, duration and the time spent in
+    (and number of) SQL statements. Successful requests to SAMPLED_ROUTES are
+    only logged at REQUEST_LOG_SAMPLE_RATE; errors and slow requests always
+    are. Set REQUEST_LOG_ENABLED=false to disable it. Timings come from the
+    instrumentation, which must be set up first.
+'''
+
+
+def setup_request_logging(app):
+    if getenv('REQUEST_LOG_ENABLED', 'true').lower() in ('0', 'false', 'no'):
+        return
+    start_listener()
+    app.after_request(log_request)
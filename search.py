@@ -0,0 +1,104 @@
+import re
+from os import getenv
+from flask import abort
+from sqlalchemy import (
+    column, false, func, literal_column, or_, table, text)
+from db import db
+from models import SEARCH_LANGUAGE
+from projection import include_relations, project
+
+
+MAX_QUERY_LENGTH = int(getenv('SEARCH_MAX_QUERY_LENGTH', 200))
+
+# bm25 weights of the searched columns, like Postgres' default ts_rank
+# weights for the A, B, C and D labels of search_vector_sql
+FTS5_WEIGHTS = (1.0, 0.4, 0.2, 0.1)
+
+# whether pg_trgm is installed, per database
+_trigram_support = {}
+
+
+def get_search_query(args):
+    """Returns the `?q=` search terms, or aborts with a 400"""
+    q = args.get('q', '').strip()
+    if not q or len(q) > MAX_QUERY_LENGTH:
+        abort(400, 'Invalid search query')
+    return q
+
+
+def has_trigram(bind):
+    url = str(bind.engine.url)
+    if url not in _trigram_support:
+        _trigram_support[url] = bool(db.session.execute(text(
+            "SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")).scalar())
+    return _trigram_support[url]
+
+
+def postgres_search(query, model, q: str, bind):
+    """Matches the tsvector column (and the trigram column, if pg_trgm is
+    installed), ranked by relevance"""
+    vector = literal_column(f'{model.__tablename__}.search_vector')
+    tsquery = func.websearch_to_tsquery(SEARCH_LANGUAGE, q)
+    match = vector.op('@@')(tsquery)
+    rank = func.ts_rank(vector, tsquery)
+    if has_trigram(bind):
+        similar = getattr(model, model.trigram_column)
+        match = or_(match, similar.op('%')(q))
+        rank = func.greatest(rank, func.similarity(similar, q))
+    return query.filter(match).order_by(rank.desc(), model.id)
+
+
+def fts5_query(q: str):
+    """Returns the terms as an FTS5 query of prefix matches, so that user
+    input can't inject FTS5 syntax. Returns None if there are no terms"""
+    return ' '.join(f'"{term}"*' for term in re.findall(r'\w+', q)) or None
+
+
+def sqlite_search(query, model, q: str):
+    """Matches the FTS5 table, ranked by weighted bm25"""
+    terms = fts5_query(q)
+    if terms is None:
+        return query.filter(false())
+    name = f'{model.__tablename__}_fts'
+    fts = table(name, column('rowid'))
+    weights = FTS5_WEIGHTS[:len(model.search_columns)]
+    # bm25 is negative, the more relevant the lower
+    rank = func.bm25(literal_column(name), *weights)
+    return query.join(fts, fts.c.rowid == model.id) \
+        .filter(literal_column(name).op('MATCH')(terms)) \
+        .order_by(rank, model.id)
+
+
+'''Return a page of the entities matching the search terms, best first.
+
+    @INPUTS
+        model: the searched model, see its search_columns
+        q: the search terms
+        limit: the page size
+        offset: the number of results to skip
+        fields: only load these fields (see projection.py)
+        include: eager load these relationships
+
+    Results are ranked, so they are paginated by offset: returns the rows
+    and the offset of the next page, or None on the last page.
+'''
+
+
+def search(model, q: str, limit: int, offset: int = 0, fields=None,
+           include=()):
+    query = project(model.query, model, fields)
+    query = include_relations(query, model, include)
+    bind = db.session.get_bind(mapper=model.__mapper__)
+    if bind.dialect.name == 'postgresql':
+        query = postgres_search(query, model, q, bind)
+    elif bind.dialect.name == 'sqlite':
+        query = sqlite_search(query, model, q)
+    else:
+        abort(501)
+
+    rows = query.offset(offset).limit(limit + 1).all()
+    next_offset = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_offset = offset + limit
+    return rows, next_offset
@@ -0,0 +1,66 @@
+from datetime import date
+from flask.json.provider import DefaultJSONProvider
+from pagination import ID_SORT, with_sort_field
+
+try:
+    import orjson
+except ImportError:  # optional, see README
+    orjson = None
+
+
+def default(o):
+    """Serializes dates as ISO 8601, and the rest like Flask does"""
+    if isinstance(o, date):
+        return o.isoformat()
+    return DefaultJSONProvider.default(o)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """JSON provider encoding with orjson when it is installed, and the
+    standard library otherwise. Dates are ISO 8601 either way (Flask renders
+    them as RFC 1123 by default)"""
+    default = staticmethod(default)
+
+    def dumps(self, obj, **kwargs):
+        # the arguments Flask passes are mapped onto orjson's options
+        if orjson is None or not set(kwargs) <= {'indent', 'separators'}:
+            return super().dumps(obj, **kwargs)
+        option = orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if kwargs.get('indent'):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=self.default, option=option).decode()
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+
+'''Return the query selecting plain rows of the serialized columns.
+
+    @INPUTS
+        query: the (filtered) query to restrict
+        model: the queried model
+        fields: the fields returned by projection.get_fields
+        sort: the sort returned by pagination.get_sort
+
+    Read-only lists don't need ORM objects: selecting the columns returns
+    lightweight rows, which skip instantiating, identity-mapping and
+    tracking an object per row. The sort field is selected after the
+    serialized fields when it isn't one of them, for the next page's cursor.
+'''
+
+
+def row_query(query, model, fields=None, sort=ID_SORT):
+    columns = with_sort_field(fields or model.serialized_fields, sort)
+    return query.with_entities(*(getattr(model, field) for field in columns))
+
+
+def format_row(row, model, fields=None, include=()):
+    """Serializes a row of row_query, or a model when relationships are
+    included (see Model.format)"""
+    if include:
+        return row.format(fields, include)
+    return dict(zip(fields or model.serialized_fields, row))
@@ -0,0 +1,53 @@
+from os import getenv
+from flask import current_app, Response, stream_with_context
+from db import db
+from pagination import ID_SORT, order_after
+from serialization import format_row
+
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+STREAM_BATCH_SIZE = int(getenv('STREAM_BATCH_SIZE', 1000))
+
+
+def wants_ndjson(request):
+    """Checks whether the client asked for a streamed NDJSON export"""
+    if request.args.get('stream', '').lower() in ('1', 'true'):
+        return True
+    accept = request.accept_mimetypes
+    return accept[NDJSON_MIMETYPE] > accept['application/json']
+
+
+'''Return a response streaming every row of a query as NDJSON.
+
+    @INPUTS
+        query: the query to export
+        model: the exported model
+        cursor: only stream rows after this cursor (to resume an export)
+        fields: only serialize these fields (see projection.py)
+        include: embed these relationships, which the query eager loads
+        sort: the order of the rows (see pagination.get_sort), by id by default
+
+    Rows are read through a server-side cursor in batches of
+    STREAM_BATCH_SIZE and written out as they are read, so the worker's
+    memory stays flat however large the table is.
+'''
+
+
+def stream_ndjson(query, model, cursor=None, fields=None, include=(),
+                  sort=ID_SORT):
+    query = order_after(query, model, sort, cursor)
+    query = query.execution_options(stream_results=True) \
+        .yield_per(STREAM_BATCH_SIZE)
+    dumps = current_app.json.dumps
+
+    def generate():
+        try:
+            for row in query:
+                yield dumps(format_row(row, model, fields, include)) + '\n'
+        finally:
+            db.session.close()
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype=NDJSON_MIMETYPE,
+    )
@@ -1,31 +1,101 @@
+import asyncio
+import gzip
+import importlib
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+import tracemalloc
 import unittest
 from os import getenv
+from unittest import mock
 from flask import Flask
 from json import loads
-from datetime import datetime
+from sqlalchemy import create_engine, event, insert, inspect, text
+from sqlalchemy.engine import Engine, make_url
+from alembic.script import ScriptDirectory
+from datetime import date, datetime, timedelta
+from werkzeug.datastructures import MultiDict
 from init import init_app
-from db import db, build_db_path
+from db import (
+    db,
+    build_db_path,
+    dispose_engines,
+    get_engine_options,
+    get_pool_stats,
+    RoutingSession,
+)
+from models import Actor, Movie, VERSIONED_TABLES
+from filters import filter_query
+from pagination import ID_SORT, order_after
 from test_data_factory import ActorFactory, MovieFactory
+from test_auth_stub import (
+    ALL_PERMISSIONS,
+    OfflineAuth,
+    SigningKey,
+    StubJWKSServer,
+)
+from jwks import JWKSKeyStore
+from token_cache import VerifiedTokenCache, token_cache
+from auth import AuthError, Claims, check_permissions, requires_auth
+from replicas import router
+import cache
+import rate_limit
+import request_logging
+from instrumentation import metrics
+from cache import get_entity, LRUCache, RedisCache
+from coalescing import read_flights, SingleFlight
+from rate_limit import get_tier, LocalBuckets, RateLimiter, RedisBuckets
 from dotenv import load_dotenv, find_dotenv
 
 birthdate_format = '%a, %d %b %Y %H:%M:%S GMT'
 
+
+def iso_date(birthdate: str):
+    """Returns an RFC 1123 birthdate as responses render it (ISO 8601)"""
+    return datetime.strptime(birthdate, birthdate_format).date().isoformat()
+
+
 load_dotenv(find_dotenv('.env.test'))
 
+# tokens are minted locally, against a stand-in of the Auth0 JWKS endpoint
+offline_auth = OfflineAuth('test')
+
+CASTING_ASSISTANT_PERMISSIONS = ['get:actors', 'get:movies']
+CASTING_DIRECTOR_PERMISSIONS = [
+    'delete:actors',
+    'get:actors',
+    'get:movies',
+    'patch:actors',
+    'patch:movies',
+    'post:actors',
+]
+
+# ids start over in every test, as on a new schema
+RESTART_SEQUENCES = \
+    "SELECT setval(oid::regclass, 1, false) FROM pg_class WHERE relkind = 'S'"
+
+
+def setUpModule():
+    offline_auth.__enter__()
+
+
+def tearDownModule():
+    offline_auth.__exit__(None, None, None)
+
+
 def get_headers_for_casting_assistant():
     """Test auth token for read-only endpoints"""
-    auth_token = getenv('CASTING_ASSISTANT_AUTH_TOKEN', '')
-    return {
-        'Authorization': 'Bearer ' + auth_token
-    }
+    return offline_auth.headers(
+        CASTING_ASSISTANT_PERMISSIONS, 'auth0|casting-assistant')
 
 
 def get_headers_for_casting_director():
     """Test auth token: CRUD for actors, RU for movies"""
-    auth_token = getenv('CASTING_DIRECTOR_AUTH_TOKEN', '')
-    return {
-        'Authorization': 'Bearer ' + auth_token
-    }
+    return offline_auth.headers(
+        CASTING_DIRECTOR_PERMISSIONS, 'auth0|casting-director')
 
 
 def get_headers_for_executive_producer():
@@ -33,40 +103,321 @@ def get_headers_for_executive_producer():
     Test auth token with all permissions
     (using this as default for testing endpoints)
     """
-    auth_token = getenv('EXECUTIVE_PRODUCER_AUTH_TOKEN', '')
-    return {
-        'Authorization': 'Bearer ' + auth_token
-    }
+    return offline_auth.headers(ALL_PERMISSIONS, 'auth0|executive-producer')
+
+
+def get_test_db_path():
+    """Returns the test database of this process: each pytest-xdist worker
+    gets its own, so that workers can run in parallel"""
+    db_name = 'castingagencytest'
+    worker = getenv('PYTEST_XDIST_WORKER')
+    if worker:
+        db_name = f'{db_name}_{worker}'
+    return build_db_path(
+        'postgresql', 'postgres', 'password', 'localhost:5432', db_name)
+
+
+def create_test_db(db_path: str):
+    """Creates the test database, unless it exists"""
+    url = make_url(db_path)
+    engine = create_engine(
+        url.set(database='postgres'), isolation_level='AUTOCOMMIT')
+    try:
+        with engine.connect() as connection:
+            exists = connection.execute(
+                text('SELECT 1 FROM pg_database WHERE datname = :name'),
+                {'name': url.database}).scalar()
+            if not exists:
+                connection.execute(text(
+                    f'CREATE DATABASE "{url.database}" '
+                    "ENCODING 'UTF8' TEMPLATE template0"))
+    finally:
+        engine.dispose()
+
+
+class TransactionalSession(RoutingSession):
+    """Session joining the transaction of the running test, bound to its
+    connection: commits only release a savepoint"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            return self.bind
+        return super().get_bind(
+            mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(TransactionalSession, 'after_transaction_end')
+def restart_savepoint(session, transaction):
+    """Opens the next savepoint once the app committed or rolled back"""
+    connection = session.bind
+    if connection.in_transaction() \
+            and not connection.in_nested_transaction():
+        connection.begin_nested()
+
+
+def without_transaction(test):
+    """Runs a test on the app's own pooled connections: it must not leave
+    any rows behind"""
+    test.transactional = False
+    return test
 
 
 class CastingAgencyTestCase(unittest.TestCase):
     """This class represents the actor test case"""
-    def setUp(self):
-        """Define test variables and initialize app."""
-        db_dialect = 'postgresql'
-        db_user = 'postgres'
-        db_password = 'password'
-        db_host = 'localhost:5432'
-        db_name = 'castingagencytest'
-        self.db_path = build_db_path(
-            db_dialect,
-            db_user,
-            db_password,
-            db_host,
-            db_name)
+    @classmethod
+    def setUpClass(cls):
+        """Creates the schema and the app once, every test rolls its
+        changes back"""
+        cls.db_path = get_test_db_path()
+        create_test_db(cls.db_path)
+        cls.app = Flask(__name__)
+        init_app(cls.app, db_path=cls.db_path, drop_db=True)
 
-        app = Flask(__name__)
+    @classmethod
+    def tearDownClass(cls):
+        dispose_engines(cls.app)
 
-        init_app(app, db_path=self.db_path, drop_db=True)
+    def setUp(self):
+        """Define test variables and begin the test's transaction."""
+        # the rolled back rows may still be cached, and their writers are
+        # still read from the primary, bypassing the cache
+        cache.entity_cache.clear()
+        rate_limit.rate_limiter.clear()
+        router.clear()
 
-        self.app = app
         self.client = self.app.test_client
+        self.connection = None
+        test = getattr(self, self._testMethodName)
+        if getattr(test, 'transactional', True):
+            self.begin_transaction()
+
+    def begin_transaction(self):
+        """Binds the sessions to one connection, in a transaction which
+        tearDown rolls back"""
+        with self.app.app_context():
+            self.connection = db.engine.connect()
+        self.transaction = self.connection.begin()
+        self.connection.execute(text(RESTART_SEQUENCES))
+        self.connection.begin_nested()
+        self.session = db.session
+        db.session = db._make_scoped_session({
+            'class_': TransactionalSession,
+            'bind': self.connection,
+        })
 
     def tearDown(self):
         """Executed after each test"""
+        if self.connection is not None:
+            db.session = self.session
+            self.transaction.rollback()
+            self.connection.close()
+
+    #  ------------------------------------------------------------------------
+    #  Diagnostics
+    #  ------------------------------------------------------------------------
+    def test_engine_options_from_env(self):
+        """Tests that pool settings are read from the environment"""
+        env = {
+            'DB_POOL_SIZE': '20',
+            'DB_MAX_OVERFLOW': '0',
+            'DB_POOL_RECYCLE': '300',
+            'DB_POOL_PRE_PING': 'false',
+        }
+        with mock.patch.dict('os.environ', env):
+            options = get_engine_options(self.db_path)
+        self.assertEqual(options['pool_size'], 20)
+        self.assertEqual(options['max_overflow'], 0)
+        self.assertEqual(options['pool_recycle'], 300)
+        self.assertEqual(options['pool_pre_ping'], False)
+        self.assertEqual(get_engine_options('sqlite://'), {})
+
+    @without_transaction
+    def test_pool_diagnostics(self):
+        """Tests the pool statistics endpoint"""
+        self.client().get(
+            '/actors',
+            headers=get_headers_for_executive_producer()
+        )
+        res = self.client().get('/healthcheck/pool')
+        data = loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        pool = data['pool']
+        self.assertEqual(pool['pool'], 'InstrumentedQueuePool')
+        self.assertGreaterEqual(pool['checkouts'], 1)
+        self.assertEqual(pool['checked_out'], 0)
+
+    @without_transaction
+    def test_pool_counters(self):
+        """Tests the pool counters under concurrent checkouts, and once the
+        pool was recreated"""
+        engine = create_engine(
+            self.db_path, **get_engine_options(self.db_path))
+        try:
+            def check_out():
+                for _ in range(25):
+                    engine.connect().close()
+
+            threads = [threading.Thread(target=check_out) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            stats = get_pool_stats(engine)
+            self.assertEqual(stats['checkouts'], 200)
+            self.assertEqual(stats['checked_out'], 0)
+            self.assertGreater(stats['hold_time_total'], 0)
+
+            # a recreated pool counts its own checkouts, once each
+            engine.dispose()
+            engine.connect().close()
+            self.assertEqual(get_pool_stats(engine)['checkouts'], 1)
+        finally:
+            engine.dispose()
+
+    def test_request_logging(self):
+        """Tests that requests are logged as JSON lines"""
+        stream = io.StringIO()
+        request_logging.stop_listener()
+        request_logging.start_listener(stream)
+        try:
+            self.client().get(
+                '/movies',
+                headers=get_headers_for_executive_producer()
+            )
+            self.client().get(
+                '/movies/42',
+                headers=get_headers_for_executive_producer()
+            )
+        finally:
+            request_logging.stop_listener()
+            request_logging.start_listener()
+
+        lines = [loads(line) for line in stream.getvalue().splitlines()]
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(lines[0]['method'], 'GET')
+        self.assertEqual(lines[0]['route'], '/movies')
+        self.assertEqual(lines[0]['status'], 200)
+        self.assertGreater(lines[0]['duration_ms'], 0)
+        self.assertGreaterEqual(lines[0]['db_statements'], 1)
+        self.assertEqual(lines[1]['route'], '/movies/<int:movie_id>')
+        self.assertEqual(lines[1]['status'], 404)
+        self.assertIn('NotFound', lines[1]['error'])
+
+    @without_transaction
+    def test_forked_worker(self):
+        """Tests the gunicorn fork hooks: a forked worker gets its own
+        connections and logging thread"""
+        log_path = os.path.join(tempfile.mkdtemp(), 'requests.log')
+        with open(log_path, 'w') as stream:
+            request_logging.stop_listener()
+            request_logging.start_listener(stream)
+            try:
+                with self.app.app_context():
+                    db.session.execute(text('SELECT 1'))
+                    db.session.close()
+                # pre_fork
+                dispose_engines(self.app)
+                with self.app.app_context():
+                    self.assertEqual(db.engine.pool.checkedin(), 0)
+
+                pid = os.fork()
+                if pid == 0:
+                    # post_fork
+                    exit_code = 1
+                    try:
+                        dispose_engines(self.app)
+                        request_logging.restart_listener()
+                        res = self.client().get(
+                            '/movies',
+                            headers=get_headers_for_executive_producer())
+                        request_logging.stop_listener()
+                        exit_code = 0 if res.status_code == 200 else 1
+                    finally:
+                        os._exit(exit_code)
+                _, status = os.waitpid(pid, 0)
+                self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+            finally:
+                request_logging.stop_listener()
+                request_logging.start_listener()
+
+        with open(log_path) as stream:
+            lines = [loads(line) for line in stream]
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(lines[0]['route'], '/movies')
+        self.assertGreaterEqual(lines[0]['db_statements'], 1)
+        res = self.client().get(
+            '/movies', headers=get_headers_for_executive_producer())
+        self.assertEqual(res.status_code, 200)
+
+    def test_lazy_app(self):
+        """Tests that app.py builds its module level app on first access"""
+        import app as app_module
+        self.assertNotIn('app', vars(app_module))
+        with mock.patch.object(
+                app_module, 'create_app', return_value=self.app) as create:
+            try:
+                self.assertIs(app_module.app, self.app)
+                self.assertIs(app_module.app, self.app)
+            finally:
+                vars(app_module).pop('app', None)
+        self.assertEqual(create.call_count, 1)
+
+    def test_request_log_sampling(self):
+        """Tests that successful requests to busy routes are sampled"""
+        with mock.patch.object(request_logging, 'SAMPLE_RATE', 0):
+            self.assertFalse(request_logging.should_log('/movies', 200, 1))
+            self.assertTrue(request_logging.should_log('/movies', 500, 1))
+            self.assertTrue(request_logging.should_log('/movies', 200, 5000))
+            self.assertTrue(request_logging.should_log('/movies/bulk', 200, 1))
+
+    def test_server_timing(self):
+        """Tests the breakdown of requests in a Server-Timing header"""
         with self.app.app_context():
-            db.session.rollback()
-            pass
+            MovieFactory.create_batch(2)
+            db.session.commit()
+
+        with mock.patch.dict('os.environ', {'SERVER_TIMING_ENABLED': 'true'}):
+            res = self.client().get(
+                '/movies',
+                headers=get_headers_for_executive_producer()
+            )
+        self.assertEqual(res.status_code, 200)
+        phases = [
+            entry.split(';')[0]
+            for entry in res.headers['Server-Timing'].split(', ')
+        ]
+        self.assertEqual(phases[0], 'auth')
+        self.assertIn('db', phases)
+        self.assertIn('serialize', phases)
+        self.assertEqual(phases[-1], 'total')
+
+        res = self.client().get(
+            '/movies',
+            headers=get_headers_for_executive_producer()
+        )
+        self.assertNotIn('Server-Timing', res.headers)
+
+    def test_metrics(self):
+        """Tests the Prometheus metrics endpoint"""
+        metrics.clear()
+        self.client().get(
+            '/movies',
+            headers=get_headers_for_executive_producer()
+        )
+        res = self.client().get('/metrics')
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res.content_type.startswith('text/plain'))
+        text = res.get_data(as_text=True)
+        self.assertIn(
+            'http_request_duration_seconds_count{'
+            'endpoint="movies_blueprint.get_movies",method="GET",'
+            'status="200"} 1',
+            text)
+        self.assertIn(
+            'http_request_phase_duration_seconds_bucket{'
+            'endpoint="movies_blueprint.get_movies",phase="db",le="+Inf"} 1',
+            text)
+        self.assertIn('castingagency_token_cache_hits ', text)
 
     #  ------------------------------------------------------------------------
     #  Auth errors
@@ -90,16 +441,84 @@ class CastingAgencyTestCase(unittest.TestCase):
 
     def test_expired_token(self):
         """Tests that token expiry is checked"""
-        expired_auth_token = getenv('EXPIRED_AUTH_TOKEN', '')
-        invalid_headers = {
-            'Authorization': f'Bearer {expired_auth_token}'
-        }
+        invalid_headers = offline_auth.headers(expires_in=-3600)
         res = self.client().get('/actors', headers=invalid_headers)
         data = loads(res.data)
         self.assertEqual(res.status_code, 403)
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'], 'Token has expired')
 
+    def test_rate_limited(self):
+        """Tests that each subject is limited to its tier's rate"""
+        limiter = rate_limit.rate_limiter
+        rate_limit.set_rate_limiter(RateLimiter(
+            LocalBuckets(), limits={'read': (0.5, 2), 'write': (10, 20)}))
+        try:
+            headers = get_headers_for_casting_assistant()
+            for _ in range(2):
+                res = self.client().get('/movies', headers=headers)
+                self.assertEqual(res.status_code, 200)
+            res = self.client().get('/movies', headers=headers)
+            data = loads(res.data)
+            self.assertEqual(res.status_code, 429)
+            self.assertEqual(res.headers['Retry-After'], '2')
+            self.assertEqual(data['success'], False)
+            self.assertEqual(data['message'], 'Too many requests')
+
+            res = self.client().get(
+                '/movies', headers=get_headers_for_casting_director())
+            self.assertEqual(res.status_code, 200)
+            text = self.client().get('/metrics').get_data(as_text=True)
+            self.assertIn('castingagency_rate_limit_read_allowed 2\n', text)
+            self.assertIn('castingagency_rate_limit_read_limited 1\n', text)
+            self.assertIn('castingagency_rate_limit_write_allowed 1\n', text)
+        finally:
+            rate_limit.set_rate_limiter(limiter)
+
+    def test_coalesced_reads(self):
+        """Tests that concurrent reads of a movie share one load"""
+        with self.app.app_context():
+            MovieFactory.create()
+            db.session.commit()
+        headers = get_headers_for_casting_assistant()
+        read_flights.clear()
+        responses = []
+
+        def read_movie():
+            responses.append(self.client().get('/movies/1', headers=headers))
+
+        def load_while_read(*args):
+            # the second read arrives while the first one loads the movie
+            follower.start()
+            while read_flights.stats()['coalesced'] < 1:
+                time.sleep(0.001)
+            return get_entity(*args)
+
+        follower = threading.Thread(target=read_movie)
+        with mock.patch('movies.routes.get_entity',
+                        side_effect=load_while_read) as load:
+            read_movie()
+            follower.join()
+        self.assertEqual(load.call_count, 1)
+        self.assertEqual(
+            [res.status_code for res in responses], [200, 200])
+        self.assertEqual(responses[0].data, responses[1].data)
+        self.assertEqual(responses[0].headers['ETag'],
+                         responses[1].headers['ETag'])
+
+        # reads of recent writers run on their own, 404s aren't shared
+        res = self.client().get('/movies/1', headers={
+            **headers, 'X-Read-Your-Writes': 'true'})
+        self.assertEqual(res.status_code, 200)
+        res = self.client().get('/movies/2', headers=headers)
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(read_flights.stats(), {
+            'calls': 3, 'executions': 2, 'coalesced': 1, 'in_flight': 0,
+            'collapse_ratio': 1 / 3,
+        })
+        text = self.client().get('/metrics').get_data(as_text=True)
+        self.assertIn('castingagency_read_coalescing_coalesced 1\n', text)
+
     #  ------------------------------------------------------------------------
     #  Actors
     #  ------------------------------------------------------------------------
@@ -122,6 +541,204 @@ class CastingAgencyTestCase(unittest.TestCase):
         actors = data['actors']
         self.assertEqual(len(actors), num_actors_to_test)
 
+    def test_get_actors_paginated(self):
+        """Tests paging through the actors with a cursor"""
+        num_actors_to_test = 5
+        with self.app.app_context():
+            ActorFactory.create_batch(num_actors_to_test)
+            db.session.commit()
+
+        seen = []
+        cursor = None
+        while True:
+            url = '/actors?limit=2' + (f'&cursor={cursor}' if cursor else '')
+            res = self.client().get(
+                url,
+                headers=get_headers_for_executive_producer()
+            )
+            data = loads(res.data)
+            self.assertEqual(res.status_code, 200)
+            self.assertLessEqual(len(data['actors']), 2)
+            seen.extend(actor['id'] for actor in data['actors'])
+            cursor = data['next_cursor']
+            if not cursor:
+                break
+        self.assertEqual(seen, sorted(set(seen)))
+        self.assertEqual(len(seen), num_actors_to_test)
+
+    def test_get_actors_invalid_cursor_400(self):
+        """Tests that a malformed cursor is rejected"""
+        res = self.client().get(
+            '/actors?cursor=not-a-cursor',
+            headers=get_headers_for_executive_producer()
+        )
+        data = loads(res.data)
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
+    def test_get_actors_filtered(self):
+        """Tests filtering the actors by name prefix and birthdate range"""
+        with self.app.app_context():
+            for name, birthdate in (
+                    ('Al Pacino', '1940-04-25'),
+                    ('alan Arkin', '1934-03-26'),
+                    ('Albert Finney', '1936-05-09'),
+                    ('Al_ Green', '1946-04-13'),
+                    ('Bob Hoskins', '1942-10-26')):
+                ActorFactory.create(name=name, birthdate=birthdate)
+            db.session.commit()
+
+        headers = get_headers_for_executive_producer()
+
+        def names(query):
+            res = self.client().get('/actors?' + query, headers=headers)
+            self.assertEqual(res.status_code, 200)
+            return sorted(actor['name'] for actor in loads(res.data)['actors'])
+
+        self.assertEqual(
+            names('name_prefix=AL'),
+            ['Al Pacino', 'Al_ Green', 'Albert Finney', 'alan Arkin'])
+        # LIKE wildcards are matched literally
+        self.assertEqual(names('name_prefix=al_'), ['Al_ Green'])
+        self.assertEqual(names('name_prefix=%25'), [])
+        self.assertEqual(
+            names('birthdate_from=1936-05-09&birthdate_to=1942-10-26'),
+            ['Al Pacino', 'Albert Finney', 'Bob Hoskins'])
+        self.assertEqual(
+            names('name_prefix=al&birthdate_to=1937-01-01'),
+            ['Albert Finney', 'alan Arkin'])
+
+        for query in ('birthdate_from=yesterday', 'name_prefix='):
+            res = self.client().get('/actors?' + query, headers=headers)
+            self.assertEqual(res.status_code, 400)
+
+    def test_get_actors_sorted_paginated(self):
+        """Tests paging through the actors sorted by a column, with ties and
+        NULLs"""
+        with self.app.app_context():
+            for name, birthdate in (
+                    ('Cher', None),
+                    ('Cher', '1946-05-20'),
+                    ('Anna', '1980-01-01'),
+                    ('Bea', None),
+                    ('Anna', '1980-01-01'),
+                    ('Dan', '1970-07-07')):
+                ActorFactory.create(name=name, birthdate=birthdate)
+            db.session.commit()
+            actors = [
+                (actor.id, actor.name, actor.birthdate)
+                for actor in Actor.query.all()]
+
+        headers = get_headers_for_executive_producer()
+
+        def page_through(sort, fields=None):
+            seen = []
+            cursor = None
+            while True:
+                url = f'/actors?limit=2&sort={sort}'
+                if fields:
+                    url += f'&fields={fields}'
+                if cursor:
+                    url += f'&cursor={cursor}'
+                res = self.client().get(url, headers=headers)
+                self.assertEqual(res.status_code, 200)
+                data = loads(res.data)
+                seen.extend(actor['id'] for actor in data['actors'])
+                cursor = data['next_cursor']
+                if not cursor:
+                    return seen
+
+        by_name = sorted(actors, key=lambda actor: (actor[1], actor[0]))
+        self.assertEqual(
+            page_through('name'), [actor[0] for actor in by_name])
+        # the sort column needn't be among the requested fields
+        self.assertEqual(
+            page_through('name', fields='id'), [actor[0] for actor in by_name])
+        # NULLs come last, and first when descending
+        dated = sorted(
+            (actor for actor in actors if actor[2]),
+            key=lambda actor: (actor[2], actor[0]))
+        undated = [actor[0] for actor in actors if not actor[2]]
+        self.assertEqual(
+            page_through('birthdate'),
+            [actor[0] for actor in dated] + sorted(undated))
+        self.assertEqual(
+            page_through('-birthdate'),
+            sorted(undated, reverse=True)
+            + [actor[0] for actor in reversed(dated)])
+
+        # a cursor only resumes the sort it was issued for
+        res = self.client().get('/actors?limit=2&sort=name', headers=headers)
+        cursor = loads(res.data)['next_cursor']
+        for query in (f'cursor={cursor}', f'sort=-name&cursor={cursor}',
+                      'sort=updated_at', 'sort=-'):
+            res = self.client().get('/actors?' + query, headers=headers)
+            self.assertEqual(res.status_code, 400)
+
+    def test_filter_and_sort_use_indexes(self):
+        """Tests that filtered and sorted pages are planned as index scans
+        rather than sequential scans of the table"""
+        with self.app.app_context():
+            db.session.execute(insert(Actor), [
+                {
+                    'name': f'Actor {i:05d}',
+                    'birthdate': date(1930, 1, 1) + timedelta(days=i * 2),
+                }
+                for i in range(10000)
+            ])
+            db.session.commit()
+            db.session.execute(text('ANALYZE actors'))
+
+            def explain(args, sort=ID_SORT, cursor=None):
+                query = filter_query(Actor.query, Actor, MultiDict(args))
+                query = order_after(query, Actor, sort, cursor).limit(51)
+                compiled = query.statement.compile(db.engine)
+                plan = db.session.connection().exec_driver_sql(
+                    f'EXPLAIN {compiled}', compiled.params).scalars().all()
+                return '\n'.join(plan)
+
+            for plan in (
+                    explain({'name_prefix': 'actor 0012'}),
+                    explain({'birthdate_from': '1950-01-01',
+                             'birthdate_to': '1950-03-01'}),
+                    explain({}, sort=('name', False)),
+                    explain({}, sort=('name', True), cursor={
+                        'after': 5000,
+                        'sort': '-name',
+                        'key': 'Actor 05000',
+                    }),
+                    explain({}, sort=('birthdate', False))):
+                self.assertIn('Index', plan)
+                self.assertNotIn('Seq Scan', plan)
+
+    def test_get_actors_serialization(self):
+        """Tests that dates are rendered as ISO 8601, with or without orjson,
+        and that lists are serialized without loading ORM objects"""
+        with self.app.app_context():
+            ActorFactory.create(name='Ingrid Bergman', birthdate='1915-08-29')
+            db.session.commit()
+
+        headers = get_headers_for_executive_producer()
+        loaded = []
+
+        def record(target, context):
+            loaded.append(target)
+
+        event.listen(Actor, 'load', record)
+        try:
+            res = self.client().get('/actors?sort=name', headers=headers)
+        finally:
+            event.remove(Actor, 'load', record)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(loaded, [])
+        self.assertEqual(loads(res.data)['actors'], [
+            {'id': 1, 'name': 'Ingrid Bergman', 'birthdate': '1915-08-29'},
+        ])
+
+        with mock.patch('serialization.orjson', None):
+            fallback = self.client().get('/actors?sort=name', headers=headers)
+        self.assertEqual(fallback.data, res.data)
+
     def test_get_actor(self):
         """Tests getting an individual actor"""
         # creating multiple actors, and picking a specific one
@@ -159,10 +776,28 @@ class CastingAgencyTestCase(unittest.TestCase):
             {
                 'id': expected_id,
                 'name': expected_name,
-                'birthdate': expected_birthdate,
+                'birthdate': iso_date(expected_birthdate),
             }
         )
 
+    def test_get_actor_fields(self):
+        """Tests getting a subset of an actor's fields"""
+        with self.app.app_context():
+            actor = ActorFactory.create(name='Morgan Freeman')
+            db.session.commit()
+            actor_id = actor.id
+
+        res = self.client().get(
+            f'actors/{actor_id}?fields=name',
+            headers=get_headers_for_executive_producer()
+        )
+        data = loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(
+            data['actor'],
+            {'id': actor_id, 'name': 'Morgan Freeman'}
+        )
+
     def test_get_actor_error_404(self):
         """Tests an error getting an actor"""
         out_of_range_id = 3
@@ -210,7 +845,7 @@ class CastingAgencyTestCase(unittest.TestCase):
             {
                 'id': id,
                 'name': expected_name,
-                'birthdate': expected_birthdate
+                'birthdate': iso_date(expected_birthdate)
             }
         )
 
@@ -261,7 +896,7 @@ class CastingAgencyTestCase(unittest.TestCase):
             {
                 'id': 1,
                 'name': expected_name,
-                'birthdate': expected_birthdate,
+                'birthdate': iso_date(expected_birthdate),
             }
         )
 
@@ -279,6 +914,21 @@ class CastingAgencyTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 400)
         self.assertEqual(data['success'], False)
 
+    def test_create_actor_422(self):
+        """Tests creating an actor with an invalid birthdate"""
+        post_data = {
+            'name': 'Chuck Norris',
+            'birthdate': '10 Mar 1940',
+        }
+        res = self.client().post(
+            'actors',
+            json=post_data,
+            headers=get_headers_for_executive_producer()
+        )
+        data = loads(res.data)
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
+
     def test_delete_actor(self):
         """Tests deleting a actor"""
         with self.app.app_context():
@@ -340,109 +990,417 @@ class CastingAgencyTestCase(unittest.TestCase):
         movies = data['movies']
         self.assertEqual(len(movies), num_movies_to_test)
 
-    def test_get_movie(self):
-        """Tests getting an individual movie"""
-        # creating multiple movies, and picking a specific one
-        expected_id = 2
-        expected_title = 'Driving Miss Daisy'
-        expected_description = ('An old Jewish woman and her African-American '
-                                'chauffeur in the American South have a '
-                                'relationship that grows and improves over '
-                                'the years.')
+    def test_get_movies_offset(self):
+        """Tests the offset paging fallback for movies"""
         with self.app.app_context():
-            MovieFactory.create(
-                title='Con Air',
-                description=(
-                    'Newly-paroled ex-con and former U.S. Ranger Cameron Poe '
-                    'finds himself trapped in a prisoner-transport plane '
-                    'when the passengers seize control.'
-                )
-            )
-            MovieFactory.create(
-                title=expected_title,
-                description=expected_description
-            )
-            MovieFactory.create(
-                title='Random Movie',
-                description='This is a random description.'
-            )
+            MovieFactory.create_batch(5)
             db.session.commit()
 
         res = self.client().get(
-            f'movies/{expected_id}',
+            '/movies?limit=2&offset=4',
             headers=get_headers_for_executive_producer()
         )
         data = loads(res.data)
         self.assertEqual(res.status_code, 200)
-        self.assertEqual(data['success'], True)
-        self.assertNotIn('error', data)
-        movie = data['movie']
-        # expected movie
-        self.assertEqual(
-            movie,
-            {
-                'id': expected_id,
-                'title': expected_title,
-                'description': expected_description
-            }
-        )
+        self.assertEqual(len(data['movies']), 1)
+        self.assertIsNone(data['next_cursor'])
 
-    def test_get_movie_error_404(self):
-        """Tests an error getting an movie"""
-        out_of_range_id = 3
+    def test_get_movies_ndjson(self):
+        """Tests streaming all movies as NDJSON"""
+        num_movies_to_test = 7
         with self.app.app_context():
-            MovieFactory.create_batch(2)
+            MovieFactory.create_batch(num_movies_to_test)
+            db.session.commit()
+
+        headers = get_headers_for_executive_producer()
+        headers['Accept'] = 'application/x-ndjson'
+        res = self.client().get('/movies', headers=headers)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'application/x-ndjson')
+        lines = res.data.decode().splitlines()
+        self.assertEqual(len(lines), num_movies_to_test)
+        ids = [loads(line)['id'] for line in lines]
+        self.assertEqual(ids, sorted(ids))
+
+    def test_get_movies_compressed(self):
+        """Tests gzip compression of large and streamed responses"""
+        with self.app.app_context():
+            MovieFactory.create_batch(20, description='A long story. ' * 20)
+            ActorFactory.create()
+            db.session.commit()
+
+        headers = get_headers_for_executive_producer()
+        plain = self.client().get('/movies', headers=headers)
+        self.assertNotIn('Content-Encoding', plain.headers)
+        self.assertIn('Accept-Encoding', plain.vary)
+
+        headers['Accept-Encoding'] = 'gzip'
+        res = self.client().get('/movies', headers=headers)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+        self.assertLess(len(res.data), len(plain.data) / 4)
+        self.assertEqual(gzip.decompress(res.data), plain.data)
+        # the ETag is weakened, and still revalidates
+        self.assertEqual(res.headers['ETag'], 'W/' + plain.headers['ETag'])
+        res = self.client().get('/movies', headers={
+            **headers, 'If-None-Match': res.headers['ETag']})
+        self.assertEqual(res.status_code, 304)
+
+        # small responses aren't worth it
+        res = self.client().get('/actors/1', headers=headers)
+        self.assertNotIn('Content-Encoding', res.headers)
+
+        res = self.client().get('/movies?stream=1', headers=headers)
+        self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+        lines = gzip.decompress(res.data).decode().splitlines()
+        self.assertEqual(len(lines), 20)
+
+    def test_stream_movies_bounded_memory(self):
+        """Tests that streaming a large table keeps memory flat"""
+        num_movies_to_test = 20000
+        description = 'x' * 1000
+        with self.app.app_context():
+            db.session.execute(Movie.__table__.insert(), [
+                {'title': f'Movie {i}', 'description': description}
+                for i in range(num_movies_to_test)
+            ])
             db.session.commit()
 
         res = self.client().get(
-            f'movies/{out_of_range_id}',
-            headers=get_headers_for_executive_producer()
+            '/movies?stream=1',
+            headers=get_headers_for_executive_producer(),
+            buffered=False
         )
-        data = loads(res.data)
-        self.assertEqual(res.status_code, 404)
-        self.assertEqual(data['success'], False)
+        self.assertEqual(res.status_code, 200)
+        tracemalloc.start()
+        try:
+            num_bytes = 0
+            num_lines = 0
+            for chunk in res.response:
+                num_bytes += len(chunk)
+                num_lines += chunk.count(b'\n')
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+            res.close()
+        self.assertEqual(num_lines, num_movies_to_test)
+        # the whole body is ~20MB, the stream should never hold much of it
+        self.assertGreater(num_bytes, 20 * 1024 * 1024)
+        self.assertLess(peak, num_bytes / 4)
 
-    def test_update_movie(self):
-        """Tests updating an existing movie"""
+    def test_get_movies_fields(self):
+        """Tests that ?fields= projects columns in SQL"""
         with self.app.app_context():
-            MovieFactory.create(
-                title='Dawn of the Dead',
-                description=('During an escalating zombie epidemic, two '
-                             'Philadelphia SWAT team members, a traffic '
-                             'reporter and his TV executive girlfriend seek '
-                             'refuge in a secluded shopping mall.')
-            )
+            MovieFactory.create_batch(3)
             db.session.commit()
+            engine = db.engine
 
-        id = 1
-        expected_title = 'Dawn of the Dead'
-        expected_description = ('A nurse, a policeman, a young married '
-                                'couple, a salesman and other survivors of a '
-                                'worldwide plague that is producing '
-                                'aggressive, flesh-eating zombies, take '
-                                'refuge in a mega Midwestern shopping mall.')
-        patch_data = {
-            'title': expected_title,
-            'description': expected_description
-        }
-        res = self.client().patch(
-            f'movies/{id}',
-            json=patch_data,
-            headers=get_headers_for_executive_producer()
-        )
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(engine, 'before_cursor_execute', record)
+        try:
+            res = self.client().get(
+                '/movies?fields=title',
+                headers=get_headers_for_executive_producer()
+            )
+        finally:
+            event.remove(engine, 'before_cursor_execute', record)
         data = loads(res.data)
         self.assertEqual(res.status_code, 200)
-        self.assertEqual(data['success'], True)
-        self.assertNotIn('error', data)
-        movie = data['movie']
-        self.assertEqual(
-            movie,
-            {
-                'id': id,
-                'title': expected_title,
-                'description': expected_description
-            }
-        )
+        for movie in data['movies']:
+            self.assertEqual(set(movie), {'id', 'title'})
+        self.assertTrue(statements)
+        for statement in statements:
+            self.assertNotIn('description', statement)
+
+    def test_get_movie_cached(self):
+        """Tests that movies are served from the entity cache until written"""
+        with self.app.app_context():
+            movie = MovieFactory.create(title='Con Air')
+            db.session.commit()
+            movie_id = movie.id
+            engine = db.engine
+
+        headers = get_headers_for_executive_producer()
+        res = self.client().get(f'/movies/{movie_id}', headers=headers)
+        self.assertEqual(loads(res.data)['movie']['title'], 'Con Air')
+
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(engine, 'before_cursor_execute', record)
+        try:
+            res = self.client().get(f'/movies/{movie_id}', headers=headers)
+        finally:
+            event.remove(engine, 'before_cursor_execute', record)
+        self.assertEqual(loads(res.data)['movie']['title'], 'Con Air')
+        self.assertEqual(statements, [])
+
+        self.client().patch(
+            f'/movies/{movie_id}',
+            json={'title': 'Face/Off'},
+            headers=headers
+        )
+        res = self.client().get(f'/movies/{movie_id}', headers=headers)
+        self.assertEqual(loads(res.data)['movie']['title'], 'Face/Off')
+
+        self.client().delete(f'/movies/{movie_id}', headers=headers)
+        res = self.client().get(f'/movies/{movie_id}', headers=headers)
+        self.assertEqual(res.status_code, 404)
+
+    def test_get_movie_not_modified(self):
+        """Tests that a movie's ETag is honoured until the movie changes"""
+        with self.app.app_context():
+            movie = MovieFactory.create(title='Con Air')
+            db.session.commit()
+            movie_id = movie.id
+
+        headers = get_headers_for_executive_producer()
+        res = self.client().get(f'/movies/{movie_id}', headers=headers)
+        etag = res.headers['ETag']
+        self.assertIn('Last-Modified', res.headers)
+
+        res = self.client().get(
+            f'/movies/{movie_id}',
+            headers={**headers, 'If-None-Match': etag})
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.data, b'')
+        self.assertEqual(res.headers['ETag'], etag)
+
+        # projections are distinct representations
+        res = self.client().get(
+            f'/movies/{movie_id}?fields=title',
+            headers={**headers, 'If-None-Match': etag})
+        self.assertEqual(res.status_code, 200)
+
+        self.client().patch(
+            f'/movies/{movie_id}',
+            json={'title': 'Face/Off'},
+            headers=headers
+        )
+        res = self.client().get(
+            f'/movies/{movie_id}',
+            headers={**headers, 'If-None-Match': etag})
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers['ETag'], etag)
+        self.assertEqual(loads(res.data)['movie']['title'], 'Face/Off')
+
+    def test_get_movies_not_modified(self):
+        """Tests that unchanged lists are answered without loading rows"""
+        with self.app.app_context():
+            MovieFactory.create_batch(3)
+            db.session.commit()
+            engine = db.engine
+
+        headers = get_headers_for_executive_producer()
+        res = self.client().get('/movies?limit=2', headers=headers)
+        etag = res.headers['ETag']
+
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            # leaving out the savepoints of the test's transaction
+            if 'SAVEPOINT' not in statement:
+                statements.append(statement)
+
+        event.listen(engine, 'before_cursor_execute', record)
+        try:
+            res = self.client().get(
+                '/movies?limit=2',
+                headers={**headers, 'If-None-Match': etag})
+        finally:
+            event.remove(engine, 'before_cursor_execute', record)
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(len(statements), 1)
+        self.assertIn('table_versions', statements[0])
+
+        res = self.client().get(
+            '/movies?limit=1', headers={**headers, 'If-None-Match': etag})
+        self.assertEqual(res.status_code, 200)
+
+        self.client().post(
+            '/movies/bulk',
+            json={'movies': [{'title': 'Heat', 'description': 'Crime'}]},
+            headers=headers
+        )
+        res = self.client().get(
+            '/movies?limit=2', headers={**headers, 'If-None-Match': etag})
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers['ETag'], etag)
+
+    def test_table_versions_bumped_in_order(self):
+        """Tests that a flush bumps (so locks) the table versions in order of
+        name, whatever the order of the changes"""
+        bumped = []
+
+        def record(conn, cursor, statement, parameters, *args):
+            if statement.startswith('UPDATE table_versions'):
+                bumped.extend(
+                    value for value in parameters.values()
+                    if value in VERSIONED_TABLES)
+
+        with self.app.app_context():
+            actor = ActorFactory.create()
+            movie = MovieFactory.create()
+            db.session.commit()
+            engine = db.engine
+
+            event.listen(engine, 'before_cursor_execute', record)
+            try:
+                movie.actors.append(actor)
+                actor.name = 'Cher'
+                db.session.flush()
+            finally:
+                event.remove(engine, 'before_cursor_execute', record)
+            db.session.rollback()
+        self.assertEqual(bumped, ['actors', 'castings', 'movies'])
+
+    def test_get_actor_if_modified_since(self):
+        """Tests conditional requests on the Last-Modified date"""
+        with self.app.app_context():
+            actor = ActorFactory.create()
+            db.session.commit()
+            actor_id = actor.id
+
+        headers = get_headers_for_executive_producer()
+        res = self.client().get(f'/actors/{actor_id}', headers=headers)
+        last_modified = res.headers['Last-Modified']
+
+        res = self.client().get(
+            f'/actors/{actor_id}',
+            headers={**headers, 'If-Modified-Since': last_modified})
+        self.assertEqual(res.status_code, 304)
+
+        res = self.client().get(
+            f'/actors/{actor_id}',
+            headers={
+                **headers,
+                'If-Modified-Since': 'Mon, 01 Jan 2001 00:00:00 GMT',
+            })
+        self.assertEqual(res.status_code, 200)
+
+    def test_get_movie_invalid_fields_400(self):
+        """Tests that unknown fields are rejected"""
+        with self.app.app_context():
+            MovieFactory.create()
+            db.session.commit()
+
+        res = self.client().get(
+            '/movies/1?fields=budget',
+            headers=get_headers_for_executive_producer()
+        )
+        data = loads(res.data)
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
+    def test_get_movie(self):
+        """Tests getting an individual movie"""
+        # creating multiple movies, and picking a specific one
+        expected_id = 2
+        expected_title = 'Driving Miss Daisy'
+        expected_description = ('An old Jewish woman and her African-American '
+                                'chauffeur in the American South have a '
+                                'relationship that grows and improves over '
+                                'the years.')
+        with self.app.app_context():
+            MovieFactory.create(
+                title='Con Air',
+                description=(
+                    'Newly-paroled ex-con and former U.S. Ranger Cameron Poe '
+                    'finds himself trapped in a prisoner-transport plane '
+                    'when the passengers seize control.'
+                )
+            )
+            MovieFactory.create(
+                title=expected_title,
+                description=expected_description
+            )
+            MovieFactory.create(
+                title='Random Movie',
+                description='This is a random description.'
+            )
+            db.session.commit()
+
+        res = self.client().get(
+            f'movies/{expected_id}',
+            headers=get_headers_for_executive_producer()
+        )
+        data = loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertNotIn('error', data)
+        movie = data['movie']
+        # expected movie
+        self.assertEqual(
+            movie,
+            {
+                'id': expected_id,
+                'title': expected_title,
+                'description': expected_description
+            }
+        )
+
+    def test_get_movie_error_404(self):
+        """Tests an error getting an movie"""
+        out_of_range_id = 3
+        with self.app.app_context():
+            MovieFactory.create_batch(2)
+            db.session.commit()
+
+        res = self.client().get(
+            f'movies/{out_of_range_id}',
+            headers=get_headers_for_executive_producer()
+        )
+        data = loads(res.data)
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['success'], False)
+
+    def test_update_movie(self):
+        """Tests updating an existing movie"""
+        with self.app.app_context():
+            MovieFactory.create(
+                title='Dawn of the Dead',
+                description=('During an escalating zombie epidemic, two '
+                             'Philadelphia SWAT team members, a traffic '
+                             'reporter and his TV executive girlfriend seek '
+                             'refuge in a secluded shopping mall.')
+            )
+            db.session.commit()
+
+        id = 1
+        expected_title = 'Dawn of the Dead'
+        expected_description = ('A nurse, a policeman, a young married '
+                                'couple, a salesman and other survivors of a '
+                                'worldwide plague that is producing '
+                                'aggressive, flesh-eating zombies, take '
+                                'refuge in a mega Midwestern shopping mall.')
+        patch_data = {
+            'title': expected_title,
+            'description': expected_description
+        }
+        res = self.client().patch(
+            f'movies/{id}',
+            json=patch_data,
+            headers=get_headers_for_executive_producer()
+        )
+        data = loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertNotIn('error', data)
+        movie = data['movie']
+        self.assertEqual(
+            movie,
+            {
+                'id': id,
+                'title': expected_title,
+                'description': expected_description
+            }
+        )
 
     def test_update_movie_error_404(self):
         """Tests an error while updating a movie"""
@@ -560,6 +1518,297 @@ class CastingAgencyTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 404)
         self.assertEqual(data['success'], False)
 
+    #  ------------------------------------------------------------------------
+    #  Bulk endpoints
+    #  ------------------------------------------------------------------------
+    def test_create_actors_bulk(self):
+        """Tests creating a batch of actors"""
+        post_data = {
+            'actors': [
+                {'name': 'Tommy Wiseau', 'birthdate': '1955-11-22'},
+                {'name': 'Greg Sestero', 'birthdate': '1978-07-15'},
+            ]
+        }
+        res = self.client().post(
+            '/actors/bulk',
+            json=post_data,
+            headers=get_headers_for_executive_producer()
+        )
+        data = loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(len(data['created']), 2)
+
+        res = self.client().get(
+            '/actors',
+            headers=get_headers_for_executive_producer()
+        )
+        names = [actor['name'] for actor in loads(res.data)['actors']]
+        self.assertEqual(names, ['Tommy Wiseau', 'Greg Sestero'])
+
+    def test_create_actors_bulk_422(self):
+        """Tests that an invalid batch reports per-item errors atomically"""
+        post_data = {
+            'actors': [
+                {'name': 'Tommy Wiseau', 'birthdate': '1955-11-22'},
+                {'name': 'Greg Sestero'},
+                {'name': 'Juliette Danielle', 'birthdate': 'yesterday'},
+            ]
+        }
+        res = self.client().post(
+            '/actors/bulk',
+            json=post_data,
+            headers=get_headers_for_executive_producer()
+        )
+        data = loads(res.data)
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(
+            [error['index'] for error in data['errors']], [1, 2])
+
+        res = self.client().get(
+            '/actors',
+            headers=get_headers_for_executive_producer()
+        )
+        self.assertEqual(loads(res.data)['actors'], [])
+
+    def test_update_movies_bulk(self):
+        """Tests updating a batch of movies"""
+        with self.app.app_context():
+            movies = MovieFactory.create_batch(3)
+            db.session.commit()
+            ids = [movie.id for movie in movies]
+
+        patch_data = {
+            'movies': [
+                {'id': ids[0], 'title': 'The Room'},
+                {'id': ids[2], 'description': 'A new description.'},
+            ]
+        }
+        res = self.client().patch(
+            '/movies/bulk',
+            json=patch_data,
+            headers=get_headers_for_executive_producer()
+        )
+        data = loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['updated'], [ids[0], ids[2]])
+
+        res = self.client().get(
+            f'/movies/{ids[0]}',
+            headers=get_headers_for_executive_producer()
+        )
+        self.assertEqual(loads(res.data)['movie']['title'], 'The Room')
+
+    def test_delete_actors_bulk(self):
+        """Tests removing a batch of actors, rejecting unknown ids"""
+        with self.app.app_context():
+            actors = ActorFactory.create_batch(3)
+            db.session.commit()
+            ids = [actor.id for actor in actors]
+
+        res = self.client().delete(
+            '/actors/bulk',
+            json={'ids': [ids[0], ids[2] + 100]},
+            headers=get_headers_for_executive_producer()
+        )
+        data = loads(res.data)
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['errors'][0]['id'], ids[2] + 100)
+
+        res = self.client().delete(
+            '/actors/bulk',
+            json={'ids': ids[:2]},
+            headers=get_headers_for_executive_producer()
+        )
+        data = loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['removed'], ids[:2])
+
+        res = self.client().get(
+            '/actors',
+            headers=get_headers_for_executive_producer()
+        )
+        remaining = [actor['id'] for actor in loads(res.data)['actors']]
+        self.assertEqual(remaining, [ids[2]])
+
+    #  ------------------------------------------------------------------------
+    #  Castings
+    #  ------------------------------------------------------------------------
+    def test_include_castings(self):
+        """Tests casting actors in movies and embedding them in reads"""
+        with self.app.app_context():
+            movie = MovieFactory.create()
+            actors = ActorFactory.create_batch(2)
+            db.session.commit()
+            movie_id = movie.id
+            actor_ids = [actor.id for actor in actors]
+
+        headers = get_headers_for_executive_producer()
+        res = self.client().get(
+            f'/movies/{movie_id}?include=actors', headers=headers)
+        self.assertEqual(loads(res.data)['movie']['actors'], [])
+        etag = res.headers['ETag']
+
+        res = self.client().patch(
+            f'/movies/{movie_id}',
+            json={'actor_ids': actor_ids},
+            headers=headers
+        )
+        self.assertEqual(res.status_code, 200)
+
+        res = self.client().get(
+            f'/movies/{movie_id}?include=actors',
+            headers={**headers, 'If-None-Match': etag})
+        self.assertEqual(res.status_code, 200)
+        movie = loads(res.data)['movie']
+        self.assertEqual(
+            [actor['id'] for actor in movie['actors']], actor_ids)
+        self.assertEqual(set(movie['actors'][0]), {'id', 'name', 'birthdate'})
+
+        res = self.client().get(
+            f'/actors/{actor_ids[0]}?include=movies', headers=headers)
+        movies = loads(res.data)['actor']['movies']
+        self.assertEqual([movie['id'] for movie in movies], [movie_id])
+
+        res = self.client().get(f'/actors/{actor_ids[0]}', headers=headers)
+        self.assertNotIn('movies', loads(res.data)['actor'])
+
+        res = self.client().patch(
+            f'/actors/{actor_ids[0]}',
+            json={'movie_ids': []},
+            headers=headers
+        )
+        self.assertEqual(res.status_code, 200)
+        res = self.client().get(
+            f'/movies/{movie_id}?include=actors', headers=headers)
+        movie = loads(res.data)['movie']
+        self.assertEqual(
+            [actor['id'] for actor in movie['actors']], actor_ids[1:])
+
+        self.client().delete(
+            '/actors/bulk', json={'ids': actor_ids[1:]}, headers=headers)
+        res = self.client().get(
+            f'/movies/{movie_id}?include=actors', headers=headers)
+        self.assertEqual(loads(res.data)['movie']['actors'], [])
+
+    def test_include_castings_errors(self):
+        """Tests that unknown relationships and actors are rejected"""
+        with self.app.app_context():
+            movie = MovieFactory.create()
+            db.session.commit()
+            movie_id = movie.id
+
+        headers = get_headers_for_executive_producer()
+        res = self.client().get(
+            f'/movies/{movie_id}?include=studios', headers=headers)
+        self.assertEqual(res.status_code, 400)
+
+        res = self.client().patch(
+            f'/movies/{movie_id}',
+            json={'actor_ids': [movie_id + 100]},
+            headers=headers
+        )
+        self.assertEqual(res.status_code, 422)
+
+    def test_include_castings_statement_count(self):
+        """Tests that embedding relationships in a page takes a constant
+        number of SQL statements, however many rows it holds"""
+        with self.app.app_context():
+            actors = ActorFactory.create_batch(3)
+            movies = MovieFactory.create_batch(20)
+            for movie in movies:
+                movie.actors = actors
+            db.session.commit()
+            engine = db.engine
+
+        headers = get_headers_for_executive_producer()
+
+        def count_statements(path):
+            statements = []
+
+            def record(conn, cursor, statement, *args):
+                statements.append(statement)
+
+            event.listen(engine, 'before_cursor_execute', record)
+            try:
+                res = self.client().get(path, headers=headers)
+            finally:
+                event.remove(engine, 'before_cursor_execute', record)
+            self.assertEqual(res.status_code, 200)
+            return res, len(statements)
+
+        res, small_page = count_statements('/movies?include=actors&limit=2')
+        self.assertEqual(len(loads(res.data)['movies'][0]['actors']), 3)
+        res, large_page = count_statements('/movies?include=actors&limit=20')
+        self.assertEqual(len(loads(res.data)['movies']), 20)
+        self.assertEqual(small_page, large_page)
+
+        res, _ = count_statements('/movies?include=actors&stream=1')
+        lines = res.get_data(as_text=True).splitlines()
+        self.assertEqual(len(lines), 20)
+        self.assertEqual(len(loads(lines[0])['actors']), 3)
+
+    #  ------------------------------------------------------------------------
+    #  Search
+    #  ------------------------------------------------------------------------
+    def test_search_movies(self):
+        """Tests ranked full-text search over titles and descriptions"""
+        with self.app.app_context():
+            MovieFactory.create(
+                title='Taxi Driver',
+                description='A veteran works the night shift.')
+            MovieFactory.create(
+                title='Con Air',
+                description='A getaway driver is caught on a prison plane.')
+            MovieFactory.create(
+                title='Dawn of the Dead',
+                description='Survivors take refuge in a mall.')
+            db.session.commit()
+
+        headers = get_headers_for_executive_producer()
+        res = self.client().get('/movies/search?q=drivers', headers=headers)
+        data = loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        # title matches outrank description matches
+        self.assertEqual(
+            [movie['title'] for movie in data['movies']],
+            ['Taxi Driver', 'Con Air'])
+        self.assertIsNone(data['next_offset'])
+
+        res = self.client().get(
+            '/movies/search?q=driver&limit=1', headers=headers)
+        self.assertEqual(loads(res.data)['next_offset'], 1)
+
+        res = self.client().get('/movies/search?q=zombies', headers=headers)
+        self.assertEqual(loads(res.data)['movies'], [])
+
+        res = self.client().get('/movies/search?q=', headers=headers)
+        self.assertEqual(res.status_code, 400)
+
+    def test_search_actors(self):
+        """Tests that search follows updates to actors"""
+        with self.app.app_context():
+            actor = ActorFactory.create(name='Nicolas Cage')
+            ActorFactory.create(name='John Travolta')
+            db.session.commit()
+            actor_id = actor.id
+
+        headers = get_headers_for_executive_producer()
+        res = self.client().get(
+            '/actors/search?q=cage&fields=name', headers=headers)
+        self.assertEqual(
+            loads(res.data)['actors'],
+            [{'id': actor_id, 'name': 'Nicolas Cage'}])
+
+        self.client().patch(
+            f'/actors/{actor_id}',
+            json={'name': 'Nicolas Coppola'},
+            headers=headers
+        )
+        res = self.client().get('/actors/search?q=cage', headers=headers)
+        self.assertEqual(loads(res.data)['actors'], [])
+
     #  ------------------------------------------------------------------------
     #  RBAC tests
     #  ------------------------------------------------------------------------
@@ -694,6 +1943,654 @@ class CastingAgencyTestCase(unittest.TestCase):
         self.assertEqual(delete_res.status_code, 401)
 
 
+class JWKSKeyStoreTestCase(unittest.TestCase):
+    """Tests the JWKS key store against a local stand-in JWKS server"""
+    @classmethod
+    def setUpClass(cls):
+        cls.signing_key = SigningKey('test-key-1')
+        cls.rotated_key = SigningKey('test-key-2')
+
+    def setUp(self):
+        self.server = StubJWKSServer([self.signing_key]).start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def get_store(self, **kwargs):
+        options = {
+            'url': self.server.url,
+            'ttl': 600,
+            'stale_ttl': 3600,
+            'min_refresh_interval': 30,
+            'min_ttl': 0,
+            'background': False,
+        }
+        options.update(kwargs)
+        return JWKSKeyStore(**options)
+
+    def test_keys_are_cached(self):
+        """Tests that repeat lookups are served without refetching"""
+        store = self.get_store()
+        for _ in range(5):
+            key = store.get_key(self.signing_key.kid)
+            self.assertEqual(key['kid'], self.signing_key.kid)
+        self.assertEqual(self.server.requests, 1)
+        stats = store.stats()
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hits'], 4)
+        self.assertEqual(stats['refreshes'], 1)
+
+    def test_cache_control_max_age(self):
+        """Tests that the provider's max-age overrides the default ttl"""
+        self.server.cache_control = 'public, max-age=3600'
+        store = self.get_store(ttl=0)
+        store.get_key(self.signing_key.kid)
+        store.get_key(self.signing_key.kid)
+        self.assertEqual(self.server.requests, 1)
+
+        self.server.cache_control = 'max-age=0'
+        store = self.get_store(ttl=3600)
+        store.get_key(self.signing_key.kid)
+        store.get_key(self.signing_key.kid)
+        self.assertEqual(self.server.requests, 3)
+        self.assertEqual(store.stats()['stale_hits'], 1)
+
+    def test_min_ttl(self):
+        """Tests that no-cache key sets are still cached for min_ttl"""
+        self.server.cache_control = 'no-cache'
+        store = self.get_store(ttl=600, min_ttl=5)
+        for _ in range(5):
+            store.get_key(self.signing_key.kid)
+        self.assertEqual(self.server.requests, 1)
+        self.assertEqual(store.stats()['hits'], 4)
+
+        # once stale, a failing provider is retried once per min_ttl
+        store = self.get_store(ttl=0, min_ttl=5)
+        store.get_key(self.signing_key.kid)
+        store._expires_at = time.monotonic() - 1
+        self.server.fail = True
+        for _ in range(5):
+            store.get_key(self.signing_key.kid)
+        self.assertEqual(store.stats()['stale_hits'], 5)
+        self.assertEqual(store.stats()['refresh_errors'], 0)
+        store._attempted_at -= 5
+        store.get_key(self.signing_key.kid)
+        self.assertEqual(store.stats()['refresh_errors'], 1)
+
+    def test_unknown_kid_forces_single_refresh(self):
+        """Tests that a rotated key is picked up, without refetch storms"""
+        store = self.get_store(min_refresh_interval=0)
+        store.get_key(self.signing_key.kid)
+        self.server.keys.append(self.rotated_key)
+        key = store.get_key(self.rotated_key.kid)
+        self.assertEqual(key['kid'], self.rotated_key.kid)
+        self.assertEqual(self.server.requests, 2)
+
+        store = self.get_store(min_refresh_interval=30)
+        store.get_key(self.signing_key.kid)
+        for _ in range(5):
+            self.assertIsNone(store.get_key('unknown-kid'))
+        self.assertEqual(self.server.requests, 3)
+
+    def test_stale_while_revalidate(self):
+        """Tests that stale keys are served while a slow provider refreshes"""
+        store = self.get_store(ttl=0, background=True)
+        store.get_key(self.signing_key.kid)
+        self.server.delay = 1
+        started = time.monotonic()
+        key = store.get_key(self.signing_key.kid)
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertEqual(key['kid'], self.signing_key.kid)
+        self.assertEqual(store.stats()['stale_hits'], 1)
+
+    def test_provider_errors_keep_serving_cached_keys(self):
+        """Tests that an unavailable provider doesn't drop known keys"""
+        store = self.get_store(ttl=0, stale_ttl=0)
+        store.get_key(self.signing_key.kid)
+        self.server.fail = True
+        key = store.get_key(self.signing_key.kid)
+        self.assertEqual(key['kid'], self.signing_key.kid)
+        self.assertEqual(store.stats()['refresh_errors'], 1)
+
+
+class VerifiedTokenCacheTestCase(unittest.TestCase):
+    """Tests the LRU cache of verified tokens"""
+    def get_payload(self, expires_in=3600):
+        return {'sub': 'auth0|test', 'exp': time.time() + expires_in}
+
+    def test_cached_payload_is_returned(self):
+        """Tests that a verified token is served from the cache"""
+        cache = VerifiedTokenCache(max_size=10, max_ttl=300)
+        payload = self.get_payload()
+        self.assertIsNone(cache.get('token'))
+        cache.put('token', payload)
+        self.assertIs(cache.get('token'), payload)
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_tokens_are_evicted_at_expiry(self):
+        """Tests that a token is never served past its exp claim"""
+        cache = VerifiedTokenCache(max_size=10, max_ttl=300)
+        cache.put('token', self.get_payload(expires_in=-1))
+        self.assertIsNone(cache.get('token'))
+        self.assertEqual(cache.stats()['expired'], 1)
+
+    def test_least_recently_used_are_evicted(self):
+        """Tests that the cache stays bounded"""
+        cache = VerifiedTokenCache(max_size=2, max_ttl=300)
+        cache.put('first', self.get_payload())
+        cache.put('second', self.get_payload())
+        cache.get('first')
+        cache.put('third', self.get_payload())
+        self.assertIsNotNone(cache.get('first'))
+        self.assertIsNone(cache.get('second'))
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+
+class PermissionsTestCase(unittest.TestCase):
+    """Tests permission checks on precomputed claims"""
+    def setUp(self):
+        self.claims = Claims({
+            'sub': 'auth0|test',
+            'exp': time.time() + 3600,
+            'permissions': ['get:actors', 'get:movies'],
+        })
+
+    def tearDown(self):
+        token_cache.clear()
+
+    def call_with_claims(self, view):
+        """Calls a decorated view with cached claims for a fake token"""
+        token_cache.put('precomputed', self.claims)
+        app = Flask(__name__)
+        headers = {'Authorization': 'Bearer precomputed'}
+        with app.test_request_context('/', headers=headers):
+            return view()
+
+    def test_check_permissions(self):
+        """Tests single, all and any permission checks"""
+        self.assertTrue(check_permissions('get:actors', self.claims))
+        self.assertTrue(check_permissions(
+            ['get:actors', 'get:movies'], self.claims))
+        self.assertTrue(check_permissions(
+            ['post:actors', 'get:movies'], self.claims, match='any'))
+        with self.assertRaises(AuthError) as context:
+            check_permissions(['post:actors', 'get:movies'], self.claims)
+        self.assertEqual(context.exception.status_code, 401)
+
+    def test_check_permissions_malformed(self):
+        """Tests that a token without permissions is rejected"""
+        with self.assertRaises(AuthError) as context:
+            check_permissions('get:actors', Claims({'sub': 'auth0|test'}))
+        self.assertEqual(context.exception.status_code, 400)
+
+    def test_requires_auth_multiple_permissions(self):
+        """Tests that routes can require all or any of several permissions"""
+        @requires_auth(permissions=['get:actors', 'get:movies'])
+        def read_all(payload):
+            return payload['sub']
+
+        @requires_auth(permissions=['post:actors', 'get:movies'], match='any')
+        def read_any(payload):
+            return payload['sub']
+
+        @requires_auth(permissions=['post:actors', 'get:movies'])
+        def write(payload):
+            return payload['sub']
+
+        self.assertEqual(self.call_with_claims(read_all), 'auth0|test')
+        self.assertEqual(self.call_with_claims(read_any), 'auth0|test')
+        with self.assertRaises(AuthError) as context:
+            self.call_with_claims(write)
+        self.assertEqual(context.exception.status_code, 401)
+
+
+class SQLiteTestCase(unittest.TestCase):
+    """Base of the tests run on local SQLite databases, kept in a temporary
+    directory removed after each test"""
+    db_name = 'test.db'
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.db_path = self.get_db_path(self.db_name)
+        cache.entity_cache.clear()
+        router.clear()
+        self.addCleanup(router.clear)
+
+    def get_db_path(self, name: str):
+        return f"sqlite:///{os.path.join(self.directory, name)}"
+
+    def create_app(self, **env):
+        """Returns an app on a new schema, with the given env vars"""
+        app = Flask(__name__)
+        with mock.patch.dict(os.environ, env):
+            init_app(app, db_path=self.db_path, drop_db=True)
+        return app
+
+
+class ReplicaRoutingTestCase(SQLiteTestCase):
+    """Tests read replica routing with two local SQLite databases"""
+    db_name = 'primary.db'
+
+    def setUp(self):
+        super().setUp()
+        app = self.create_app(
+            DB_REPLICA_URLS=self.get_db_path('replica.db'))
+
+        # the same schema on both, with rows telling them apart
+        with app.app_context():
+            self.replica = db.engines['replica_0']
+            db.metadata.create_all(self.replica)
+            db.session.execute(
+                Movie.__table__.insert(),
+                {'title': 'From primary', 'description': ''})
+            db.session.commit()
+            with self.replica.begin() as connection:
+                connection.execute(
+                    Movie.__table__.insert(),
+                    {'title': 'From replica', 'description': ''})
+
+        self.app = app
+        self.client = self.app.test_client
+
+    def get_titles(self, headers=None):
+        headers = {**get_headers_for_executive_producer(), **(headers or {})}
+        res = self.client().get('/movies', headers=headers)
+        self.assertEqual(res.status_code, 200)
+        return [movie['title'] for movie in loads(res.data)['movies']]
+
+    def test_reads_go_to_replica(self):
+        """Tests that read-only requests are served by the replica"""
+        self.assertEqual(self.get_titles(), ['From replica'])
+        self.assertEqual(router.stats()['replica_reads'], 1)
+
+    def test_read_your_writes(self):
+        """Tests that writers read from the primary"""
+        self.assertEqual(
+            self.get_titles({'X-Read-Your-Writes': 'true'}),
+            ['From primary'])
+
+        res = self.client().post(
+            '/movies',
+            json={'title': 'Written', 'description': ''},
+            headers=get_headers_for_executive_producer()
+        )
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(self.get_titles(), ['From primary', 'Written'])
+
+    def test_fallback_to_primary(self):
+        """Tests that reads fall back to the primary when a replica fails"""
+        with self.replica.begin() as connection:
+            connection.exec_driver_sql('DROP TABLE movies')
+        self.assertEqual(self.get_titles(), ['From primary'])
+        self.assertEqual(router.stats()['fallbacks'], 1)
+        self.assertEqual(router.stats()['down'], ['replica_0'])
+        # the failed replica is skipped until it's retried
+        self.assertEqual(self.get_titles(), ['From primary'])
+        self.assertEqual(router.stats()['fallbacks'], 1)
+
+    def test_cache_after_write(self):
+        """Tests that rows read from a lagging replica aren't cached"""
+        def get_title(headers):
+            res = self.client().get('/movies/1', headers=headers)
+            self.assertEqual(res.status_code, 200)
+            return loads(res.data)['movie']['title']
+
+        writer = get_headers_for_executive_producer()
+        reader = get_headers_for_casting_assistant()
+        res = self.client().patch(
+            '/movies/1', json={'title': 'Patched'}, headers=writer)
+        self.assertEqual(res.status_code, 200)
+
+        # the replica hasn't caught up yet
+        self.assertEqual(get_title(reader), 'From replica')
+        self.assertIsNone(cache.entity_cache.get('movies:1'))
+        self.assertEqual(get_title(writer), 'Patched')
+        self.assertEqual(
+            get_title({**reader, 'X-Read-Your-Writes': 'true'}), 'Patched')
+
+        with self.replica.begin() as connection:
+            connection.execute(
+                Movie.__table__.update().values(title='Patched'))
+        self.assertEqual(get_title(reader), 'Patched')
+
+
+class LocalRedis():
+    """A Redis-compatible stand-in, implementing what RedisCache and
+    RedisBuckets use. Being single threaded, it is its own pipeline"""
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        value, expires_at = self.values.get(key, (None, 0))
+        return value if time.monotonic() < expires_at else None
+
+    def set(self, key, value, ex=None, px=None):
+        ttl = ex if px is None else px / 1000
+        self.values[key] = (value, time.monotonic() + ttl)
+
+    def transaction(self, func, *watches, value_from_callable=False):
+        value = func(self)
+        return value if value_from_callable else None
+
+    def multi(self):
+        pass
+
+    def delete(self, *keys):
+        for key in keys:
+            self.values.pop(key, None)
+
+    def scan_iter(self, match):
+        return [key for key in self.values if key.startswith(match[:-1])]
+
+
+class DatabaseInitTestCase(SQLiteTestCase):
+    """Tests how the schema is created, on a local SQLite database"""
+    db_name = 'init.db'
+
+    def boot(self, **env):
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        app = Flask(__name__)
+        event.listen(Engine, 'before_cursor_execute', record)
+        try:
+            with mock.patch.dict(os.environ, env):
+                init_app(app, db_path=self.db_path)
+        finally:
+            event.remove(Engine, 'before_cursor_execute', record)
+        return app, statements
+
+    def get_tables(self, app):
+        with app.app_context():
+            return set(inspect(db.engine).get_table_names())
+
+    def test_boot_leaves_schema_alone(self):
+        app, statements = self.boot()
+        self.assertEqual(statements, [])
+        self.assertEqual(self.get_tables(app), set())
+
+    def test_lazy_init(self):
+        app, statements = self.boot(DB_INIT='lazy')
+        self.assertEqual(statements, [])
+        res = app.test_client().get('/healthcheck')
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('actors', self.get_tables(app))
+
+    def test_create_db_command(self):
+        app, _ = self.boot()
+        result = app.test_cli_runner().invoke(args=['create-db'])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertTrue(
+            {'actors', 'movies', 'castings', 'alembic_version'}
+            <= self.get_tables(app))
+        with app.app_context():
+            revision = db.session.execute(
+                text('SELECT version_num FROM alembic_version')).scalar()
+        heads = ScriptDirectory.from_config(
+            app.extensions['migrate'].migrate.get_config()).get_heads()
+        self.assertEqual([revision], heads)
+
+
+def has_modules(*names):
+    try:
+        for name in names:
+            importlib.import_module(name)
+    except ImportError:
+        return False
+    return True
+
+
+@unittest.skipUnless(
+    has_modules('asgiref', 'aiosqlite'), 'requires asgiref and aiosqlite')
+class AsyncAppTestCase(SQLiteTestCase):
+    """Tests the ASGI app against the Flask app, on a local SQLite database"""
+    db_name = 'async.db'
+
+    def setUp(self):
+        from sqlalchemy.ext.asyncio import create_async_engine
+        from asgi import AsyncApp, get_async_db_url
+
+        super().setUp()
+        app = self.create_app()
+        with app.app_context():
+            for name in ('Cher', 'Anna', 'Bea'):
+                ActorFactory.create(name=name, birthdate=date(1990, 1, 1))
+            db.session.commit()
+        self.app = app
+        self.loop = asyncio.new_event_loop()
+        self.asgi_app = AsyncApp(
+            app, create_async_engine(get_async_db_url(self.db_path)))
+
+    def tearDown(self):
+        self.loop.run_until_complete(self.asgi_app.engine.dispose())
+        self.loop.close()
+
+    def get(self, path: str, headers: dict):
+        """Returns the status, headers and body of an ASGI GET request"""
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+
+        path, _, query_string = path.partition('?')
+        self.loop.run_until_complete(self.asgi_app({
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': 'GET',
+            'scheme': 'http',
+            'path': path,
+            'raw_path': path.encode(),
+            'query_string': query_string.encode(),
+            'root_path': '',
+            'headers': [
+                (name.lower().encode(), value.encode())
+                for name, value in headers.items()
+            ],
+            'client': ('127.0.0.1', 0),
+            'server': ('localhost', 80),
+        }, receive, send))
+        start = messages[0]
+        headers = {
+            name.decode(): value.decode()
+            for name, value in start['headers']}
+        body = b''.join(message.get('body', b'') for message in messages[1:])
+        return start['status'], headers, body
+
+    def test_native_reads_match_flask(self):
+        headers = get_headers_for_executive_producer()
+        client = self.app.test_client()
+        for path in ('/actors?sort=name&limit=2', '/actors/2?fields=name'):
+            status, async_headers, body = self.get(path, headers)
+            res = client.get(path, headers=headers)
+            self.assertEqual(status, res.status_code)
+            self.assertEqual(loads(body), loads(res.data))
+            self.assertEqual(async_headers['etag'], res.headers['ETag'])
+
+        status, _, body = self.get('/actors/100', headers)
+        self.assertEqual(status, 404)
+        status, _, body = self.get('/actors?cursor=bad', headers)
+        self.assertEqual(status, 400)
+        status, _, body = self.get('/actors', {})
+        self.assertEqual(status, 401)
+        self.assertEqual(loads(body)['success'], False)
+
+    def test_other_requests_go_to_flask(self):
+        headers = get_headers_for_executive_producer()
+        status, _, body = self.get('/actors?include=movies', headers)
+        self.assertEqual(status, 200)
+        self.assertEqual(loads(body)['actors'][0]['movies'], [])
+        status, _, body = self.get('/healthcheck', {})
+        self.assertEqual((status, body), (200, b'OK'))
+
+
+class SQLiteSearchTestCase(SQLiteTestCase):
+    """Tests the FTS5 search fallback on a local SQLite database"""
+    db_name = 'search.db'
+
+    def setUp(self):
+        super().setUp()
+        app = self.create_app()
+        with app.app_context():
+            for title, description in (
+                    ('Taxi Driver', 'A veteran works the night shift.'),
+                    ('Con Air', 'A getaway driver is caught on a plane.'),
+                    ('Dawn of the Dead', 'Survivors take refuge in a mall.')):
+                db.session.add(Movie(title=title, description=description))
+            db.session.commit()
+        self.app = app
+        self.client = self.app.test_client
+
+    def search(self, q):
+        res = self.client().get(
+            f'/movies/search?q={q}',
+            headers=get_headers_for_executive_producer())
+        self.assertEqual(res.status_code, 200)
+        return [movie['title'] for movie in loads(res.data)['movies']]
+
+    def test_search(self):
+        """Tests ranked, stemmed and prefix matches"""
+        self.assertEqual(self.search('drivers'), ['Taxi Driver', 'Con Air'])
+        self.assertEqual(self.search('surviv'), ['Dawn of the Dead'])
+        self.assertEqual(self.search('taxi" ('), ['Taxi Driver'])
+        self.assertEqual(self.search('zombies'), [])
+
+    def test_search_follows_writes(self):
+        """Tests that the FTS5 table is kept in sync by its triggers"""
+        headers = get_headers_for_executive_producer()
+        self.client().patch(
+            '/movies/3', json={'title': 'Face/Off'}, headers=headers)
+        self.client().delete('/movies/1', headers=headers)
+        self.assertEqual(self.search('face'), ['Face/Off'])
+        self.assertEqual(self.search('taxi'), [])
+
+
+class EntityCacheTestCase(unittest.TestCase):
+    """Tests the entity cache backends"""
+    def test_lru_cache(self):
+        """Tests expiry and eviction of the in-process cache"""
+        backend = LRUCache(max_size=2)
+        backend.set('movies:1', {'id': 1}, ttl=60)
+        backend.set('movies:2', {'id': 2}, ttl=0.01)
+        self.assertEqual(backend.get('movies:1'), {'id': 1})
+        time.sleep(0.02)
+        self.assertIsNone(backend.get('movies:2'))
+        backend.set('movies:3', {'id': 3}, ttl=60)
+        backend.set('movies:4', {'id': 4}, ttl=60)
+        self.assertIsNone(backend.get('movies:1'))
+        backend.delete('movies:4')
+        self.assertIsNone(backend.get('movies:4'))
+        self.assertEqual(backend.get('movies:3'), {'id': 3})
+
+    def test_redis_cache(self):
+        """Tests the shared backend against a local Redis stand-in"""
+        backend = RedisCache(LocalRedis())
+        birthdate = datetime(1937, 6, 1).date()
+        backend.set('actors:1', {'id': 1, 'birthdate': birthdate}, ttl=60)
+        self.assertEqual(
+            backend.get('actors:1'), {'id': 1, 'birthdate': birthdate})
+        backend.delete('actors:1')
+        self.assertIsNone(backend.get('actors:1'))
+        backend.set('actors:2', {'id': 2}, ttl=60)
+        backend.clear()
+        self.assertIsNone(backend.get('actors:2'))
+
+
+class RateLimitTestCase(unittest.TestCase):
+    """Tests the rate limiter backends"""
+    def test_buckets(self):
+        """Tests bursts and refills, in process and on a Redis stand-in"""
+        for backend in (LocalBuckets(), RedisBuckets(LocalRedis())):
+            self.assertEqual(backend.take('read:a', rate=20, burst=2), 0)
+            self.assertEqual(backend.take('read:a', rate=20, burst=2), 0)
+            wait = backend.take('read:a', rate=20, burst=2)
+            self.assertGreater(wait, 0)
+            self.assertLessEqual(wait, 0.05)
+            self.assertEqual(backend.take('read:b', rate=20, burst=2), 0)
+            time.sleep(wait)
+            self.assertEqual(backend.take('read:a', rate=20, burst=2), 0)
+            backend.clear()
+            self.assertEqual(backend.take('read:a', rate=1, burst=1), 0)
+
+    def test_tiers(self):
+        """Tests that tokens with a write permission get the write tier"""
+        self.assertEqual(get_tier(frozenset(['get:movies'])), 'read')
+        self.assertEqual(get_tier(frozenset()), 'read')
+        self.assertEqual(
+            get_tier(frozenset(['get:movies', 'patch:movies'])), 'write')
+
+
+class SingleFlightTestCase(unittest.TestCase):
+    """Tests the coalescing of concurrent calls"""
+    def run_concurrently(self, flights, fn, callers=4):
+        """Calls fn through flights from several threads at once, returns
+        their results or exceptions"""
+        results = []
+        started = threading.Barrier(callers)
+
+        def call():
+            started.wait()
+            try:
+                results.append(flights.do('key', fn))
+            except Exception as e:
+                results.append(e)
+
+        threads = [threading.Thread(target=call) for _ in range(callers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_shared_result(self):
+        """Tests that concurrent callers share one call and its result"""
+        flights = SingleFlight()
+        release = threading.Event()
+        calls = []
+
+        def fn():
+            calls.append(1)
+            # hold the call until every caller joined it
+            release.wait()
+            return object()
+
+        def release_when_joined():
+            while flights.stats()['calls'] < 4:
+                time.sleep(0.001)
+            release.set()
+
+        threading.Thread(target=release_when_joined).start()
+        results = self.run_concurrently(flights, fn)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(set(map(id, results))), 1)
+        self.assertEqual(flights.stats()['collapse_ratio'], 0.75)
+
+        # once returned, the next call runs anew
+        release.set()
+        self.assertIsNot(flights.do('key', fn), results[0])
+        self.assertEqual(len(calls), 2)
+
+    def test_shared_error(self):
+        """Tests that the callers joining a failing call get its error"""
+        flights = SingleFlight()
+        error = ValueError('failed')
+
+        def fn():
+            while flights.stats()['calls'] < 4:
+                time.sleep(0.001)
+            raise error
+
+        self.assertEqual(self.run_concurrently(flights, fn), [error] * 4)
+        self.assertEqual(flights.stats()['in_flight'], 0)
+
+
 # Make the tests conveniently executable
 if __name__ == "__main__":
     unittest.main()
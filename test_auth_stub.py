@@ -0,0 +1,170 @@
+import json
+import os
+import threading
+import time
+from base64 import urlsafe_b64encode
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jose import jwk, jwt
+
+
+ALL_PERMISSIONS = [
+    'delete:actors',
+    'delete:movies',
+    'get:actors',
+    'get:movies',
+    'patch:actors',
+    'patch:movies',
+    'post:actors',
+    'post:movies',
+]
+
+
+def b64_uint(value: int):
+    """Encodes an unsigned int as unpadded base64url, as used in JWKs"""
+    raw = value.to_bytes((value.bit_length() + 7) // 8, 'big')
+    return urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+
+class SigningKey():
+    """A locally generated RSA key pair standing in for an Auth0 signing key"""
+
+    def __init__(self, kid: str):
+        self.kid = kid
+        self.private_key = rsa.generate_private_key(
+            public_exponent=65537,
+            key_size=2048,
+        )
+        self.private_pem = self.private_key.private_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PrivateFormat.PKCS8,
+            encryption_algorithm=serialization.NoEncryption(),
+        ).decode('ascii')
+        # parsed once: parsing the PEM dominates the cost of signing
+        self.jose_key = jwk.construct(self.private_pem, 'RS256')
+
+    def jwk(self):
+        numbers = self.private_key.public_key().public_numbers()
+        return {
+            'kty': 'RSA',
+            'kid': self.kid,
+            'use': 'sig',
+            'alg': 'RS256',
+            'n': b64_uint(numbers.n),
+            'e': b64_uint(numbers.e),
+        }
+
+    def mint(self, claims: dict):
+        return jwt.encode(
+            claims,
+            self.jose_key,
+            algorithm='RS256',
+            headers={'kid': self.kid},
+        )
+
+
+class StubJWKSServer():
+    """A local stand-in for the Auth0 `/.well-known/jwks.json` endpoint.
+
+    Serves the JWKS for `keys`, counts the requests it receives and can be
+    made slow (`delay`) or unavailable (`fail`) to exercise caching paths.
+    """
+
+    def __init__(self, keys: list[SigningKey], cache_control: str = None):
+        self.keys = list(keys)
+        self.cache_control = cache_control
+        self.delay = 0
+        self.fail = False
+        self.requests = 0
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.requests += 1
+                if stub.delay:
+                    time.sleep(stub.delay)
+                if stub.fail:
+                    self.send_response(503)
+                    self.end_headers()
+                    return
+                body = json.dumps(
+                    {'keys': [key.jwk() for key in stub.keys]}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                if stub.cache_control:
+                    self.send_header('Cache-Control', stub.cache_control)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        # polled often, so that stop() doesn't wait out the default 0.5s
+        self.thread = threading.Thread(
+            target=self.server.serve_forever,
+            kwargs={'poll_interval': 0.01},
+            daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return f'http://{host}:{port}/.well-known/jwks.json'
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class OfflineAuth():
+    """Serves a local JWKS, points the app at it and mints tokens it can
+    verify, so nothing reaches Auth0"""
+
+    def __init__(self, name: str = 'benchmark'):
+        self.name = name
+        self.signing_key = SigningKey(name)
+        self.server = StubJWKSServer([self.signing_key])
+        self.environ = {}
+
+    def __enter__(self):
+        self.server.start()
+        self.environ = {
+            name: os.environ.get(name)
+            for name in ('JWKS_URL', 'AUTH0_DOMAIN', 'API_AUDIENCE')
+        }
+        os.environ['JWKS_URL'] = self.server.url
+        os.environ.setdefault('AUTH0_DOMAIN', f'{self.name}.local')
+        os.environ.setdefault('API_AUDIENCE', 'http://localhost:9876')
+        return self
+
+    def __exit__(self, *args):
+        self.server.stop()
+        for name, value in self.environ.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+    def mint(self, permissions=ALL_PERMISSIONS, subject: str = None,
+             expires_in: int = 3600):
+        now = int(time.time())
+        return self.signing_key.mint({
+            'iss': f"https://{os.environ['AUTH0_DOMAIN']}/",
+            'sub': subject or f'auth0|{self.name}',
+            'aud': os.environ['API_AUDIENCE'],
+            'iat': now,
+            'exp': now + expires_in,
+            'permissions': list(permissions),
+        })
+
+    def headers(self, permissions=ALL_PERMISSIONS, subject: str = None,
+                expires_in: int = 3600):
+        token = self.mint(permissions, subject, expires_in)
+        return {'Authorization': f'Bearer {token}'}
@@ -2,15 +2,23 @@ import factory
 from models import Actor, Movie
 from db import db
 
+
+def get_session():
+  """Returns the current session, looked up on every create since the
+  tests swap it (see test_app)"""
+  return db.session
+
+
 class ActorFactory(factory.alchemy.SQLAlchemyModelFactory):
   """Factory for generating mocked Actor instances for testing"""
 
   class Meta:
     model = Actor
-    sqlalchemy_session = db.session
+    sqlalchemy_session = None
+    sqlalchemy_session_factory = get_session
 
   name = factory.Faker('name')
-  birthdate = factory.Faker('date')
+  birthdate = factory.Faker('date_object')
 
 
 class MovieFactory(factory.alchemy.SQLAlchemyModelFactory):
@@ -18,7 +26,8 @@ class MovieFactory(factory.alchemy.SQLAlchemyModelFactory):
   """Factory for generating mocked Movie instances for testing"""
   class Meta:
     model = Movie
-    sqlalchemy_session = db.session
+    sqlalchemy_session = None
+    sqlalchemy_session_factory = get_session
 
   title = factory.Faker('sentence', nb_words=3)
   description = factory.Faker('sentence')
@@ -0,0 +1,79 @@
+import threading
+import time
+from collections import OrderedDict
+from hashlib import sha256
+from os import getenv
+
+
+class VerifiedTokenCache():
+    """Bounded LRU cache of bearer tokens whose signature was already verified.
+
+    Entries are keyed by a sha256 digest of the raw token (the token itself is
+    never stored) and hold the decoded payload until the token's `exp` claim,
+    capped at `max_ttl` seconds so revoked signing keys eventually take effect.
+    """
+
+    def __init__(self, max_size: int = None, max_ttl: float = None):
+        self.max_size = max_size if max_size is not None else int(
+            getenv('TOKEN_CACHE_SIZE', 1024))
+        self.max_ttl = max_ttl if max_ttl is not None else float(
+            getenv('TOKEN_CACHE_MAX_TTL', 300))
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {
+            'hits': 0,
+            'misses': 0,
+            'expired': 0,
+            'evictions': 0,
+        }
+
+    @staticmethod
+    def _key(token: str):
+        return sha256(token.encode('utf-8')).digest()
+
+    def get(self, token: str):
+        """Returns the cached payload for the token, or None"""
+        if self.max_size <= 0:
+            return None
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._counters['misses'] += 1
+                return None
+            expires_at, payload = entry
+            if time.time() >= expires_at:
+                del self._entries[key]
+                self._counters['expired'] += 1
+                self._counters['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._counters['hits'] += 1
+            return payload
+
+    def put(self, token: str, payload: dict):
+        """Caches a verified payload until its expiry"""
+        if self.max_size <= 0 or 'exp' not in payload:
+            return
+        expires_at = min(float(payload['exp']), time.time() + self.max_ttl)
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = (expires_at, payload)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._counters['evictions'] += 1
+
+    def stats(self):
+        """Returns a snapshot of the cache counters"""
+        return {**self._counters, 'size': len(self._entries)}
+
+    def clear(self):
+        """Drops all cached tokens and resets the counters"""
+        with self._lock:
+            self._entries.clear()
+            for counter in self._counters:
+                self._counters[counter] = 0
+
+
+token_cache = VerifiedTokenCache()